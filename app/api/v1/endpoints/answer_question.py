@@ -1,7 +1,15 @@
+import json
+import uuid
 import logging
 from typing import Optional
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from app.models.state import initial_app_state
 from app.services.answer_service import AnswerService
+from app.config import settings
+from app.services.session_service import SessionService
+from app.core.retrievers.search_filter import SearchFilter
+from app.repositories.session_repository import SessionRepository
 from app.core.utils.response_handler import success_handler, error_handler
 
 router = APIRouter()
@@ -9,26 +17,114 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def session_repository() -> SessionRepository:
+    return SessionRepository(settings.SESSION_DATABASE_PATH, settings.SESSION_TTL_SECONDS)
+
+
 @router.post("/answer_question")
 async def answer_question(
         payload: dict,
+        background_tasks: BackgroundTasks,
         model_name: Optional[str] = Query("gpt-3.5-turbo"),
-        collection_name: Optional[str] = Query(...)):
+        collection_name: Optional[str] = Query(...),
+        fast: Optional[bool] = Query(None)):
     try:
         query = payload.get("query")
         if not query:
             return error_handler("Query must be provided", status_code=400)
 
-        chat_history = payload.get("chat_history", [])
-        if not chat_history:
-            chat_history = []
+        try:
+            search_filter = SearchFilter.from_payload(payload.get("filter"))
+        except ValueError as e:
+            return error_handler(str(e), status_code=400)
+
+        if not initial_app_state.ready:
+            return error_handler("Application is warming up", status_code=503)
 
         logger.info("Received query: %s", query)
         service = AnswerService(model_name=model_name)
-        result = await service.get_answer(query, chat_history, collection_name)
-        logger.info(f"Result: {result}")
 
-        return success_handler({"message": result}, status_code=200)
+        chat_history = payload.get("chat_history")
+        session_id = payload.get("session_id")
+        if chat_history and not session_id:
+            # stateless clients that still send their own history
+            result = await service.get_answer(query, chat_history, collection_name, fast=fast,
+                                              search_filter=search_filter)
+            logger.debug(f"Result: {result}")
+            return success_handler({"message": result}, status_code=200)
+
+        session_id = session_id or uuid.uuid4().hex
+        session_service = SessionService(service)
+        result = await session_service.answer(query, session_id, collection_name, fast=fast,
+                                              search_filter=search_filter)
+        # the running summary is updated after the response is sent, off the latency path of this turn
+        background_tasks.add_task(session_service.compact, session_id)
+        logger.debug(f"Result: {result}")
+
+        return success_handler({"message": result, "session_id": session_id}, status_code=200)
     except Exception as e:
         logger.error("Error processing data: %s", str(e))
-        return error_handler(e, status_code=500)
\ No newline at end of file
+        return error_handler(e, status_code=500)
+
+
+@router.post("/answer_question_stream")
+async def answer_question_stream(
+        payload: dict,
+        background_tasks: BackgroundTasks,
+        model_name: Optional[str] = Query("gpt-3.5-turbo"),
+        collection_name: Optional[str] = Query(...)):
+    # newline-delimited JSON: {"type": "token", "text": ...} while the answer is generated, then one
+    # {"type": "done", "message": ..., "session_id": ...} or {"type": "error", "message": ...}
+    query = payload.get("query")
+    if not query:
+        return error_handler("Query must be provided", status_code=400)
+
+    try:
+        search_filter = SearchFilter.from_payload(payload.get("filter"))
+    except ValueError as e:
+        return error_handler(str(e), status_code=400)
+
+    if not initial_app_state.ready:
+        return error_handler("Application is warming up", status_code=503)
+
+    logger.info("Received streaming query: %s", query)
+    service = AnswerService(model_name=model_name)
+    chat_history = payload.get("chat_history")
+    session_id = payload.get("session_id")
+    if chat_history and not session_id:
+        chunks = service.stream_answer(query, chat_history, collection_name, search_filter=search_filter)
+    else:
+        session_id = session_id or uuid.uuid4().hex
+        session_service = SessionService(service)
+        chunks = session_service.stream_answer(query, session_id, collection_name, search_filter)
+        # runs once the whole body has been sent
+        background_tasks.add_task(session_service.compact, session_id)
+
+    async def events():
+        parts = []
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield json.dumps({"type": "token", "text": chunk}, ensure_ascii=False) + "\n"
+            yield json.dumps({"type": "done", "message": "".join(parts), "session_id": session_id},
+                             ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error("Error streaming answer: %s", str(e))
+            yield json.dumps({"type": "error", "message": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@router.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = session_repository().get(session_id)
+    if session is None:
+        return error_handler(f"Session not found: {session_id}", status_code=404)
+    return success_handler(session)
+
+
+@router.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not session_repository().delete(session_id):
+        return error_handler(f"Session not found: {session_id}", status_code=404)
+    return success_handler({"message": f"Session {session_id} deleted"})
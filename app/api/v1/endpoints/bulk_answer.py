@@ -0,0 +1,74 @@
+import os
+import re
+import uuid
+import shutil
+import logging
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, Form, Request
+from fastapi.responses import FileResponse
+from app.config import settings
+from app.models.state import AppState
+from app.services.bulk_answer_service import BulkAnswerJob
+from app.core.utils.response_handler import success_handler, error_handler
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# job ids name a directory under BULK_JOB_DIRECTORY, so nothing that could leave it ("..", separators) is accepted
+JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def job_paths(job_id: str):
+    job_directory = os.path.join(settings.BULK_JOB_DIRECTORY, job_id)
+    return job_directory, os.path.join(job_directory, "questions.jsonl"), os.path.join(job_directory, "answers.jsonl")
+
+
+@router.post("/answer_jobs")
+async def create_answer_job(request: Request,
+                            file: Optional[UploadFile] = File(None),
+                            collection_name: str = Form(...),
+                            model_name: str = Form("gpt-3.5-turbo"),
+                            job_id: Optional[str] = Form(None)):
+    app_state: AppState = request.app.state.app_state
+    if not app_state.ready:
+        return error_handler("Application is warming up", status_code=503)
+
+    # passing the id of an earlier job resumes it from its answers file
+    job_id = job_id or uuid.uuid4().hex
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return error_handler("Invalid job_id", status_code=400)
+
+    existing_job = app_state.bulk_jobs.get(job_id)
+    if existing_job is not None and existing_job.status == "running":
+        return error_handler(f"Job {job_id} is already running", status_code=409)
+
+    job_directory, input_path, output_path = job_paths(job_id)
+    if file is not None:
+        os.makedirs(job_directory, exist_ok=True)
+        with open(input_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+    elif not os.path.exists(input_path):
+        return error_handler("A questions file is required for a new job", status_code=400)
+
+    job = BulkAnswerJob(job_id, input_path, output_path, collection_name, app_state, model_name=model_name)
+    app_state.bulk_jobs[job_id] = job
+    job.start()
+    logger.info(f"Started bulk answer job {job_id} for collection {collection_name}")
+    return success_handler(job.to_dict(), status_code=202)
+
+
+@router.get("/answer_jobs/{job_id}")
+async def get_answer_job(job_id: str, request: Request):
+    app_state: AppState = request.app.state.app_state
+    job = app_state.bulk_jobs.get(job_id)
+    if job is None:
+        return error_handler(f"Job not found: {job_id}", status_code=404)
+    return success_handler(job.to_dict())
+
+
+@router.get("/answer_jobs/{job_id}/results")
+async def get_answer_job_results(job_id: str):
+    _, _, output_path = job_paths(job_id)
+    if not JOB_ID_PATTERN.fullmatch(job_id) or not os.path.exists(output_path):
+        return error_handler(f"Results not found: {job_id}", status_code=404)
+    return FileResponse(output_path, media_type="application/x-ndjson", filename=f"{job_id}.jsonl")
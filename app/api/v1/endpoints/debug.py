@@ -0,0 +1,30 @@
+import logging
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.core.utils.tracing import trace_store
+from app.core.utils.response_handler import success_handler, error_handler
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+@router.get("/traces")
+async def list_traces(limit: int = 50):
+    traces = [trace.summary() for trace in trace_store.recent(limit)]
+    return success_handler({"traces": traces})
+
+
+@router.get("/traces/{request_id}")
+async def get_trace(request_id: str):
+    trace = trace_store.get(request_id)
+    if trace is None:
+        return error_handler(f"Trace not found: {request_id}", status_code=404)
+    return success_handler(trace.to_dict())
+
+
+@router.get("/profiles/{request_id}", response_class=PlainTextResponse)
+async def get_profile(request_id: str):
+    trace = trace_store.get(request_id)
+    if trace is None or trace.profile is None:
+        return error_handler(f"Profile not found: {request_id}", status_code=404)
+    return PlainTextResponse(trace.profile)
@@ -1,12 +1,16 @@
+import json
+import asyncio
 import logging
-from typing import List
+from typing import List, Optional, Set
 from app.config import settings
 from app.models.state import initial_app_state
-from fastapi import APIRouter, UploadFile, File, Form
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
 from app.core.utils.common import save_files, is_directory_non_empty
-from app.core.embeddings.initializers import initialize_bm25_retriever
+from app.core.embeddings.initializers import publish_bm25_retriever
 from app.core.utils.response_handler import success_handler, error_handler
-from app.services.ingest_service import process_and_store_vector, process_and_store_text
+from app.services.ingest_service import process_and_store_vector, process_and_store_text, ProgressCallback
+from app.services.document_service import delete_documents, compact_collection
 
 UPLOAD_DIRECTORY = settings.UPLOAD_DIR
 if UPLOAD_DIRECTORY is None:
@@ -16,27 +20,94 @@ router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# streamed ingests still running; the event loop only keeps weak references to tasks
+_ingest_tasks: Set[asyncio.Task] = set()
+
+
+async def run_ingest(file_paths: List[str], collection_name: str,
+                     progress: Optional[ProgressCallback] = None) -> None:
+    await process_and_store_vector(file_paths, collection_name, progress=progress)
+    await process_and_store_text(file_paths, collection_name, progress=progress)
+
+    if is_directory_non_empty(settings.TEXT_REPOSITORY_PATH):
+        bm25_retriever = await publish_bm25_retriever(initial_app_state, collection_name)
+        if bm25_retriever:
+            logger.info("BM25 retriever successfully initialized after data ingestion.")
+        else:
+            logger.error("BM25 retriever initialization failed after data ingestion.")
+    else:
+        logger.error("Text repository path does not contain any files after data ingestion.")
+    if progress:
+        progress("bm25", 1, 1)
+
 
 @router.post("/ingest_data")
 async def ingest_data(files: List[UploadFile] = File(...), collection_name: str = Form(...)):
     try:
         logger.info(f"Starting data ingestion for collection: {collection_name}")
         file_paths = save_files(files, UPLOAD_DIRECTORY)
+        await run_ingest(file_paths, collection_name)
+        return success_handler({"message": "Ingesting data completed"})
+    except Exception as e:
+        logger.error(f"Error processing data: {e}")
+        return error_handler(e, status_code=500)
 
-        # await process_and_store_vector(file_paths, collection_name)
-        # await process_and_store_text(file_paths, collection_name)
 
-        if is_directory_non_empty(settings.TEXT_REPOSITORY_PATH):
-            bm25_retriever = await initialize_bm25_retriever(collection_name, settings.TEXT_REPOSITORY_PATH)
-            if bm25_retriever:
-                initial_app_state.bm25_retriever = bm25_retriever
-                logger.info("BM25 retriever successfully initialized after data ingestion.")
-            else:
-                logger.error("BM25 retriever initialization failed after data ingestion.")
-        else:
-            logger.error("Text repository path does not contain any files after data ingestion.")
+@router.post("/ingest_data_stream")
+async def ingest_data_stream(files: List[UploadFile] = File(...), collection_name: str = Form(...)):
+    # newline-delimited JSON: {"type": "progress", "stage": "vector" | "text" | "bm25", "completed": n,
+    # "total": m} after each step, then {"type": "done", "message": ...} or {"type": "error", "message": ...}
+    logger.info(f"Starting streamed data ingestion for collection: {collection_name}")
+    file_paths = save_files(files, UPLOAD_DIRECTORY)
+    events: asyncio.Queue = asyncio.Queue()
 
-        return success_handler({"message": "Ingesting data completed"})
+    def progress(stage: str, completed: int, total: int) -> None:
+        events.put_nowait({"type": "progress", "stage": stage, "completed": completed, "total": total})
+
+    async def ingest() -> None:
+        try:
+            await run_ingest(file_paths, collection_name, progress=progress)
+            events.put_nowait({"type": "done", "message": "Ingesting data completed"})
+        except Exception as e:
+            logger.error(f"Error processing data: {e}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            events.put_nowait({"type": "error", "message": detail})
+
+    async def stream():
+        # the ingest runs as its own task, so a client that disconnects does not abort it half way
+        task = asyncio.create_task(ingest())
+        _ingest_tasks.add(task)
+        task.add_done_callback(_ingest_tasks.discard)
+        while True:
+            event = await events.get()
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+            if event["type"] != "progress":
+                break
+        await task
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.post("/delete_data")
+async def delete_data(payload: dict, background_tasks: BackgroundTasks):
+    # {"collection_name": ..., "source": file name or list of file names}; the stores are compacted in the
+    # background once enough of the collection is deleted
+    collection_name = payload.get("collection_name")
+    sources = payload.get("source")
+    if isinstance(sources, str):
+        sources = [sources]
+    if not collection_name or not isinstance(sources, list) or not sources \
+            or not all(isinstance(source, str) and source for source in sources):
+        logger.warning("collection_name and source must be provided")
+        return error_handler("collection_name and source (a file name or a list of file names) must be provided",
+                             status_code=400)
+
+    try:
+        logger.info(f"Deleting {sources} from collection: {collection_name}")
+        summary = await delete_documents(collection_name, sources, initial_app_state)
+        if summary["compaction_due"]:
+            background_tasks.add_task(compact_collection, summary["collection_name"], initial_app_state)
+        return success_handler(summary)
     except Exception as e:
-        logger.error(f"Error processing data: {e}")
-        return error_handler(e, status_code=500)
\ No newline at end of file
+        logger.error(f"Error deleting data: {e}")
+        return error_handler(e, status_code=500)
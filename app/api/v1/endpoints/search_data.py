@@ -1,7 +1,9 @@
 import logging
 from app.models.state import AppState
 from fastapi import APIRouter, Request
-from app.services.search_service import SearchService
+from app.config import settings
+from app.services.search_service import SearchService, BatchSearchService
+from app.core.retrievers.search_filter import SearchFilter
 from app.core.utils.response_handler import success_handler, error_handler
 
 router = APIRouter()
@@ -17,15 +19,20 @@ async def search_vector(payload: dict, request: Request):
         logger.warning("Query and collection_name must be provided")
         return error_handler("Query and collection_name must be provided", status_code=400)
 
+    try:
+        search_filter = SearchFilter.from_payload(payload.get("filter"))
+    except ValueError as e:
+        return error_handler(str(e), status_code=400)
+
     logger.info(f"API search_vector called with query: {query} in collection: {collection_name}")
     app_state: AppState = request.app.state.app_state
 
-    if not app_state.bm25_retriever:
-        logger.error("BM25 retriever is not initialized")
-        return error_handler("BM25 retriever is not initialized", status_code=500)
+    if not app_state.ready:
+        logger.warning("Search requested before application warmup completed")
+        return error_handler("Application is warming up", status_code=503)
 
     try:
-        search_service = SearchService(collection_name, query, app_state)
+        search_service = SearchService(collection_name, query, app_state, search_filter)
         result = await search_service.get_relevant_documents()
 
         if result["status"] == "error":
@@ -35,4 +42,45 @@ async def search_vector(payload: dict, request: Request):
         return success_handler(result, status_code=200)
     except Exception as e:
         logger.error(f"Exception in search_vector: {str(e)}", exc_info=True)
-        return error_handler(e, status_code=500)
\ No newline at end of file
+        return error_handler(e, status_code=500)
+
+
+@router.post("/search_batch")
+async def search_batch(payload: dict, request: Request):
+    queries = payload.get("queries")
+    collection_name = payload.get("collection_name")
+    top_k = payload.get("top_k", 8)
+
+    if not queries or not collection_name:
+        logger.warning("Queries and collection_name must be provided")
+        return error_handler("Queries and collection_name must be provided", status_code=400)
+
+    if not isinstance(queries, list) or not all(isinstance(query, str) and query for query in queries):
+        return error_handler("Queries must be a list of non-empty strings", status_code=400)
+
+    if len(queries) > settings.SEARCH_BATCH_MAX_QUERIES:
+        return error_handler(f"At most {settings.SEARCH_BATCH_MAX_QUERIES} queries are allowed per request",
+                             status_code=413)
+
+    if not isinstance(top_k, int) or top_k < 2:
+        return error_handler("top_k must be an integer of at least 2", status_code=400)
+
+    try:
+        search_filter = SearchFilter.from_payload(payload.get("filter"))
+    except ValueError as e:
+        return error_handler(str(e), status_code=400)
+
+    logger.info(f"API search_batch called with {len(queries)} queries in collection: {collection_name}")
+    app_state: AppState = request.app.state.app_state
+
+    if not app_state.ready:
+        logger.warning("Batch search requested before application warmup completed")
+        return error_handler("Application is warming up", status_code=503)
+
+    try:
+        search_service = BatchSearchService(collection_name, queries, app_state, search_filter)
+        result = await search_service.get_relevant_documents(top_k=top_k)
+        return success_handler(result, status_code=200)
+    except Exception as e:
+        logger.error(f"Exception in search_batch: {str(e)}", exc_info=True)
+        return error_handler(e, status_code=500)
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+from app.config import settings
+from app.models.state import initial_app_state
+from app.core.embeddings.initializers import warmup_app_state
+from app.services.bulk_answer_service import BulkAnswerJob
+from app.core.llm.client_pool import close_llm_clients
+
+logger = logging.getLogger(__name__)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    await warmup_app_state(initial_app_state, args.collection, open_vector_store=False)
+    if not initial_app_state.ready:
+        raise RuntimeError(initial_app_state.warmup_error or "Warmup failed")
+
+    job = BulkAnswerJob(
+        job_id=args.job_id or os.path.splitext(os.path.basename(args.output))[0],
+        input_path=args.input,
+        output_path=args.output,
+        collection_name=args.collection,
+        app_state=initial_app_state,
+        model_name=args.model,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        max_attempts=args.max_attempts,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm
+    )
+    try:
+        return await job.run()
+    finally:
+        await close_llm_clients()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Answer every question of a JSONL file; rerunning with the same output resumes the job"
+    )
+    parser.add_argument("--input", required=True, help='JSONL with {"id": ..., "question": ...} per line')
+    parser.add_argument("--output", required=True, help="JSONL the answers are appended to")
+    parser.add_argument("--collection", required=True)
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--job-id")
+    parser.add_argument("--concurrency", type=int, default=settings.BULK_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=settings.BULK_BATCH_SIZE)
+    parser.add_argument("--max-attempts", type=int, default=settings.BULK_MAX_ATTEMPTS)
+    parser.add_argument("--rpm", type=int, default=settings.OPENAI_REQUESTS_PER_MINUTE,
+                        help="requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=settings.OPENAI_TOKENS_PER_MINUTE,
+                        help="tokens-per-minute budget")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    summary = asyncio.run(run(args))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if summary["status"] != "completed" or summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
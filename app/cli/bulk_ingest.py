@@ -0,0 +1,38 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+from app.config import settings
+from app.core.utils.common import validate_collection_name
+from app.services.bulk_ingest_service import BulkIngestJob
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Ingest every PDF under a directory; rerunning with the same checkpoint resumes the backfill"
+    )
+    parser.add_argument("--directory", required=True, help="searched recursively for *.pdf")
+    parser.add_argument("--collection", required=True)
+    parser.add_argument("--checkpoint", help="JSONL of ingested files (default: under BULK_JOB_DIRECTORY)")
+    parser.add_argument("--workers", type=int, default=settings.BULK_INGEST_WORKERS,
+                        help="processes parsing and chunking PDFs")
+    parser.add_argument("--batch-size", type=int, default=settings.BULK_INGEST_BATCH_SIZE,
+                        help="chunks embedded and written together")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    checkpoint = args.checkpoint or os.path.join(
+        settings.BULK_JOB_DIRECTORY, f"ingest_{validate_collection_name(args.collection)}.jsonl"
+    )
+    job = BulkIngestJob(args.directory, args.collection, checkpoint, workers=args.workers,
+                        batch_size=args.batch_size)
+    summary = asyncio.run(job.run())
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import json
+import asyncio
+import logging
+import argparse
+from app.models.state import initial_app_state
+from app.services.document_service import compact_collection
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Rewrite a collection's text and vector stores without its deleted documents"
+    )
+    parser.add_argument("--collection", required=True)
+    parser.add_argument("--force", action="store_true",
+                        help="compact even below COMPACTION_DEAD_RATIO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    summary = asyncio.run(compact_collection(args.collection, initial_app_state, force=args.force))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,9 +12,99 @@ class Settings:
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", 8000))
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
+    # optional OpenAI-compatible endpoint, e.g. the fake server used by the load tests
+    OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "")
+    # pooled LLM clients: per-request timeouts, keep-alive pool size, retries and circuit breaking
+    LLM_TIMEOUT_SECONDS: float = float(os.getenv("LLM_TIMEOUT_SECONDS", 30))
+    LLM_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", 5))
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", 2))
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", 5))
+    LLM_CIRCUIT_RESET_SECONDS: float = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", 30))
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "app/database/pdfs/")
     CHROMA_DIRECTORY: str = os.getenv("CHROMA_DIRECTORY", "app/database/chroma/")
+    # "persistent" opens CHROMA_DIRECTORY in this process; "http" makes every API, worker and ingest process use
+    # one Chroma server, whose writes are coalesced into batches of up to CHROMA_WRITE_BATCH_SIZE chunks
+    CHROMA_MODE: str = os.getenv("CHROMA_MODE", "persistent")
+    CHROMA_HOST: str = os.getenv("CHROMA_HOST", "localhost")
+    CHROMA_PORT: int = int(os.getenv("CHROMA_PORT", 8001))
+    CHROMA_SSL: bool = os.getenv("CHROMA_SSL", "False") == "True"
+    CHROMA_WRITE_BATCH_SIZE: int = int(os.getenv("CHROMA_WRITE_BATCH_SIZE", 256))
+    CHROMA_WRITE_LINGER_MS: float = float(os.getenv("CHROMA_WRITE_LINGER_MS", 20))
+    CHROMA_WRITE_CONCURRENCY: int = int(os.getenv("CHROMA_WRITE_CONCURRENCY", 4))
+    # the collection locks of "http" mode are flocks under TEXT_REPOSITORY_PATH, so every process using the server
+    # must run on one host: that host holds a lease recorded on the server. 0 turns the check off, for a shared
+    # volume whose flock excludes across hosts (NFSv4)
+    CHROMA_HOST_LEASE_SECONDS: float = float(os.getenv("CHROMA_HOST_LEASE_SECONDS", 120))
+    # parsed PDF pages keyed by content hash, shared by both ingest stages and by later re-ingests
+    PAGE_CACHE_PATH: str = os.getenv("PAGE_CACHE_PATH", "app/database/page_cache.sqlite3")
+    PAGE_CACHE_MAX_MB: int = int(os.getenv("PAGE_CACHE_MAX_MB", 512))
+    # OCR for scanned pages (no text layer): render resolution, tesseract languages, pool size (0 runs OCR in the
+    # calling process) and result cache; off unless the tesseract binary and its language data are installed
+    OCR_ENABLED: bool = os.getenv("OCR_ENABLED", "False") == "True"
+    OCR_DPI: int = int(os.getenv("OCR_DPI", 300))
+    OCR_LANGUAGES: str = os.getenv("OCR_LANGUAGES", "kor+eng")
+    OCR_WORKERS: int = int(os.getenv("OCR_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+    OCR_BATCH_SIZE: int = int(os.getenv("OCR_BATCH_SIZE", 8))
+    OCR_CACHE_DIRECTORY: str = os.getenv("OCR_CACHE_DIRECTORY", "app/database/ocr_cache/")
+    # embedding model revision (a Hugging Face commit or tag; empty means the latest) and the persistent
+    # vector cache consulted before every embedding call, bounded in size
+    EMBEDDING_MODEL_REVISION: str = os.getenv("EMBEDDING_MODEL_REVISION", "")
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "True") == "True"
+    EMBEDDING_CACHE_DIRECTORY: str = os.getenv("EMBEDDING_CACHE_DIRECTORY", "app/database/embedding_cache/")
+    EMBEDDING_CACHE_MAX_MB: int = int(os.getenv("EMBEDDING_CACHE_MAX_MB", 1024))
+    # ingest-time near-duplicate removal: MinHash/LSH on chunk text before embedding, then cosine similarity
+    # against the most recent kept chunks and the nearest stored chunk before writing
+    DEDUP_ENABLED: bool = os.getenv("DEDUP_ENABLED", "True") == "True"
+    DEDUP_NUM_PERM: int = int(os.getenv("DEDUP_NUM_PERM", 128))
+    DEDUP_LSH_BANDS: int = int(os.getenv("DEDUP_LSH_BANDS", 16))
+    DEDUP_JACCARD_THRESHOLD: float = float(os.getenv("DEDUP_JACCARD_THRESHOLD", 0.8))
+    DEDUP_COSINE_THRESHOLD: float = float(os.getenv("DEDUP_COSINE_THRESHOLD", 0.98))
+    DEDUP_WINDOW_SIZE: int = int(os.getenv("DEDUP_WINDOW_SIZE", 512))
+    # chunks embedded and written to the vector store per call
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", 64))
     TEXT_REPOSITORY_PATH: str = os.getenv("TEXT_REPOSITORY_PATH", "app/database/textdb/")
+    # deletes leave dead entries behind (tombstoned text lines, unreclaimed vector index space); once this share
+    # of a collection's text store is dead, a delete starts a compaction of both stores in the background
+    COMPACTION_DEAD_RATIO: float = float(os.getenv("COMPACTION_DEAD_RATIO", 0.2))
+    # physical shards (Chroma collections, text files and BM25 indexes) a new collection is split into;
+    # an existing collection keeps the layout recorded in its shard manifest
+    COLLECTION_SHARDS: int = int(os.getenv("COLLECTION_SHARDS", 1))
+    # number of prefork workers started by app.prefork
+    WORKERS: int = int(os.getenv("WORKERS", 1))
+    # how often a worker checks the on-disk generation marker of a collection for changes
+    GENERATION_CHECK_INTERVAL_MS: float = float(os.getenv("GENERATION_CHECK_INTERVAL_MS", 1000))
+    # upper bound on the number of queries accepted by /search_batch in one request
+    SEARCH_BATCH_MAX_QUERIES: int = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", 256))
+    # server-side chat sessions and the share of the prompt their history may take
+    SESSION_DATABASE_PATH: str = os.getenv("SESSION_DATABASE_PATH", "app/database/sessions.sqlite3")
+    SESSION_TTL_SECONDS: float = float(os.getenv("SESSION_TTL_SECONDS", 86400))
+    CHAT_HISTORY_TOKEN_BUDGET: int = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", 1500))
+    # history-aware search query rewrites kept per (conversation history, question)
+    REWRITE_CACHE_SIZE: int = int(os.getenv("REWRITE_CACHE_SIZE", 1024))
+    # answer and follow-up questions in one structured LLM call instead of two sequential calls
+    ANSWER_FAST_MODE: bool = os.getenv("ANSWER_FAST_MODE", "False") == "True"
+    # prompt context assembly: token budget, relevance/diversity trade-off and near-duplicate cutoff
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+    CONTEXT_MMR_LAMBDA: float = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))
+    CONTEXT_DUPLICATE_THRESHOLD: float = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", 0.95))
+    # bulk answer jobs: where their inputs/outputs live and the LLM budget they share
+    BULK_JOB_DIRECTORY: str = os.getenv("BULK_JOB_DIRECTORY", "app/database/bulk_jobs/")
+    BULK_CONCURRENCY: int = int(os.getenv("BULK_CONCURRENCY", 8))
+    BULK_BATCH_SIZE: int = int(os.getenv("BULK_BATCH_SIZE", 32))
+    BULK_MAX_ATTEMPTS: int = int(os.getenv("BULK_MAX_ATTEMPTS", 5))
+    OPENAI_REQUESTS_PER_MINUTE: int = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 500))
+    OPENAI_TOKENS_PER_MINUTE: int = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 160000))
+    # offline directory ingest (app.cli.bulk_ingest): parsing processes and chunks embedded per model call
+    BULK_INGEST_WORKERS: int = int(os.getenv("BULK_INGEST_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+    BULK_INGEST_BATCH_SIZE: int = int(os.getenv("BULK_INGEST_BATCH_SIZE", 256))
+    # "tqdm" draws progress bars, "metrics" leaves progress reporting to the /metrics counters (server mode)
+    PROGRESS_MODE: str = os.getenv("PROGRESS_MODE", "tqdm")
+    TRACE_BUFFER_SIZE: int = int(os.getenv("TRACE_BUFFER_SIZE", 200))
+    # per-request sampling profiler, requested with the X-Profile header or ?profile=1
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "False") == "True"
+    PROFILE_SAMPLE_INTERVAL_MS: float = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 5))
 
 
 settings = Settings()
@@ -0,0 +1,59 @@
+import hashlib
+import logging
+from typing import Dict, List
+from langchain_core.embeddings import Embeddings
+from app.repositories.embedding_cache_repository import EmbeddingCacheRepository
+from app.core.utils.metrics import CACHE_HITS_TOTAL, CACHE_MISSES_TOTAL, EMBEDDING_CACHE_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+
+def embedding_cache_key(kind: str, text: str) -> str:
+    # whitespace is normalized so re-wrapped but otherwise identical chunk text maps to the same vector;
+    # documents and queries are kept apart for models that embed them differently
+    normalized = " ".join(text.split())
+    return hashlib.sha256(f"{kind}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+# Looks every text up in the persistent cache of model_id first and sends only the misses to the model, so
+# moving a document between collections, rebuilding one, or re-running an interrupted ingest does not embed
+# the same chunks again. model_id names the model and its revision; another revision gets its own cache.
+# Queries go straight to the model: they rarely repeat, and a cache write on the search path would queue behind
+# ingest for the SQLite write lock.
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embedding: Embeddings, repository: EmbeddingCacheRepository, model_id: str):
+        self.embedding = embedding
+        self.repository = repository
+        self.model_id = model_id
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_cache_key("documents", text) for text in texts]
+        try:
+            cached = self.repository.get_many(keys)
+        except Exception as e:
+            # the cache only saves time; a broken cache file must not fail ingest
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            cached = {}
+        CACHE_HITS_TOTAL.inc(sum(key in cached for key in keys), cache="embeddings")
+
+        # a text repeated within the call is embedded once
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        CACHE_MISSES_TOTAL.inc(len(texts) - sum(key in cached for key in keys), cache="embeddings")
+        if missing:
+            embedded = self.embedding.embed_documents(list(missing.values()))
+            computed = dict(zip(missing, embedded))
+            try:
+                entries = self.repository.put_many(computed)
+                if entries is not None:
+                    EMBEDDING_CACHE_ENTRIES.set(entries, model=self.model_id)
+            except Exception as e:
+                logger.warning(f"Embedding cache write failed: {e}")
+        else:
+            computed = {}
+        return [computed[key] if key in computed else cached[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embedding.embed_query(text)
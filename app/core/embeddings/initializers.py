@@ -1,27 +1,82 @@
+import os
+import re
+import time
+import asyncio
 import logging
-from typing import Optional
-from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.retrievers import BM25Retriever
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, TYPE_CHECKING
+from app.config import settings
+from app.core.utils.common import is_directory_non_empty
 from app.repositories.text_repository import TextRepository
+from app.repositories.generation_repository import GenerationRepository
+
+if TYPE_CHECKING:
+    from app.models.state import AppState
+    from app.core.retrievers.bm25_index import BM25Index, BM25IndexRetriever
 
 logger = logging.getLogger(__name__)
 
+_embedding_override = None
+_bm25_locks = {}
+
+
+def override_embedding_model(embedding) -> None:
+    # lets offline tooling (benchmarks, load tests) swap in a stub model; None restores the default
+    global _embedding_override
+    _embedding_override = embedding
+
 
 def get_ko_sbert_nli_embedding():
+    if _embedding_override is not None:
+        return _embedding_override
+    return load_ko_sbert_nli_embedding()
+
+
+@lru_cache(maxsize=None)
+def load_ko_sbert_nli_embedding():
+    # torch / sentence-transformers are only imported the first time the model is requested
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from app.core.embeddings.instrumented_embeddings import InstrumentedEmbeddings
+
     model_name = "upskyy/kf-deberta-multitask"
     encode_kwargs = {'normalize_embeddings': True}
+    model_kwargs = {'revision': settings.EMBEDDING_MODEL_REVISION} if settings.EMBEDDING_MODEL_REVISION else {}
     ko_embedding = HuggingFaceEmbeddings(
         model_name=model_name,
+        model_kwargs=model_kwargs,
         encode_kwargs=encode_kwargs
     )
-    return ko_embedding
+    ko_embedding = InstrumentedEmbeddings(ko_embedding)
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return ko_embedding
+    return with_embedding_cache(ko_embedding, f"{model_name}@{settings.EMBEDDING_MODEL_REVISION or 'main'}")
 
 
-async def initialize_bm25_retriever(collection_name: str, repository_path: str) -> Optional[BM25Retriever]:
-    try:
-        text_repo = TextRepository(repository_path)
-        all_documents = text_repo.load_documents(collection_name)
+def with_embedding_cache(embedding, model_id: str):
+    # each model revision gets its own cache directory, so vectors of another revision are never served
+    from app.core.embeddings.cached_embeddings import CachedEmbeddings
+    from app.repositories.embedding_cache_repository import EmbeddingCacheRepository
+
+    directory = os.path.join(settings.EMBEDDING_CACHE_DIRECTORY, re.sub(r'[^A-Za-z0-9._-]', '_', model_id))
+    repository = EmbeddingCacheRepository(directory, settings.EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+    return CachedEmbeddings(embedding, repository, model_id)
+
+
+def build_bm25_index(collection_name: str, repository_path: str) -> Optional["BM25Index"]:
+    from app.core.retrievers.bm25_index import BM25Index
+    from app.repositories.bm25_snapshot_repository import BM25SnapshotRepository
+
+    snapshot_repo = BM25SnapshotRepository(repository_path)
+    text_repo = TextRepository(repository_path)
+    index = snapshot_repo.load(collection_name)
+
+    if index is None:
+        # fingerprint before reading, so writes that race with the rebuild leave the snapshot stale
+        source_fingerprint = snapshot_repo.source_fingerprint(collection_name)
+        # deleted documents are indexed too, so document ids stay line numbers and a snapshot stays valid
+        # until compaction rewrites the file; the tombstones below mask them
+        all_documents = text_repo.load_documents(collection_name, include_deleted=True)
 
         logger.info(f"Number of documents loaded for collection '{collection_name}': {len(all_documents)}")
 
@@ -29,15 +84,118 @@ async def initialize_bm25_retriever(collection_name: str, repository_path: str)
             logger.warning("No documents found for BM25 retriever initialization.")
             return None
 
-        preprocessed_docs = [Document(page_content=doc.page_content, metadata=doc.metadata) for doc in all_documents]
-        bm25_retriever = BM25Retriever.from_documents(
-            documents=preprocessed_docs,
-            similarity_top_k=8,
-            language="korean"
-        )
+        index = BM25Index.from_documents(all_documents)
+        try:
+            snapshot_repo.save(collection_name, index, source_fingerprint)
+        except OSError as e:
+            logger.warning(f"Could not write BM25 snapshot: {e}")
+    index.name = collection_name
+    index.delete_documents(text_repo.read_tombstones(collection_name))
+    return index
 
-        logger.info(f"BM25 retriever initialized with {len(preprocessed_docs)} documents")
-        return bm25_retriever
+
+def build_bm25_retriever(collection_name: str, repository_path: str) -> Optional["BM25IndexRetriever"]:
+    from app.core.retrievers.bm25_index import BM25IndexRetriever, ShardedBM25Index
+    from app.repositories.shard_manifest_repository import ShardManifestRepository
+
+    names = ShardManifestRepository(repository_path).shard_names(collection_name)
+    if len(names) == 1:
+        index = build_bm25_index(collection_name, repository_path)
+    else:
+        # every shard has its own text file and snapshot; they are loaded or rebuilt side by side
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            shards = [shard for shard in executor.map(build_bm25_index, names, [repository_path] * len(names))
+                      if shard is not None]
+        index = ShardedBM25Index(shards) if shards else None
+    if index is None:
+        return None
+
+    logger.info(f"BM25 retriever initialized with {index.live_count} documents")
+    return BM25IndexRetriever(index=index)
+
+
+async def initialize_bm25_retriever(collection_name: str, repository_path: str) -> Optional["BM25IndexRetriever"]:
+    try:
+        # tokenizing the corpus is CPU bound, keep it off the event loop so health checks stay responsive
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, build_bm25_retriever, collection_name, repository_path)
     except Exception as e:
         logger.error(f"Error initializing BM25 retriever: {e}", exc_info=True)
-        return None
\ No newline at end of file
+        return None
+
+
+async def get_bm25_retriever(app_state: "AppState", collection_name: str) -> Optional["BM25IndexRetriever"]:
+    generation_repo = GenerationRepository(settings.TEXT_REPOSITORY_PATH)
+    now = time.monotonic()
+    loaded_generation = app_state.bm25_generations.get(collection_name)
+    checked_at = app_state.generation_checked_at.get(collection_name, 0.0)
+
+    if collection_name in app_state.bm25_retrievers and \
+            now - checked_at < settings.GENERATION_CHECK_INTERVAL_MS / 1000:
+        return app_state.bm25_retrievers[collection_name]
+
+    lock = _bm25_locks.setdefault(collection_name, asyncio.Lock())
+    async with lock:
+        generation = generation_repo.read(collection_name)
+        app_state.generation_checked_at[collection_name] = time.monotonic()
+        if collection_name in app_state.bm25_retrievers and app_state.bm25_generations.get(collection_name) == generation:
+            return app_state.bm25_retrievers[collection_name]
+
+        bm25_retriever = await initialize_bm25_retriever(collection_name, settings.TEXT_REPOSITORY_PATH)
+        if bm25_retriever is None:
+            return app_state.bm25_retrievers.get(collection_name)
+
+        if loaded_generation is not None and loaded_generation != generation:
+            # another process wrote to this collection, reopen the vector store so its writes become visible
+            from app.repositories.sharded_chroma_repository import reset_vector_store_cache
+
+            reset_vector_store_cache(collection_name, settings.CHROMA_DIRECTORY)
+            logger.info(f"Collection '{collection_name}' moved from generation {loaded_generation} to {generation}")
+
+        app_state.bm25_retrievers[collection_name] = bm25_retriever
+        app_state.bm25_generations[collection_name] = generation
+        return bm25_retriever
+
+
+async def publish_bm25_retriever(app_state: "AppState", collection_name: str) -> Optional["BM25IndexRetriever"]:
+    # rebuilds the snapshot after a write, then bumps the generation so the other workers pick it up
+    bm25_retriever = await initialize_bm25_retriever(collection_name, settings.TEXT_REPOSITORY_PATH)
+    if bm25_retriever is None:
+        return None
+
+    generation = GenerationRepository(settings.TEXT_REPOSITORY_PATH).bump(collection_name)
+    app_state.bm25_retrievers[collection_name] = bm25_retriever
+    app_state.bm25_generations[collection_name] = generation
+    app_state.generation_checked_at[collection_name] = time.monotonic()
+    return bm25_retriever
+
+
+async def warmup_app_state(app_state: "AppState", collection_name: str = "default",
+                           open_vector_store: bool = True) -> None:
+    from app.repositories.sharded_chroma_repository import open_chroma_repository
+
+    try:
+        loop = asyncio.get_running_loop()
+        app_state.ml_models["ko_sbert_nli_embedding"] = await loop.run_in_executor(None, get_ko_sbert_nli_embedding)
+        logger.info("Embedding model loaded.")
+
+        if open_vector_store:
+            app_state.chroma_repo = await loop.run_in_executor(
+                None, open_chroma_repository, collection_name, settings.CHROMA_DIRECTORY
+            )
+            logger.info(f"Chroma persist directory: {app_state.chroma_repo.persist_directory}")
+
+        if is_directory_non_empty(settings.TEXT_REPOSITORY_PATH):
+            bm25_retriever = await get_bm25_retriever(app_state, collection_name)
+            if bm25_retriever:
+                logger.info("BM25 retriever successfully initialized.")
+            else:
+                logger.warning("BM25 retriever initialization failed.")
+        else:
+            logger.warning("Required directories do not contain any files. Please ingest data first.")
+
+        app_state.ready = True
+        logger.info("Application warmup completed.")
+    except Exception as e:
+        app_state.warmup_error = str(e)
+        logger.error(f"Error during application warmup: {e}", exc_info=True)
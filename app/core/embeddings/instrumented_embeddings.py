@@ -0,0 +1,18 @@
+from typing import List
+from langchain_core.embeddings import Embeddings
+from app.core.utils.metrics import EMBEDDING_BATCH_SECONDS, EMBEDDED_TEXTS_TOTAL
+
+
+class InstrumentedEmbeddings(Embeddings):
+    def __init__(self, embedding: Embeddings):
+        self.embedding = embedding
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        EMBEDDED_TEXTS_TOTAL.inc(len(texts), kind="documents")
+        with EMBEDDING_BATCH_SECONDS.time(kind="documents"):
+            return self.embedding.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        EMBEDDED_TEXTS_TOTAL.inc(kind="query")
+        with EMBEDDING_BATCH_SECONDS.time(kind="query"):
+            return self.embedding.embed_query(text)
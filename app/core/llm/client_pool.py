@@ -0,0 +1,79 @@
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+from app.config import settings
+from app.core.utils.circuit_breaker import CircuitBreaker
+from app.core.utils.metrics import LLM_POOLED_CLIENTS
+
+logger = logging.getLogger(__name__)
+
+_pool: Dict[str, Tuple[Any, Any]] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_http_client = None
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def transient_errors() -> Tuple[type, ...]:
+    # provider-side failures worth retrying and counting against the circuit; bad requests are neither
+    import httpx
+    import openai
+
+    return (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError,
+            httpx.TransportError)
+
+
+def _get_http_client():
+    # one keep-alive pool for every model, so connection and TLS setup are paid once per process
+    global _http_client
+    if _http_client is None:
+        import httpx
+
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=settings.LLM_MAX_CONNECTIONS,
+                                max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS),
+            timeout=httpx.Timeout(settings.LLM_TIMEOUT_SECONDS, connect=settings.LLM_CONNECT_TIMEOUT_SECONDS)
+        )
+    return _http_client
+
+
+def get_chat_models(model_name: str) -> Tuple[Any, Any]:
+    # (llm, structured_llm) for the model, created once per process
+    with _lock:
+        if model_name not in _pool:
+            from langchain_openai import ChatOpenAI
+
+            llm = ChatOpenAI(
+                model_name=model_name,
+                base_url=settings.OPENAI_BASE_URL or None,
+                http_async_client=_get_http_client(),
+                timeout=settings.LLM_TIMEOUT_SECONDS,
+                # AnswerService retries with jitter itself, so every attempt reaches the circuit breaker
+                max_retries=0
+            )
+            # OpenAI's JSON mode guarantees the single-call answer parses as a JSON object
+            _pool[model_name] = (llm, llm.bind(response_format={"type": "json_object"}))
+            LLM_POOLED_CLIENTS.set(len(_pool))
+            logger.info(f"Created pooled LLM client for {model_name}")
+        return _pool[model_name]
+
+
+def get_circuit_breaker(model_name: str) -> CircuitBreaker:
+    with _lock:
+        if model_name not in _breakers:
+            _breakers[model_name] = CircuitBreaker(
+                model_name, settings.LLM_CIRCUIT_FAILURE_THRESHOLD, settings.LLM_CIRCUIT_RESET_SECONDS
+            )
+        return _breakers[model_name]
+
+
+async def close_llm_clients() -> None:
+    global _http_client
+    with _lock:
+        client: Optional[Any] = _http_client
+        _http_client = None
+        _pool.clear()
+        LLM_POOLED_CLIENTS.set(0)
+    if client is not None:
+        await client.aclose()
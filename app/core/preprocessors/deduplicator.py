@@ -0,0 +1,136 @@
+import zlib
+import logging
+from typing import Dict, List, Optional, Sequence, Set
+import numpy as np
+from app.core.utils.metrics import INGEST_DUPLICATES_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# hash values are kept below a 31-bit prime, so a * x + b never overflows uint64
+_PRIME = np.uint64((1 << 31) - 1)
+# character shingles rather than word shingles: Korean particles attach to words and would hide overlap
+SHINGLE_SIZE = 5
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    normalized = " ".join(text.lower().split())
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) & 0x7FFFFFFF for shingle in shingles),
+                       dtype=np.uint64, count=len(shingles))
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, int(_PRIME), num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingle_hashes(text)
+        if not len(hashes):
+            return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        # every permutation applied to every shingle in one (shingles x permutations) pass
+        return ((hashes[:, None] * self._a + self._b) % _PRIME).min(axis=0)
+
+
+def estimated_jaccard(first: np.ndarray, second: np.ndarray) -> float:
+    return float(np.mean(first == second))
+
+
+# Banded LSH over MinHash signatures: two texts become candidates when all rows of any band agree, so only a
+# handful of earlier chunks are compared instead of all of them.
+class MinHashLSH:
+    def __init__(self, num_perm: int, bands: int):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._signatures: List[np.ndarray] = []
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def query(self, signature: np.ndarray, threshold: float) -> Optional[int]:
+        candidates: Set[int] = set()
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(buckets.get(key, ()))
+        # candidates are only likely matches; the signature estimate decides
+        for candidate in sorted(candidates):
+            if estimated_jaccard(signature, self._signatures[candidate]) >= threshold:
+                return candidate
+        return None
+
+    def add(self, signature: np.ndarray) -> int:
+        key = len(self._signatures)
+        self._signatures.append(signature)
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(band_key, []).append(key)
+        return key
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+# Ingest-time dedup within one source file, in two stages. Before embedding, chunks whose text is a near copy
+# (MinHash/LSH) of a chunk already seen in the file are dropped, so they never reach the model. After embedding,
+# chunks whose vector is nearly identical to one of the most recent kept chunks, or to their nearest neighbour
+# among the file's chunks already stored in the collection, are dropped before they are written. Chunks of
+# different files are never merged: each file must stay fully searchable and deletable on its own.
+class ChunkDeduplicator:
+    def __init__(self, num_perm: int = 128, bands: int = 16, jaccard_threshold: float = 0.8,
+                 cosine_threshold: float = 0.98, window_size: int = 512):
+        self.minhasher = MinHasher(num_perm)
+        self.lsh = MinHashLSH(num_perm, bands)
+        self.jaccard_threshold = jaccard_threshold
+        self.cosine_threshold = cosine_threshold
+        self.window_size = window_size
+        # ring buffer of the normalized vectors of the most recently kept chunks
+        self._window: Optional[np.ndarray] = None
+        self._window_filled = 0
+        self._window_next = 0
+
+    def filter_texts(self, chunks: Sequence[str]) -> List[int]:
+        # indices of the chunks to keep
+        kept = []
+        for index, chunk in enumerate(chunks):
+            signature = self.minhasher.signature(chunk)
+            if self.lsh.query(signature, self.jaccard_threshold) is not None:
+                INGEST_DUPLICATES_TOTAL.inc(method="minhash")
+                continue
+            self.lsh.add(signature)
+            kept.append(index)
+        return kept
+
+    def _remember(self, vector: np.ndarray) -> None:
+        if self._window is None:
+            self._window = np.zeros((self.window_size, vector.shape[0]), dtype=np.float32)
+        self._window[self._window_next] = vector
+        self._window_next = (self._window_next + 1) % self.window_size
+        self._window_filled = min(self._window_filled + 1, self.window_size)
+
+    def filter_vectors(self, embeddings: Sequence[Sequence[float]],
+                       neighbour_similarities: Optional[Sequence[float]] = None) -> List[int]:
+        # indices of the embeddings to keep; neighbour_similarities holds each embedding's cosine similarity to
+        # its nearest neighbour in the collection, when the collection was searched
+        if not len(embeddings):
+            return []
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        kept = []
+        for index, vector in enumerate(vectors):
+            if neighbour_similarities is not None and neighbour_similarities[index] >= self.cosine_threshold:
+                INGEST_DUPLICATES_TOTAL.inc(method="collection")
+                continue
+            if self._window_filled and float((self._window[:self._window_filled] @ vector).max()) \
+                    >= self.cosine_threshold:
+                INGEST_DUPLICATES_TOTAL.inc(method="window")
+                continue
+            self._remember(vector)
+            kept.append(index)
+        return kept
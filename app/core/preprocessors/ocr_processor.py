@@ -0,0 +1,124 @@
+import os
+import time
+import atexit
+import hashlib
+import functools
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.config import settings
+from app.core.utils.metrics import OCR_PAGES_TOTAL, OCR_PAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _cache_path(cache_directory: str, digest: str, languages: str) -> str:
+    return os.path.join(cache_directory, digest[:2], f"{digest}.{languages}.txt")
+
+
+def ocr_page_batch(file_path: str, page_numbers: Sequence[int], dpi: int, languages: str,
+                   cache_directory: str) -> List[Tuple[int, str, bool, float]]:
+    # runs in a pool worker: renders each page, and OCRs it unless a page with the same pixels was done before.
+    # Returns (page_number, text, from_cache, seconds) per page
+    import pdfplumber
+    import pytesseract
+
+    results = []
+    with pdfplumber.open(file_path) as pdf:
+        for page_number in page_numbers:
+            started_at = time.perf_counter()
+            image = pdf.pages[page_number].to_image(resolution=dpi).original
+            digest = hashlib.sha256(f"{image.mode}{image.size}".encode("ascii") + image.tobytes()).hexdigest()
+            cache_path = _cache_path(cache_directory, digest, languages)
+            if os.path.exists(cache_path):
+                with open(cache_path, "r", encoding="utf-8") as file:
+                    text = file.read()
+                results.append((page_number, text, True, time.perf_counter() - started_at))
+                continue
+
+            text = pytesseract.image_to_string(image, lang=languages).strip()
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # write-then-rename, so a worker reading concurrently never sees half a file
+            temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as file:
+                file.write(text)
+            os.replace(temporary_path, cache_path)
+            results.append((page_number, text, False, time.perf_counter() - started_at))
+    return results
+
+
+def get_ocr_pool() -> ProcessPoolExecutor:
+    # spawned rather than forked: the parent holds torch, chromadb and event loop threads
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.OCR_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_ocr_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(shutdown_ocr_pool)
+
+
+def _discard_broken_pool(error: Exception) -> None:
+    # a worker that died (e.g. killed for memory) breaks the whole pool; the next file starts a fresh one
+    if isinstance(error, BrokenProcessPool):
+        shutdown_ocr_pool()
+
+
+def text_less_pages(pages) -> List[int]:
+    # scanned pages carry images but no character objects at all
+    return [index for index, page in enumerate(pages) if not page.chars]
+
+
+def ocr_pages(file_path: str, page_numbers: Sequence[int]) -> Dict[int, str]:
+    # OCR text by zero-based page number ("" for a page OCR read as blank); pages that fail are left out
+    # rather than failing the ingest
+    if not settings.OCR_ENABLED or not page_numbers:
+        return {}
+
+    logger.info(f"Running OCR on {len(page_numbers)} pages without a text layer in {file_path}")
+    batch_size = settings.OCR_BATCH_SIZE
+    batches = [page_numbers[start:start + batch_size] for start in range(0, len(page_numbers), batch_size)]
+    options = (settings.OCR_DPI, settings.OCR_LANGUAGES, settings.OCR_CACHE_DIRECTORY)
+    texts = {}
+    if settings.OCR_WORKERS > 0:
+        try:
+            pool = get_ocr_pool()
+            batch_results = [pool.submit(ocr_page_batch, file_path, batch, *options).result for batch in batches]
+        except Exception as e:
+            _discard_broken_pool(e)
+            OCR_PAGES_TOTAL.inc(len(page_numbers), result="failed")
+            logger.error(f"Could not start OCR for {file_path}: {e}")
+            return texts
+    else:
+        # in this process, e.g. a bulk ingest worker that is already one of a pool of processes
+        batch_results = [functools.partial(ocr_page_batch, file_path, batch, *options) for batch in batches]
+
+    for batch, get_results in zip(batches, batch_results):
+        try:
+            results = get_results()
+        except Exception as e:
+            _discard_broken_pool(e)
+            OCR_PAGES_TOTAL.inc(len(batch), result="failed")
+            logger.error(f"OCR failed for pages {list(batch)} of {file_path}: {e}")
+            continue
+        for page_number, text, from_cache, seconds in results:
+            OCR_PAGES_TOTAL.inc(result="cached" if from_cache else "ocr")
+            OCR_PAGE_SECONDS.observe(seconds)
+            texts[page_number] = text
+    return texts
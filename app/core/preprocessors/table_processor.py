@@ -1,16 +1,44 @@
 import logging
-import pandas as pd
+from typing import List, Optional, Sequence, Tuple
 
 logger = logging.getLogger(__name__)
 
+BBox = Tuple[float, float, float, float]
 
-def extract_table(page):
-    table = page.extract_table()
 
-    if table is not None:
-        df = pd.DataFrame(table[1:], columns=table[0])
-        markdown_table = df.to_markdown(index=False)
-        logger.debug(f"Extracted table from page {page.page_number}: {markdown_table}")
-        return markdown_table
+def _cell(value: Optional[str]) -> str:
+    # markdown cells are single-line; a literal pipe would start a new column
+    if value is None:
+        return ""
+    return " ".join(str(value).split()).replace("|", "\\|")
 
-    return None
+
+def render_markdown_table(rows: Sequence[Sequence[Optional[str]]]) -> Optional[str]:
+    # the first row is the header, as the DataFrame-based renderer used to assume
+    rows = [[_cell(value) for value in row] for row in rows if row]
+    if not rows or not any(any(row) for row in rows):
+        return None
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + "|".join([" --- "] * width) + "|"]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows[1:])
+    return "\n".join(lines)
+
+
+def extract_tables(page) -> List[Tuple[str, BBox]]:
+    # every table on the page as (markdown, bbox); one detection pass yields both the cells and the
+    # region to leave out of the page body
+    tables = []
+    for table in page.find_tables():
+        markdown_table = render_markdown_table(table.extract())
+        if markdown_table:
+            logger.debug(f"Extracted table from page {page.page_number}: {markdown_table}")
+            tables.append((markdown_table, table.bbox))
+    return tables
+
+
+def outside_tables(page, bboxes: Sequence[BBox]):
+    # the page without the table regions, so table cells are not emitted a second time as body text
+    for bbox in bboxes:
+        page = page.outside_bbox(bbox, strict=False)
+    return page
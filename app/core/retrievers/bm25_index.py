@@ -0,0 +1,409 @@
+import json
+import heapq
+import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, TYPE_CHECKING
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from app.core.retrievers.search_filter import CONTENT_TYPES, SearchFilter, metadata_file_name
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_NAME = "whitespace"
+# a filter whose documents form more runs than this is applied with a mask instead of binary searches
+MAX_FILTER_RUNS = 64
+DOC_FILTER_CACHE_SIZE = 32
+# a query batch is scored a slice of queries at a time, so its (queries x documents) score matrix stays this small
+BATCH_SCORES_MAX_BYTES = 64 * 1024 * 1024
+
+
+def tokenize(text: str) -> List[str]:
+    # same preprocessing as langchain's BM25Retriever default, so scores do not change
+    return text.split()
+
+
+# what filters and tombstones match on, one entry per document: a code into file_names, the page (-1 when
+# unknown) and an index into CONTENT_TYPES (-1 when unknown)
+class FilterColumns:
+    def __init__(self, file_names: List[str], files: np.ndarray, pages: np.ndarray, content_types: np.ndarray):
+        self.file_names = file_names
+        self.file_codes = {file_name: code for code, file_name in enumerate(file_names)}
+        self.files = files
+        self.pages = pages
+        self.content_types = content_types
+
+    @classmethod
+    def from_metadatas(cls, metadatas: Iterable[Dict[str, Any]], size: int) -> "FilterColumns":
+        file_codes: Dict[str, int] = {}
+        files = np.zeros(size, dtype=np.int32)
+        pages = np.full(size, -1, dtype=np.int32)
+        content_types = np.full(size, -1, dtype=np.int8)
+        for doc_id, metadata in enumerate(metadatas):
+            files[doc_id] = file_codes.setdefault(metadata_file_name(metadata), len(file_codes))
+            pages[doc_id] = metadata.get("page", -1)
+            if metadata.get("content_type") in CONTENT_TYPES:
+                content_types[doc_id] = CONTENT_TYPES.index(metadata["content_type"])
+        return cls(list(file_codes), files, pages, content_types)
+
+
+# read-only list of utf-8 strings stored back to back in one buffer (bytes or an mmap)
+class BlobSequence(Sequence):
+    def __init__(self, blob, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, values: List[str]) -> "BlobSequence":
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return bytes(self.blob[start:end]).decode("utf-8")
+
+
+# The documents a SearchFilter admits, as sorted ids. Postings are sorted by document, and the chunks of one source
+# file are stored next to each other, so a filter is usually a few contiguous runs of ids: a term's admitted
+# postings are then found by binary search instead of reading them all.
+class DocFilter:
+    def __init__(self, mask: np.ndarray):
+        self.mask = mask
+        self.allowed = np.flatnonzero(mask).astype(np.int32)
+        self.size = len(self.allowed)
+        breaks = np.flatnonzero(np.diff(self.allowed) != 1) + 1
+        self.run_starts = self.allowed[np.concatenate(([0], breaks))] if self.size else self.allowed
+        self.run_ends = self.allowed[np.concatenate((breaks - 1, [self.size - 1]))] + 1 if self.size else self.allowed
+
+    def select(self, docs: np.ndarray) -> np.ndarray:
+        # positions in a sorted postings list whose documents are admitted
+        if len(self.run_starts) > MAX_FILTER_RUNS:
+            return np.flatnonzero(self.mask[docs])
+        lower = np.searchsorted(docs, self.run_starts)
+        upper = np.searchsorted(docs, self.run_ends)
+        ranges = [np.arange(start, end) for start, end in zip(lower, upper) if end > start]
+        return np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.int64)
+
+    def slots(self, docs: np.ndarray) -> np.ndarray:
+        # where admitted documents sit in the compact score array
+        return np.searchsorted(self.allowed, docs)
+
+
+# Okapi BM25 with the same scoring as rank_bm25.BM25Okapi, but the corpus statistics live in flat
+# numpy arrays (term-major CSR postings) so they can be written to and memory-mapped from a snapshot.
+class BM25Index:
+    def __init__(self, vocabulary: Dict[str, int], indptr: np.ndarray, postings_doc: np.ndarray,
+                 postings_tf: np.ndarray, doc_len: np.ndarray, idf: np.ndarray, page_contents: BlobSequence,
+                 metadatas: BlobSequence, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                 columns: Optional[FilterColumns] = None):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.postings_doc = postings_doc
+        self.postings_tf = postings_tf
+        self.doc_len = doc_len
+        self.idf = idf
+        self.page_contents = page_contents
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = len(doc_len)
+        # the text collection (or shard) the index was built from
+        self.name: Optional[str] = None
+        # documents not deleted by a tombstone; deleted ones keep their ids until the store is compacted
+        self.alive: Optional[np.ndarray] = None
+        self.live_count = self.corpus_size
+        self._alive_filter: Optional[DocFilter] = None
+        # read from the metadata here when not given, so no search pays for it
+        self.columns = columns if columns is not None else FilterColumns.from_metadatas(
+            (json.loads(metadatas[doc_id]) for doc_id in range(self.corpus_size)), self.corpus_size
+        )
+        self._doc_filters: "OrderedDict[tuple, DocFilter]" = OrderedDict()
+        self._filter_lock = threading.Lock()
+        self.set_corpus_statistics(idf, float(doc_len.sum()) / self.corpus_size if self.corpus_size else 0.0)
+
+    def set_corpus_statistics(self, idf: np.ndarray, avgdl: float) -> None:
+        # a shard scores with the statistics of the whole collection, so its scores compare with other shards'
+        self.idf = idf
+        self.avgdl = avgdl
+        self._length_norm = self.k1 * (1 - self.b + self.b * self.doc_len / avgdl) if avgdl \
+            else np.full(self.corpus_size, self.k1)
+
+    def live_doc_freqs(self) -> np.ndarray:
+        doc_freqs = np.diff(self.indptr)
+        if self.alive is None or len(doc_freqs) == 0:
+            return doc_freqs
+        # every term has at least one posting, so no reduceat segment is empty
+        return np.add.reduceat(self.alive[self.postings_doc].astype(np.int64), self.indptr[:-1])
+
+    def live_length(self) -> float:
+        return float(self.doc_len.sum() if self.alive is None else self.doc_len[self.alive].sum())
+
+    def delete_documents(self, tombstones: Dict[str, int], update_statistics: bool = True) -> int:
+        # tombstones: file name -> number of documents stored when it was deleted; that file's documents below
+        # the count are dead, while chunks of a later re-ingest stay alive. Returns the newly deleted documents
+        if not tombstones or self.corpus_size == 0:
+            return 0
+        columns = self.columns
+        doc_ids = np.arange(self.corpus_size)
+        dead = np.zeros(self.corpus_size, dtype=bool)
+        for file_name, before in tombstones.items():
+            if file_name in columns.file_codes:
+                dead |= (columns.files == columns.file_codes[file_name]) & (doc_ids < before)
+        alive = ~dead if self.alive is None else self.alive & ~dead
+        deleted = self.live_count - int(alive.sum())
+        if not deleted:
+            return 0
+
+        with self._filter_lock:
+            self.alive = alive
+            self.live_count = int(alive.sum())
+            self._alive_filter = DocFilter(alive)
+            self._doc_filters.clear()
+        if update_statistics and self.live_count:
+            # the remaining documents are scored as if the deleted ones had never been indexed
+            self.set_corpus_statistics(self.compute_idf(self.live_doc_freqs(), self.live_count, self.epsilon),
+                                       self.live_length() / self.live_count)
+        logger.info(f"Deleted {deleted} documents from the BM25 index, {self.live_count} remain")
+        return deleted
+
+    @classmethod
+    def from_documents(cls, documents: List["Document"], k1: float = 1.5, b: float = 0.75,
+                       epsilon: float = 0.25) -> "BM25Index":
+        vocabulary: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        term_freqs: List[int] = []
+        doc_len = np.zeros(len(documents), dtype=np.int32)
+
+        for doc_id, document in enumerate(documents):
+            counts = Counter(tokenize(document.page_content))
+            doc_len[doc_id] = sum(counts.values())
+            for term, freq in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+
+        term_ids_arr = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids_arr, kind="stable")
+        postings_doc = np.asarray(doc_ids, dtype=np.int32)[order]
+        postings_tf = np.asarray(term_freqs, dtype=np.int32)[order]
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids_arr, minlength=len(vocabulary)), out=indptr[1:])
+
+        idf = cls.compute_idf(np.diff(indptr), len(documents), epsilon)
+        page_contents = BlobSequence.from_strings([document.page_content for document in documents])
+        metadatas = BlobSequence.from_strings(
+            [json.dumps(document.metadata, ensure_ascii=False) for document in documents]
+        )
+        columns = FilterColumns.from_metadatas((document.metadata for document in documents), len(documents))
+        logger.info(f"Built BM25 index with {len(documents)} documents and {len(vocabulary)} terms")
+        return cls(vocabulary, indptr, postings_doc, postings_tf, doc_len, idf, page_contents, metadatas,
+                   k1=k1, b=b, epsilon=epsilon, columns=columns)
+
+    @staticmethod
+    def compute_idf(doc_freqs: np.ndarray, corpus_size: int, epsilon: float) -> np.ndarray:
+        if len(doc_freqs) == 0:
+            return np.zeros(0, dtype=np.float64)
+        idf = np.log(corpus_size - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        # rank_bm25 floors negative idf values to a fraction of the average idf
+        floor = epsilon * idf.sum() / len(idf)
+        return np.where(idf < 0, floor, idf)
+
+    def doc_filter(self, search_filter: Optional[SearchFilter]) -> Optional[DocFilter]:
+        if search_filter is None:
+            return self._alive_filter
+        key = search_filter.cache_key()
+        with self._filter_lock:
+            if key in self._doc_filters:
+                self._doc_filters.move_to_end(key)
+                return self._doc_filters[key]
+
+        columns = self.columns
+        mask = np.ones(self.corpus_size, dtype=bool) if self.alive is None else self.alive.copy()
+        if search_filter.sources:
+            mask &= np.isin(columns.files, [columns.file_codes[name] for name in search_filter.sources
+                                            if name in columns.file_codes])
+        if search_filter.page_from is not None or search_filter.page_to is not None:
+            # chunks without a page never match a page range
+            mask &= columns.pages >= max(search_filter.page_from or 1, 1)
+            if search_filter.page_to is not None:
+                mask &= columns.pages <= search_filter.page_to
+        if search_filter.content_type:
+            mask &= columns.content_types == CONTENT_TYPES.index(search_filter.content_type)
+        doc_filter = DocFilter(mask)
+
+        with self._filter_lock:
+            self._doc_filters[key] = doc_filter
+            if len(self._doc_filters) > DOC_FILTER_CACHE_SIZE:
+                self._doc_filters.popitem(last=False)
+        return doc_filter
+
+    def _postings(self, term_id: int, doc_filter: Optional[DocFilter]) -> Tuple[np.ndarray, np.ndarray]:
+        # (score slots, contributions) of one term; under a filter only the postings of admitted documents are
+        # scored, each into its slot among the admitted documents
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        docs = self.postings_doc[start:end]
+        freqs = self.postings_tf[start:end]
+        if doc_filter is not None:
+            selected = doc_filter.select(docs)
+            docs, freqs = docs[selected], freqs[selected]
+        contribution = self.idf[term_id] * (freqs * (self.k1 + 1)) / (freqs + self._length_norm[docs])
+        return (doc_filter.slots(docs) if doc_filter is not None else docs), contribution
+
+    def get_scores(self, query: str, doc_filter: Optional[DocFilter] = None) -> np.ndarray:
+        # one score per document, or per admitted document (in doc_filter.allowed order) under a filter
+        scores = np.zeros(doc_filter.size if doc_filter is not None else self.corpus_size, dtype=np.float64)
+        for term, query_freq in Counter(tokenize(query)).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            slots, contribution = self._postings(term_id, doc_filter)
+            scores[slots] += query_freq * contribution
+        return scores
+
+    def get_scores_batch(self, queries: List[str], doc_filter: Optional[DocFilter] = None) -> np.ndarray:
+        # (queries x documents) score matrix; each distinct term's contribution over its postings is
+        # computed once and added to every query that contains it
+        size = doc_filter.size if doc_filter is not None else self.corpus_size
+        scores = np.zeros((len(queries), size), dtype=np.float64)
+        term_queries: Dict[int, Tuple[List[int], List[int]]] = {}
+        for query_id, query in enumerate(queries):
+            for term, query_freq in Counter(tokenize(query)).items():
+                term_id = self.vocabulary.get(term)
+                if term_id is None:
+                    continue
+                query_ids, query_freqs = term_queries.setdefault(term_id, ([], []))
+                query_ids.append(query_id)
+                query_freqs.append(query_freq)
+
+        for term_id, (query_ids, query_freqs) in term_queries.items():
+            slots, contribution = self._postings(term_id, doc_filter)
+            rows = np.asarray(query_ids)[:, None]
+            scores[rows, slots] += np.asarray(query_freqs, dtype=np.float64)[:, None] * contribution
+        return scores
+
+    def top_k(self, query: str, k: int, search_filter: Optional[SearchFilter] = None) -> List[Tuple[int, float]]:
+        doc_filter = self.doc_filter(search_filter)
+        size = doc_filter.size if doc_filter is not None else self.corpus_size
+        if size == 0:
+            return []
+        scores = self.get_scores(query, doc_filter)
+        k = min(k, size)
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        doc_ids = doc_filter.allowed[ranked] if doc_filter is not None else ranked
+        return [(int(doc_id), float(scores[slot])) for doc_id, slot in zip(doc_ids, ranked)]
+
+    def top_k_batch(self, queries: List[str], k: int,
+                    search_filter: Optional[SearchFilter] = None) -> List[List[Tuple[int, float]]]:
+        doc_filter = self.doc_filter(search_filter)
+        size = doc_filter.size if doc_filter is not None else self.corpus_size
+        if size == 0:
+            return [[] for _ in queries]
+        if not queries:
+            return []
+        k = min(k, size)
+        rows_per_slice = max(1, BATCH_SCORES_MAX_BYTES // (size * np.dtype(np.float64).itemsize))
+        results = []
+        for start in range(0, len(queries), rows_per_slice):
+            scores = self.get_scores_batch(queries[start:start + rows_per_slice], doc_filter)
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+            order = np.argsort(-candidate_scores, axis=1, kind="stable")
+            ranked = np.take_along_axis(candidates, order, axis=1)
+            doc_ids = doc_filter.allowed[ranked] if doc_filter is not None else ranked
+            results.extend([(int(doc_id), float(scores[row, slot])) for doc_id, slot in zip(doc_ids[row], ranked[row])]
+                           for row in range(len(scores)))
+        return results
+
+    def get_document(self, doc_id: int) -> "Document":
+        from langchain_core.documents import Document
+
+        return Document(page_content=self.page_contents[doc_id], metadata=json.loads(self.metadatas[doc_id]))
+
+    def search(self, query: str, k: int, search_filter: Optional[SearchFilter] = None) -> List["Document"]:
+        return [self.get_document(doc_id) for doc_id, _ in self.top_k(query, k, search_filter)]
+
+    def search_batch(self, queries: List[str], k: int,
+                     search_filter: Optional[SearchFilter] = None) -> List[List["Document"]]:
+        return [[self.get_document(doc_id) for doc_id, _ in ranked]
+                for ranked in self.top_k_batch(queries, k, search_filter)]
+
+
+# The BM25 indexes of a sharded collection behind the search interface of one BM25Index. Each shard is given the
+# idf and average document length of the whole collection, so its scores are exactly those of an unsharded index;
+# shards are scored in parallel and the per-shard top k are merged by score.
+class ShardedBM25Index:
+    def __init__(self, shards: List[BM25Index]):
+        self.shards = shards
+        self.corpus_size = sum(shard.corpus_size for shard in shards)
+        self._executor = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="bm25-shard")
+        self._share_corpus_statistics()
+
+    @property
+    def live_count(self) -> int:
+        return sum(shard.live_count for shard in self.shards)
+
+    def delete_documents(self, tombstones_by_shard: Dict[str, Dict[str, int]]) -> int:
+        deleted = sum(shard.delete_documents(tombstones_by_shard.get(shard.name, {}), update_statistics=False)
+                      for shard in self.shards)
+        if deleted:
+            self._share_corpus_statistics()
+        return deleted
+
+    def _share_corpus_statistics(self) -> None:
+        doc_freqs: Dict[str, int] = {}
+        for shard in self.shards:
+            shard_doc_freqs = shard.live_doc_freqs()
+            for term, term_id in shard.vocabulary.items():
+                doc_freqs[term] = doc_freqs.get(term, 0) + int(shard_doc_freqs[term_id])
+        live_count = self.live_count
+        if not live_count:
+            return
+        global_idf = BM25Index.compute_idf(np.fromiter(doc_freqs.values(), dtype=np.int64, count=len(doc_freqs)),
+                                           live_count, self.shards[0].epsilon)
+        idf_by_term = dict(zip(doc_freqs, global_idf))
+        total_length = sum(shard.live_length() for shard in self.shards)
+        avgdl = total_length / live_count
+        for shard in self.shards:
+            idf = np.zeros(len(shard.vocabulary), dtype=np.float64)
+            for term, term_id in shard.vocabulary.items():
+                idf[term_id] = idf_by_term[term]
+            shard.set_corpus_statistics(idf, avgdl)
+
+    def _merge(self, ranked_per_shard: List[List[Tuple[int, float]]], k: int) -> List["Document"]:
+        hits = [(score, shard, doc_id) for shard, ranked in enumerate(ranked_per_shard) for doc_id, score in ranked]
+        return [self.shards[shard].get_document(doc_id)
+                for score, shard, doc_id in heapq.nlargest(k, hits, key=lambda hit: hit[0])]
+
+    def search(self, query: str, k: int, search_filter: Optional[SearchFilter] = None) -> List["Document"]:
+        return self._merge(list(self._executor.map(lambda shard: shard.top_k(query, k, search_filter),
+                                                   self.shards)), k)
+
+    def search_batch(self, queries: List[str], k: int,
+                     search_filter: Optional[SearchFilter] = None) -> List[List["Document"]]:
+        per_shard = list(self._executor.map(lambda shard: shard.top_k_batch(queries, k, search_filter),
+                                            self.shards))
+        return [self._merge([ranked[row] for ranked in per_shard], k) for row in range(len(queries))]
+
+
+class BM25IndexRetriever(BaseRetriever):
+    index: Any
+    k: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List["Document"]:
+        return self.index.search(query, self.k)
@@ -0,0 +1,107 @@
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+from app.core.utils.tokens import count_tokens
+from app.core.utils.metrics import CONTEXT_TOKENS, CONTEXT_PASSAGES_PRUNED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# the vector store splits with a 50-word overlap; look a little further to catch re-wrapped boundaries
+MAX_OVERLAP_WORDS = 64
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def strip_overlap(text: str, selected: Sequence[str]) -> str:
+    # drops words that an already selected neighbouring chunk repeats at its end (prefix) or start (suffix)
+    words = text.split()
+    for other in selected:
+        other_words = other.split()
+        limit = min(MAX_OVERLAP_WORDS, len(words) - 1, len(other_words))
+        for size in range(limit, 4, -1):
+            if other_words[-size:] == words[:size]:
+                words = words[size:]
+                break
+        limit = min(MAX_OVERLAP_WORDS, len(words) - 1, len(other_words))
+        for size in range(limit, 4, -1):
+            if words[-size:] == other_words[:size]:
+                words = words[:-size]
+                break
+    return " ".join(words)
+
+
+# Assembles the prompt context from retrieved passages: exact and near duplicates are dropped, the rest are
+# picked by maximal marginal relevance against the query and added until the token budget is spent.
+class ContextBuilder:
+    def __init__(self, embedding, model_name: str, max_tokens: int, lambda_mult: float = 0.7,
+                 duplicate_threshold: float = 0.95):
+        self.embedding = embedding
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.lambda_mult = lambda_mult
+        self.duplicate_threshold = duplicate_threshold
+
+    def _embed(self, query: str, passages: List[str], query_embedding: Optional[Sequence[float]],
+               known_embeddings: Dict[str, Sequence[float]]):
+        missing = [text for text in passages if text not in known_embeddings]
+        texts_to_embed = missing + ([] if query_embedding is not None else [query])
+        # passages found by the dense leg already carry their stored vectors; only the rest go to the model
+        embedded = self.embedding.embed_documents(texts_to_embed) if texts_to_embed else []
+        vectors = dict(known_embeddings)
+        vectors.update(zip(missing, embedded))
+        if query_embedding is None:
+            query_embedding = embedded[-1]
+        passage_matrix = _normalize(np.asarray([vectors[text] for text in passages], dtype=np.float64))
+        return _normalize(np.asarray(query_embedding, dtype=np.float64)), passage_matrix
+
+    def build(self, query: str, documents: List[Dict[str, Any]], query_embedding: Optional[Sequence[float]] = None,
+              known_embeddings: Optional[Dict[str, Sequence[float]]] = None) -> List[Dict[str, Any]]:
+        unique = {}
+        for document in documents:
+            text = document["page_content"].strip()
+            if text and text not in unique:
+                unique[text] = document
+            elif text:
+                CONTEXT_PASSAGES_PRUNED_TOTAL.inc(reason="duplicate")
+        if not unique:
+            return []
+        passages = list(unique)
+
+        query_vector, passage_matrix = self._embed(query, passages, query_embedding, known_embeddings or {})
+        relevance = passage_matrix @ query_vector
+        similarity = passage_matrix @ passage_matrix.T
+
+        selected: List[int] = []
+        selected_texts: List[str] = []
+        remaining = set(range(len(passages)))
+        used_tokens = 0
+        context = []
+        while remaining and used_tokens < self.max_tokens:
+            candidates = sorted(remaining)
+            redundancy = similarity[np.ix_(candidates, selected)].max(axis=1) if selected else np.zeros(len(candidates))
+            scores = self.lambda_mult * relevance[candidates] - (1 - self.lambda_mult) * redundancy
+            best = candidates[int(np.argmax(scores))]
+            best_redundancy = redundancy[candidates.index(best)]
+            remaining.discard(best)
+            if best_redundancy >= self.duplicate_threshold:
+                CONTEXT_PASSAGES_PRUNED_TOTAL.inc(reason="near_duplicate")
+                continue
+
+            text = strip_overlap(passages[best], selected_texts)
+            tokens = count_tokens(text, self.model_name)
+            if not text or used_tokens + tokens > self.max_tokens:
+                # a shorter passage further down may still fit
+                CONTEXT_PASSAGES_PRUNED_TOTAL.inc(reason="budget")
+                continue
+            used_tokens += tokens
+            selected.append(best)
+            selected_texts.append(passages[best])
+            context.append({"page_content": text, "metadata": unique[passages[best]]["metadata"]})
+
+        CONTEXT_PASSAGES_PRUNED_TOTAL.inc(len(remaining), reason="budget")
+        CONTEXT_TOKENS.observe(used_tokens)
+        logger.info(f"Context built from {len(context)} of {len(documents)} passages, {used_tokens} tokens")
+        return context
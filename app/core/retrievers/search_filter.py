@@ -0,0 +1,83 @@
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+CONTENT_TYPES = ("text", "table")
+LEGACY_CHUNK_SUFFIX = re.compile(r"_chunk_\d+$")
+
+
+def metadata_file_name(metadata: Dict[str, Any]) -> str:
+    # the file a stored chunk came from; BM25 chunks stored before filtering existed only know "{path}_chunk_{n}"
+    return metadata.get("file_name") or os.path.basename(LEGACY_CHUNK_SUFFIX.sub("", metadata.get("source", "")))
+
+
+# Restricts a search to chunks of some source files, a page range and/or one content type. Ingest stores the
+# fields it matches on with every chunk ("file_name", 1-based "page", "content_type"); the same filter is pushed
+# down into the Chroma where clause and into the BM25 index, so neither leg scores chunks it would throw away.
+class SearchFilter:
+    def __init__(self, sources: Optional[List[str]] = None, page_from: Optional[int] = None,
+                 page_to: Optional[int] = None, content_type: Optional[str] = None):
+        # sources are matched by file name, so a client does not need to know the server's upload directory
+        self.sources = sorted({os.path.basename(source) for source in sources}) if sources else None
+        self.page_from = page_from
+        self.page_to = page_to
+        self.content_type = content_type
+
+    @classmethod
+    def from_payload(cls, value: Any) -> Optional["SearchFilter"]:
+        # the "filter" object of a search or answer request; raises ValueError with a message fit for a 400
+        if value is None:
+            return None
+        if not isinstance(value, dict):
+            raise ValueError("filter must be an object")
+        unknown = set(value) - {"source", "page_from", "page_to", "content_type"}
+        if unknown:
+            raise ValueError(f"Unknown filter fields: {', '.join(sorted(unknown))}")
+
+        sources = value.get("source")
+        if isinstance(sources, str):
+            sources = [sources]
+        if sources is not None and (not isinstance(sources, list) or not sources
+                                    or not all(isinstance(source, str) and source for source in sources)):
+            raise ValueError("filter.source must be a file name or a non-empty list of file names")
+
+        pages = []
+        for field in ("page_from", "page_to"):
+            page = value.get(field)
+            if page is not None and (not isinstance(page, int) or isinstance(page, bool) or page < 1):
+                raise ValueError(f"filter.{field} must be a page number of at least 1")
+            pages.append(page)
+        if None not in pages and pages[0] > pages[1]:
+            raise ValueError("filter.page_from must not be after filter.page_to")
+
+        content_type = value.get("content_type")
+        if content_type is not None and content_type not in CONTENT_TYPES:
+            raise ValueError(f"filter.content_type must be one of {', '.join(CONTENT_TYPES)}")
+
+        search_filter = cls(sources, pages[0], pages[1], content_type)
+        return search_filter if search_filter.conditions() else None
+
+    def conditions(self) -> List[Dict[str, Any]]:
+        conditions = []
+        if self.sources:
+            conditions.append({"file_name": {"$in": self.sources}})
+        if self.page_from is not None:
+            conditions.append({"page": {"$gte": self.page_from}})
+        if self.page_to is not None:
+            conditions.append({"page": {"$lte": self.page_to}})
+        if self.content_type:
+            conditions.append({"content_type": {"$eq": self.content_type}})
+        return conditions
+
+    def chroma_where(self) -> Optional[Dict[str, Any]]:
+        conditions = self.conditions()
+        if not conditions:
+            return None
+        # chroma only accepts several conditions combined under an explicit $and
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def cache_key(self) -> tuple:
+        return tuple(self.sources or ()), self.page_from, self.page_to, self.content_type
+
+    def __repr__(self) -> str:
+        return f"SearchFilter({self.chroma_where()})"
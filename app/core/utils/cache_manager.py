@@ -1,16 +1,32 @@
+from collections import OrderedDict
+from app.core.utils.metrics import CACHE_HITS_TOTAL, CACHE_MISSES_TOTAL
+
+
 class CacheManager:
-    def __init__(self):
-        self.cache = {}
+    def __init__(self, name="extraction", max_size=None):
+        self.name = name
+        # max_size bounds the cache by evicting the least recently used entry; None keeps everything
+        self.max_size = max_size
+        self.cache = OrderedDict()
 
     def add_to_cache(self, key, value):
         self.cache[key] = value
+        self.cache.move_to_end(key)
+        if self.max_size is not None and len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
 
     def get_from_cache(self, key):
-        return self.cache.get(key)
+        value = self.cache.get(key)
+        if value is None:
+            CACHE_MISSES_TOTAL.inc(cache=self.name)
+        else:
+            self.cache.move_to_end(key)
+            CACHE_HITS_TOTAL.inc(cache=self.name)
+        return value
 
     def clear_cache(self):
         self.cache.clear()
 
     def remove_from_cache(self, key):
         if key in self.cache:
-            del self.cache[key]
\ No newline at end of file
+            del self.cache[key]
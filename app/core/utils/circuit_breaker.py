@@ -0,0 +1,64 @@
+import time
+import threading
+from app.core.utils.metrics import LLM_CIRCUIT_STATE
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# stops calling a degraded dependency after consecutive failures; once reset_timeout has passed a single
+# probe call is let through, and its outcome either closes the circuit again or keeps it open
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        LLM_CIRCUIT_STATE.set(STATE_VALUES[CLOSED], model=name)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        LLM_CIRCUIT_STATE.set(STATE_VALUES[state], model=self.name)
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+                return
+            # open, or half-open with the probe still in flight
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+    def release_probe(self) -> None:
+        # a call that ended without an outcome (cancelled, e.g. by a client disconnect) says nothing about the
+        # dependency; a half-open circuit goes back to open with its timeout already elapsed, so the next call probes
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._set_state(OPEN)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self._state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
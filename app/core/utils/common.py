@@ -1,24 +1,12 @@
 import os
 import re
 import logging
-import numpy as np
 from typing import List
 from fastapi import UploadFile
-from langchain_community.document_transformers import LongContextReorder
 
 logger = logging.getLogger(__name__)
 
 
-def calculate_cosine_similarity(embedding):
-    if len(embedding.shape) == 1:
-        embedding = embedding.reshape(1, -1)
-    norms = np.linalg.norm(embedding, axis=1, keepdims=True)
-    norms[norms == 0] = 1
-    normalized_embedding = embedding / norms
-    cosine_similarity = np.dot(normalized_embedding, normalized_embedding.T)
-    return cosine_similarity
-
-
 def format_collection_name(file_path: str) -> str:
     base_name = os.path.basename(file_path)
     valid_name = re.sub(r'[^a-zA-Z0-9_-]', '_', base_name)
@@ -54,6 +42,8 @@ def is_directory_non_empty(directory: str) -> bool:
 
 
 def context_reorder_documents(documents):
+    from langchain_community.document_transformers import LongContextReorder
+
     reorder_instance = LongContextReorder()
     return reorder_instance.transform_documents(documents)
 
@@ -81,13 +71,20 @@ def empty_result():
     }
 
 
+def _preview(text: str, length: int = 80) -> str:
+    return text[:length] + ("..." if len(text) > length else "")
+
+
 def log_json_docs(json_docs):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     for i, doc in enumerate(json_docs):
-        logger.info(f"Document {i} - Content: {doc['page_content']}, Metadata: {doc['metadata']}")
+        logger.debug(f"Document {i} - Source: {doc['metadata'].get('source')}, Content: {_preview(doc['page_content'])}")
 
 
 def log_documents(documents, doc_type):
-    print(f"Before Reorder ({doc_type}):")
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     for i, doc in enumerate(documents):
-        print(f"{doc_type} Document {i + 1}: {doc}")
-    print("-" * 50)
+        logger.debug(f"{doc_type} Document {i + 1} - Source: {doc['metadata'].get('source')}, "
+                     f"Content: {_preview(doc['page_content'])}")
@@ -0,0 +1,13 @@
+import asyncio
+from app.core.utils.metrics import EVENT_LOOP_LAG_SECONDS
+
+LOOP_MONITOR_INTERVAL = 0.1
+
+
+async def monitor_event_loop_lag(interval: float = LOOP_MONITOR_INTERVAL) -> None:
+    # anything that blocks the loop (CPU bound work, sync I/O) shows up as late timer wake-ups
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(loop.time() - start - interval, 0.0))
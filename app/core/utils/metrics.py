@@ -0,0 +1,169 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Sequence
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: List["Metric"] = []
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, counts in self._counts.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(self._sums[key])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+DENSE_SEARCH_SECONDS = Histogram("rag_dense_search_seconds", "Latency of the dense (Chroma) retrieval leg")
+BM25_SEARCH_SECONDS = Histogram("rag_bm25_search_seconds", "Latency of the BM25 retrieval leg")
+FUSION_SECONDS = Histogram("rag_fusion_seconds", "Latency of reordering and combining retrieval results")
+LLM_CALL_SECONDS = Histogram("rag_llm_call_seconds", "Latency of LLM calls in AnswerService", ["stage"])
+PDF_PAGE_EXTRACT_SECONDS = Histogram("rag_pdf_page_extract_seconds", "Latency of extracting one PDF page")
+EMBEDDING_BATCH_SECONDS = Histogram("rag_embedding_batch_seconds", "Latency of one embedding model call", ["kind"])
+EMBEDDED_TEXTS_TOTAL = Counter("rag_embedded_texts_total", "Number of texts sent to the embedding model", ["kind"])
+CHUNKS_INGESTED_TOTAL = Counter("rag_chunks_ingested_total", "Number of chunks written to a store", ["store"])
+CACHE_HITS_TOTAL = Counter("rag_cache_hits_total", "Number of cache hits", ["cache"])
+CACHE_MISSES_TOTAL = Counter("rag_cache_misses_total", "Number of cache misses", ["cache"])
+CACHE_EVICTIONS_TOTAL = Counter("rag_cache_evictions_total", "Number of entries evicted from a size-bounded cache",
+                                ["cache"])
+ERRORS_TOTAL = Counter("rag_errors_total", "Number of handled errors", ["component"])
+EVENT_LOOP_LAG_SECONDS = Histogram("rag_event_loop_lag_seconds", "Delay of the event loop in waking a periodic timer",
+                                   buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+RATE_LIMIT_WAIT_SECONDS = Histogram("rag_rate_limit_wait_seconds", "Time spent waiting for LLM rate limit budget")
+BULK_ANSWERS_TOTAL = Counter("rag_bulk_answers_total", "Number of questions processed by bulk answer jobs", ["status"])
+CONTEXT_TOKENS = Histogram("rag_context_tokens", "Tokens of retrieved context placed in the answer prompt",
+                           buckets=(128, 256, 512, 1024, 2048, 4096, 8192))
+CONTEXT_PASSAGES_PRUNED_TOTAL = Counter("rag_context_passages_pruned_total",
+                                        "Retrieved passages left out of the prompt context", ["reason"])
+ANSWER_FALLBACKS_TOTAL = Counter("rag_answer_fallbacks_total",
+                                 "Single-call answers that could not be parsed and fell back to the multi-call path")
+LLM_CALLS_TOTAL = Counter("rag_llm_calls_total", "LLM call attempts by outcome", ["model", "outcome"])
+LLM_RETRIES_TOTAL = Counter("rag_llm_retries_total", "LLM calls retried after a transient provider error", ["model"])
+LLM_CIRCUIT_STATE = Gauge("rag_llm_circuit_state", "LLM circuit breaker state: 0 closed, 1 half-open, 2 open",
+                          ["model"])
+LLM_POOLED_CLIENTS = Gauge("rag_llm_pooled_clients", "LLM clients held in the process-wide pool")
+OCR_PAGES_TOTAL = Counter("rag_ocr_pages_total", "Pages without a text layer sent to OCR", ["result"])
+OCR_PAGE_SECONDS = Histogram("rag_ocr_page_seconds", "Time to render and OCR one page in a pool worker")
+INGEST_DUPLICATES_TOTAL = Counter("rag_ingest_duplicates_total",
+                                  "Chunks dropped at ingest as near duplicates, by detection method", ["method"])
+EMBEDDING_CACHE_ENTRIES = Gauge("rag_embedding_cache_entries", "Vectors held in the persistent embedding cache",
+                                ["model"])
+CHUNKS_DELETED_TOTAL = Counter("rag_chunks_deleted_total", "Number of chunks removed from a store by source deletes",
+                               ["store"])
+COMPACTIONS_TOTAL = Counter("rag_compactions_total", "Collection compaction runs by outcome", ["result"])
+VECTOR_WRITE_BATCH_SIZE = Histogram("rag_vector_write_batch_size", "Chunks sent to the Chroma server per write request",
+                                    buckets=(1, 8, 32, 64, 128, 256, 512, 1024, 4096))
@@ -1,5 +1,24 @@
-from tqdm import tqdm
+from app.config import settings
+
+
+class NullProgress:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def update(self, n=1):
+        pass
+
+    def close(self):
+        pass
 
 
 def get_tqdm(total, desc, leave=True, dynamic_ncols=True):
+    if settings.PROGRESS_MODE == "metrics":
+        return NullProgress()
+
+    from tqdm import tqdm
+
     return tqdm(total=total, desc=desc, leave=leave, dynamic_ncols=dynamic_ncols)
@@ -0,0 +1,46 @@
+import time
+import asyncio
+from app.core.utils.metrics import RATE_LIMIT_WAIT_SECONDS
+
+
+# token buckets for the requests-per-minute and tokens-per-minute budgets of an LLM API; both refill
+# continuously so a full minute's budget is never spent in a single burst
+class RateLimiter:
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._available_requests = float(requests_per_minute)
+        self._available_tokens = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed_minutes = (now - self._updated_at) / 60
+        self._updated_at = now
+        self._available_requests = min(
+            float(self.requests_per_minute), self._available_requests + elapsed_minutes * self.requests_per_minute
+        )
+        self._available_tokens = min(
+            float(self.tokens_per_minute), self._available_tokens + elapsed_minutes * self.tokens_per_minute
+        )
+
+    async def acquire(self, tokens: int, requests: int = 1) -> None:
+        # a single call larger than the whole budget would otherwise wait forever
+        tokens = min(tokens, self.tokens_per_minute)
+        requests = min(requests, self.requests_per_minute)
+        started_at = time.monotonic()
+        # waiters queue on the lock, so budget is handed out in arrival order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._available_requests >= requests and self._available_tokens >= tokens:
+                    self._available_requests -= requests
+                    self._available_tokens -= tokens
+                    break
+                wait_minutes = max(
+                    (requests - self._available_requests) / self.requests_per_minute,
+                    (tokens - self._available_tokens) / self.tokens_per_minute
+                )
+                await asyncio.sleep(wait_minutes * 60)
+        RATE_LIMIT_WAIT_SECONDS.observe(time.monotonic() - started_at)
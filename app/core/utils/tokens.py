@@ -0,0 +1,52 @@
+import logging
+from functools import lru_cache
+from typing import List, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model_name: str):
+    import tiktoken
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use; without network access we fall back to an estimate
+        logger.warning(f"tiktoken encoding for {model_name} unavailable, estimating token counts: {e}")
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    # cl100k spends roughly one token per Hangul syllable and one per four ASCII characters
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+def count_tokens(text: str, model_name: str = "gpt-3.5-turbo") -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text))
+
+
+def split_history_by_tokens(turns: List[Dict[str, str]], max_tokens: int,
+                            model_name: str = "gpt-3.5-turbo") -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    # (older, recent): the newest chronological turns that fit in max_tokens, and everything before them
+    used = 0
+    start = len(turns)
+    while start > 0:
+        tokens = count_tokens(turns[start - 1]["content"], model_name)
+        if used + tokens > max_tokens:
+            break
+        used += tokens
+        start -= 1
+    # never open the window with an answer whose question was cut off
+    while start < len(turns) and turns[start]["role"] != "user":
+        start += 1
+    return turns[:start], turns[start:]
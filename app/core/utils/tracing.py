@@ -0,0 +1,131 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span_id: ContextVar[Optional[int]] = ContextVar("current_span_id", default=None)
+
+
+class Trace:
+    def __init__(self, request_id: str, name: str):
+        self.request_id = request_id
+        self.name = name
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        self.profile: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, parent_id: Optional[int], start: float, attributes: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            span = {
+                "span_id": len(self.spans) + 1,
+                "parent_id": parent_id,
+                "name": name,
+                "start_ms": round((start - self._start) * 1000, 3),
+                "duration_ms": None,
+                "attributes": attributes,
+            }
+            self.spans.append(span)
+        return span
+
+    def finish(self) -> None:
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "duration_ms": self.duration_ms,
+            "spans": {span["name"]: span["duration_ms"] for span in self.spans},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "spans": self.spans,
+            "has_profile": self.profile is not None,
+        }
+
+
+class TraceStore:
+    def __init__(self, max_size: int = 200):
+        self.max_size = max_size
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            self._traces[trace.request_id] = trace
+            self._traces.move_to_end(trace.request_id)
+            while len(self._traces) > self.max_size:
+                self._traces.popitem(last=False)
+
+    def get(self, request_id: str) -> Optional[Trace]:
+        with self._lock:
+            return self._traces.get(request_id)
+
+    def recent(self, limit: int = 50) -> List[Trace]:
+        with self._lock:
+            return list(self._traces.values())[-limit:][::-1]
+
+
+trace_store = TraceStore(settings.TRACE_BUFFER_SIZE)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def get_current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def get_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+@contextmanager
+def start_trace(request_id: str, name: str):
+    trace = Trace(request_id, name)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span_id.set(None)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        _current_span_id.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    start = time.perf_counter()
+    record = trace.add_span(name, _current_span_id.get(), start, attributes)
+    token = _current_span_id.set(record["span_id"])
+    try:
+        yield record
+    except Exception as e:
+        record["attributes"]["error"] = str(e)
+        raise
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        _current_span_id.reset(token)
@@ -1,16 +1,28 @@
+import json
+import asyncio
 import uvicorn
 import logging
-from fastapi import FastAPI
+from typing import Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from app.config import settings
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from app.models.state import initial_app_state, AppState
-from app.core.utils.common import is_directory_non_empty
-from app.repositories.chroma_repository import ChromaRepository
+from app.core.utils.metrics import render_metrics
+from app.core.utils.profiler import SamplingProfiler
+from app.core.utils.loop_monitor import monitor_event_loop_lag
+from app.core.utils.tracing import start_trace, trace_store, new_request_id
+from app.core.utils.response_handler import success_handler, error_handler
 from app.api.v1.endpoints.ingest_data import router as ingest_data_router_v1
 from app.api.v1.endpoints.search_data import router as search_vector_router_v1
 from app.api.v1.endpoints.answer_question import router as answer_question_router_v1
-from app.core.embeddings.initializers import get_ko_sbert_nli_embedding, initialize_bm25_retriever
+from app.api.v1.endpoints.debug import router as debug_router_v1
+from app.api.v1.endpoints.bulk_answer import router as bulk_answer_router_v1
+from app.core.embeddings.initializers import warmup_app_state
+from app.core.llm.client_pool import close_llm_clients
+from app.core.preprocessors.ocr_processor import shutdown_ocr_pool
+from app.repositories.chroma_client import close_batch_writers
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -23,25 +35,21 @@ class CustomApp(FastAPI):
 @asynccontextmanager
 async def lifespan(app: CustomApp):
     app.state.app_state = initial_app_state
-    app.state.app_state.ml_models["ko_sbert_nli_embedding"] = get_ko_sbert_nli_embedding()
-    app.state.app_state.chroma_repo = ChromaRepository(collection_name="default",
-                                                       chroma_directory=settings.CHROMA_DIRECTORY)
-
-    if is_directory_non_empty(settings.TEXT_REPOSITORY_PATH):
-        bm25_retriever = await initialize_bm25_retriever("default", settings.TEXT_REPOSITORY_PATH)
-        if bm25_retriever:
-            app.state.app_state.bm25_retriever = bm25_retriever
-            logger.info("BM25 retriever successfully initialized.")
-        else:
-            logger.warning("BM25 retriever initialization failed.")
-    else:
-        logger.warning("Required directories do not contain any files. Please ingest data first.")
-
-    logger.info(f"Chroma persist directory: {app.state.app_state.chroma_repo.persist_directory}")
+    # model loading and index rebuilds run in the background so the port opens immediately
+    warmup_task = asyncio.create_task(warmup_app_state(app.state.app_state))
+    loop_monitor_task = asyncio.create_task(monitor_event_loop_lag())
 
     try:
         yield
     finally:
+        warmup_task.cancel()
+        loop_monitor_task.cancel()
+        for job in app.state.app_state.bulk_jobs.values():
+            if job.task is not None:
+                job.task.cancel()
+        await close_batch_writers()
+        await close_llm_clients()
+        shutdown_ocr_pool()
         app.state.app_state.ml_models.clear()
 
 
@@ -71,6 +79,51 @@ app.add_middleware(
 app.include_router(answer_question_router_v1, prefix="/api/v1/answer", tags=["v1 Answer Question"])
 app.include_router(search_vector_router_v1, prefix="/api/v1/search", tags=["v1 Search Vectors"])
 app.include_router(ingest_data_router_v1, prefix="/api/v1/ingest", tags=["v1 Ingest Data"])
+app.include_router(bulk_answer_router_v1, prefix="/api/v1/bulk", tags=["v1 Bulk Answer"])
+app.include_router(debug_router_v1, prefix="/api/v1/debug", tags=["v1 Debug"])
+
+UNTRACED_PATHS = {"/healthcheck", "/readiness", "/metrics"}
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    if request.url.path in UNTRACED_PATHS or request.url.path.startswith("/api/v1/debug"):
+        return await call_next(request)
+
+    request_id = request.headers.get("X-Request-ID") or new_request_id()
+    profile_requested = request.headers.get("X-Profile") == "1" or request.query_params.get("profile") == "1"
+    profiler = None
+    if profile_requested and settings.PROFILING_ENABLED:
+        profiler = SamplingProfiler(interval=settings.PROFILE_SAMPLE_INTERVAL_MS / 1000).start()
+
+    with start_trace(request_id, f"{request.method} {request.url.path}") as trace:
+        try:
+            response = await call_next(request)
+        except BaseException:
+            if profiler is not None:
+                profiler.stop()
+            raise
+
+    response.headers["X-Request-ID"] = request_id
+    if profiler is not None:
+        response.headers["X-Profile-URL"] = f"/api/v1/debug/profiles/{request_id}"
+    response.body_iterator = finish_trace_with_body(response.body_iterator, trace, profiler)
+    return response
+
+
+async def finish_trace_with_body(body_iterator, trace, profiler: Optional[SamplingProfiler]):
+    # call_next returns once the headers are ready; a streamed answer is still being generated then, so the
+    # trace (and the profile) ends when the body has been sent or the client has gone away
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            trace.profile = profiler.collapsed()
+        trace.finish()
+        trace_store.add(trace)
+        logger.info(f"Trace: {json.dumps(trace.summary(), ensure_ascii=False)}")
 
 
 @app.get("/healthcheck")
@@ -78,5 +131,22 @@ def healthcheck():
     return {"status": "ok"}
 
 
+@app.get("/readiness")
+def readiness():
+    app_state: AppState = app.state.app_state
+    if not app_state.ready:
+        message = app_state.warmup_error or "Application is warming up"
+        return error_handler(message, status_code=503)
+    return success_handler({
+        "message": "Application is ready",
+        "bm25_collections": sorted(app_state.bm25_retrievers)
+    })
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host=settings.HOST, port=settings.PORT, log_level="info", access_log=True)
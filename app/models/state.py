@@ -1,13 +1,19 @@
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
-from langchain_community.retrievers import BM25Retriever
-from app.repositories.chroma_repository import ChromaRepository
 
 
 class AppState(BaseModel):
     ml_models: Dict[str, Any] = Field(default_factory=dict)
-    chroma_repo: Optional[ChromaRepository] = None
-    bm25_retriever: Optional[BM25Retriever] = None
+    # ChromaRepository / BM25IndexRetriever, typed as Any so importing the state does not pull in chromadb or langchain
+    chroma_repo: Optional[Any] = None
+    bm25_retrievers: Dict[str, Any] = Field(default_factory=dict)
+    # on-disk generation each collection's retriever was loaded at, and when the marker was last checked
+    bm25_generations: Dict[str, int] = Field(default_factory=dict)
+    generation_checked_at: Dict[str, float] = Field(default_factory=dict)
+    # bulk answer jobs started through the API, by job id
+    bulk_jobs: Dict[str, Any] = Field(default_factory=dict)
+    ready: bool = False
+    warmup_error: Optional[str] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -15,6 +21,5 @@ class AppState(BaseModel):
 
 initial_app_state = AppState(
     ml_models={},
-    chroma_repo=None,
-    bm25_retriever=None
+    chroma_repo=None
 )
@@ -0,0 +1,119 @@
+import gc
+import os
+import sys
+import time
+import signal
+import socket
+import asyncio
+import logging
+import argparse
+from typing import Dict
+import uvicorn
+from app.config import settings
+from app.models.state import initial_app_state
+from app.core.embeddings.initializers import warmup_app_state
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Prefork server: the master loads the embedding model and the BM25 snapshots once, then forks the
+# workers, which share those pages copy-on-write. Workers follow later ingests through the on-disk
+# generation markers (see GenerationRepository), so every worker serves the same data.
+
+
+def preload() -> None:
+    # the vector store is opened by each worker after the fork, sqlite handles must not cross it
+    asyncio.run(warmup_app_state(initial_app_state, open_vector_store=False))
+    if initial_app_state.warmup_error:
+        raise RuntimeError(f"Preloading failed: {initial_app_state.warmup_error}")
+    # keep the preloaded objects out of the collector so it does not touch (and copy) their pages
+    import app.main  # noqa: F401  imported before forking so the workers share the loaded modules
+    gc.collect()
+    gc.freeze()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    from app.main import app
+
+    config = uvicorn.Config(app, log_level="info", access_log=True)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn_worker(sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(sock)
+        finally:
+            os._exit(0)
+    logger.info(f"Started worker {pid}")
+    return pid
+
+
+def serve(host: str, port: int, workers: int) -> None:
+    preload()
+    sock = bind_socket(host, port)
+    logger.info(f"Listening on http://{host}:{port} with {workers} workers")
+
+    children: Dict[int, float] = {}
+    shutting_down = False
+
+    def shutdown(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for _ in range(workers):
+        children[spawn_worker(sock)] = time.monotonic()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started_at = children.pop(pid, None)
+        if started_at is None or shutting_down:
+            continue
+        logger.warning(f"Worker {pid} exited with status {status}, restarting")
+        if time.monotonic() - started_at < 1:
+            time.sleep(1)
+        children[spawn_worker(sock)] = time.monotonic()
+
+    sock.close()
+    logger.info("All workers stopped")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run the API with preloaded models in prefork workers")
+    parser.add_argument("--host", default=settings.HOST)
+    parser.add_argument("--port", type=int, default=settings.PORT)
+    parser.add_argument("--workers", type=int, default=settings.WORKERS)
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, "fork"):
+        sys.exit("Prefork mode requires os.fork; run uvicorn app.main:app directly on this platform")
+    serve(args.host, args.port, max(args.workers, 1))
+
+
+if __name__ == "__main__":
+    main()
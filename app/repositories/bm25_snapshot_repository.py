@@ -0,0 +1,170 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import logging
+from typing import Dict, Optional
+import numpy as np
+from app.core.retrievers.bm25_index import BM25Index, BlobSequence, FilterColumns, TOKENIZER_NAME
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"BM25SNAP"
+SNAPSHOT_VERSION = 2
+SECTION_ALIGNMENT = 8
+
+# name -> dtype of every array stored in the snapshot payload
+SNAPSHOT_SECTIONS = {
+    "indptr": "<i8",
+    "postings_doc": "<i4",
+    "postings_tf": "<i4",
+    "doc_len": "<i4",
+    "idf": "<f8",
+    "vocabulary": "u1",
+    "page_contents": "u1",
+    "page_content_offsets": "<i8",
+    "metadatas": "u1",
+    "metadata_offsets": "<i8",
+    "file_names": "u1",
+    "file_name_offsets": "<i8",
+    "files": "<i4",
+    "pages": "<i4",
+    "content_types": "i1",
+}
+
+
+def _align(offset: int) -> int:
+    return (offset + SECTION_ALIGNMENT - 1) // SECTION_ALIGNMENT * SECTION_ALIGNMENT
+
+
+class BM25SnapshotRepository:
+    def __init__(self, repository_path: str) -> None:
+        self.repository_path = repository_path
+        os.makedirs(self.repository_path, exist_ok=True)
+
+    def source_path(self, collection_name: str) -> str:
+        return os.path.join(self.repository_path, f"{collection_name}.jsonl")
+
+    def snapshot_path(self, collection_name: str) -> str:
+        return os.path.join(self.repository_path, f"{collection_name}.bm25")
+
+    def source_fingerprint(self, collection_name: str) -> Optional[Dict[str, int]]:
+        try:
+            stat = os.stat(self.source_path(collection_name))
+        except FileNotFoundError:
+            return None
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def save(self, collection_name: str, index: BM25Index, source_fingerprint: Optional[Dict[str, int]]) -> None:
+        file_names = BlobSequence.from_strings(index.columns.file_names)
+        arrays = {
+            "indptr": index.indptr,
+            "postings_doc": index.postings_doc,
+            "postings_tf": index.postings_tf,
+            "doc_len": index.doc_len,
+            "idf": index.idf,
+            "vocabulary": np.frombuffer("\n".join(index.vocabulary).encode("utf-8"), dtype=np.uint8),
+            "page_contents": np.frombuffer(index.page_contents.blob, dtype=np.uint8),
+            "page_content_offsets": index.page_contents.offsets,
+            "metadatas": np.frombuffer(index.metadatas.blob, dtype=np.uint8),
+            "metadata_offsets": index.metadatas.offsets,
+            "file_names": np.frombuffer(file_names.blob, dtype=np.uint8),
+            "file_name_offsets": file_names.offsets,
+            "files": index.columns.files,
+            "pages": index.columns.pages,
+            "content_types": index.columns.content_types,
+        }
+
+        sections = {}
+        payload = bytearray()
+        for name, dtype in SNAPSHOT_SECTIONS.items():
+            data = np.ascontiguousarray(arrays[name], dtype=dtype).tobytes()
+            payload.extend(b"\0" * (_align(len(payload)) - len(payload)))
+            sections[name] = {"offset": len(payload), "count": len(data) // np.dtype(dtype).itemsize}
+            payload.extend(data)
+
+        header = json.dumps({
+            "version": SNAPSHOT_VERSION,
+            "tokenizer": TOKENIZER_NAME,
+            "k1": index.k1,
+            "b": index.b,
+            "epsilon": index.epsilon,
+            "vocabulary_size": len(index.vocabulary),
+            "source": source_fingerprint,
+            "sections": sections,
+            "checksum": zlib.crc32(payload),
+        }).encode("utf-8")
+        prefix = SNAPSHOT_MAGIC + struct.pack("<I", len(header)) + header
+
+        file_path = self.snapshot_path(collection_name)
+        tmp_path = f"{file_path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(prefix)
+            f.write(b"\0" * (_align(len(prefix)) - len(prefix)))
+            f.write(payload)
+        os.replace(tmp_path, file_path)
+        logger.info(f"Saved BM25 snapshot ({len(payload)} bytes) to {file_path}")
+
+    def load(self, collection_name: str) -> Optional[BM25Index]:
+        file_path = self.snapshot_path(collection_name)
+        if not os.path.exists(file_path):
+            return None
+
+        try:
+            with open(file_path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            if buffer[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                logger.warning(f"Ignoring BM25 snapshot with unknown format: {file_path}")
+                return None
+            header_start = len(SNAPSHOT_MAGIC) + 4
+            (header_len,) = struct.unpack_from("<I", buffer, len(SNAPSHOT_MAGIC))
+            header = json.loads(buffer[header_start:header_start + header_len])
+
+            if header.get("version") != SNAPSHOT_VERSION or header.get("tokenizer") != TOKENIZER_NAME:
+                logger.info(f"BM25 snapshot version mismatch, rebuilding: {file_path}")
+                return None
+            if header.get("source") != self.source_fingerprint(collection_name):
+                logger.info(f"BM25 snapshot is stale, rebuilding: {file_path}")
+                return None
+
+            payload_start = _align(header_start + header_len)
+            with memoryview(buffer) as view:
+                checksum = zlib.crc32(view[payload_start:])
+            if checksum != header["checksum"]:
+                logger.warning(f"BM25 snapshot checksum mismatch, rebuilding: {file_path}")
+                return None
+
+            arrays = {
+                name: np.frombuffer(buffer, dtype=dtype, count=header["sections"][name]["count"],
+                                    offset=payload_start + header["sections"][name]["offset"])
+                for name, dtype in SNAPSHOT_SECTIONS.items()
+            }
+            vocabulary_terms = arrays["vocabulary"].tobytes().decode("utf-8").split("\n")
+            vocabulary = {term: term_id for term_id, term in enumerate(vocabulary_terms)} \
+                if header["vocabulary_size"] else {}
+            # stored so that loading does not parse the metadata of every document
+            file_names = BlobSequence(arrays["file_names"], arrays["file_name_offsets"])
+            columns = FilterColumns([file_names[code] for code in range(len(file_names))], arrays["files"],
+                                    arrays["pages"], arrays["content_types"])
+
+            index = BM25Index(
+                vocabulary=vocabulary,
+                indptr=arrays["indptr"],
+                postings_doc=arrays["postings_doc"],
+                postings_tf=arrays["postings_tf"],
+                doc_len=arrays["doc_len"],
+                idf=arrays["idf"],
+                page_contents=BlobSequence(arrays["page_contents"], arrays["page_content_offsets"]),
+                metadatas=BlobSequence(arrays["metadatas"], arrays["metadata_offsets"]),
+                k1=header["k1"],
+                b=header["b"],
+                epsilon=header["epsilon"],
+                columns=columns,
+            )
+            logger.info(f"Loaded BM25 snapshot with {index.corpus_size} documents from {file_path}")
+            return index
+        except Exception as e:
+            logger.error(f"Error loading BM25 snapshot {file_path}: {e}", exc_info=True)
+            return None
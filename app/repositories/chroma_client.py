@@ -0,0 +1,212 @@
+import os
+import time
+import socket
+import asyncio
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Set, Tuple
+from app.config import settings
+from app.core.utils.metrics import VECTOR_WRITE_BATCH_SIZE
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where only a single worker is supported
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_lock = threading.Lock()
+# when this process last renewed its host's lease on the Chroma server
+_lease_renewed_at = 0.0
+HOST_LEASE_COLLECTION = "rag-host-lease"
+# per event loop, so a writer's futures and timers always belong to the loop awaiting them
+_writers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, ChromaBatchWriter]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def uses_chroma_server() -> bool:
+    return settings.CHROMA_MODE == "http"
+
+
+def chroma_server_url() -> str:
+    scheme = "https" if settings.CHROMA_SSL else "http"
+    return f"{scheme}://{settings.CHROMA_HOST}:{settings.CHROMA_PORT}"
+
+
+def get_chroma_http_client():
+    # one client per process: it keeps a single keep-alive connection pool to the server that every repository,
+    # shard and executor thread shares
+    global _client
+    with _lock:
+        if _client is None:
+            import chromadb
+            from chromadb.config import Settings as ChromaSettings
+
+            _client = chromadb.HttpClient(host=settings.CHROMA_HOST, port=settings.CHROMA_PORT,
+                                          ssl=settings.CHROMA_SSL,
+                                          settings=ChromaSettings(anonymized_telemetry=False))
+            logger.info(f"Connected to the Chroma server at {chroma_server_url()}")
+        return _client
+
+
+class HostLeaseError(RuntimeError):
+    pass
+
+
+def check_host_lease() -> None:
+    # The collection locks below only exclude processes of one host, so in "http" mode the host using the server
+    # records a lease on it and renews it while it works; a process on another host is refused until that lease
+    # lapses, rather than racing the first host's writes and compactions
+    global _lease_renewed_at
+    lease_seconds = settings.CHROMA_HOST_LEASE_SECONDS
+    now = time.time()
+    if lease_seconds <= 0 or now - _lease_renewed_at < lease_seconds / 4:
+        return
+    client = get_chroma_http_client()
+    host = socket.gethostname()
+    try:
+        lease = client.create_collection(HOST_LEASE_COLLECTION, metadata={"host": host, "renewed_at": now},
+                                         embedding_function=None)
+    except Exception:
+        # created by another process already
+        lease = client.get_collection(HOST_LEASE_COLLECTION, embedding_function=None)
+    holder = (lease.metadata or {}).get("host")
+    if holder != host and now - (lease.metadata or {}).get("renewed_at", 0) < lease_seconds:
+        raise HostLeaseError(f"The Chroma server at {chroma_server_url()} is in use by host {holder}; every process "
+                             f"using one server must run on one host (see CHROMA_HOST_LEASE_SECONDS)")
+    lease.modify(metadata={"host": host, "renewed_at": now})
+    _lease_renewed_at = now
+
+
+def vector_lock_path(collection_name: str) -> str:
+    return os.path.join(settings.TEXT_REPOSITORY_PATH, f"{collection_name}.vectors.lock")
+
+
+@contextmanager
+def vector_write_lock(collection_name: str, exclusive: bool = False, count_write: bool = False):
+    # writes to a collection, in every process, share its lock; a vacuum takes it alone while it swaps the
+    # collection under the name, so no write lands in the copy it is about to drop. A counted write appends a
+    # byte to the lock file before releasing it, so the file's size tells a vacuum whether anything was written
+    # while it copied
+    if uses_chroma_server():
+        check_host_lease()
+    os.makedirs(settings.TEXT_REPOSITORY_PATH, exist_ok=True)
+    with open(vector_lock_path(collection_name), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if count_write:
+                # also after a failed write, which may have stored part of its records
+                lock_file.write(".")
+                lock_file.flush()
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def vector_write_count(collection_name: str) -> int:
+    try:
+        return os.path.getsize(vector_lock_path(collection_name))
+    except FileNotFoundError:
+        return 0
+
+
+# Coalesces the writes that concurrent ingests make to one collection on the Chroma server. A write waits up to
+# CHROMA_WRITE_LINGER_MS for others to join it, or goes out as soon as CHROMA_WRITE_BATCH_SIZE chunks are queued;
+# at most CHROMA_WRITE_CONCURRENCY requests are in flight. Callers resume once their chunks are stored, or with
+# the error of the request that carried them.
+class ChromaBatchWriter:
+    def __init__(self, collection, batch_size: int, linger_seconds: float, concurrency: int):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queue: List[Tuple[Dict[str, list], asyncio.Future]] = []
+        self._queued = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._max_batch_size: Optional[int] = None
+        # the event loop only keeps weak references to tasks; held here until each write is done
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str],
+                  metadatas: List[Dict[str, Any]]) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append(({"ids": ids, "embeddings": embeddings, "documents": documents, "metadatas": metadatas},
+                            future))
+        self._queued += len(ids)
+        if self._queued >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger_seconds, self._flush)
+        await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        entries, self._queue, self._queued = self._queue, [], 0
+        if entries:
+            task = asyncio.get_running_loop().create_task(self._write(entries))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> None:
+        # sends what is still lingering and waits for every write in flight
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _send(self, batch: Dict[str, list]) -> None:
+        from chromadb.errors import InvalidCollectionException
+
+        if self._max_batch_size is None:
+            self._max_batch_size = self.collection._client.get_max_batch_size()
+        with vector_write_lock(self.collection.name, count_write=True):
+            for start in range(0, len(batch["ids"]), self._max_batch_size):
+                part = {field: values[start:start + self._max_batch_size] for field, values in batch.items()}
+                try:
+                    self.collection.add(**part)
+                except InvalidCollectionException:
+                    # a vacuum replaced the collection under its name; the write goes to the new one
+                    self.collection = get_chroma_http_client().get_collection(self.collection.name,
+                                                                              embedding_function=None)
+                    self.collection.add(**part)
+                VECTOR_WRITE_BATCH_SIZE.observe(len(part["ids"]))
+
+    async def _write(self, entries: List[Tuple[Dict[str, list], asyncio.Future]]) -> None:
+        batch = {field: [value for records, _ in entries for value in records[field]] for field in entries[0][0]}
+        async with self._semaphore:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._send, batch)
+            except Exception as e:
+                logger.error(f"Batched write of {len(batch['ids'])} chunks to {self.collection.name} failed: {e}")
+                for _, future in entries:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+        for _, future in entries:
+            if not future.done():
+                future.set_result(None)
+
+
+async def close_batch_writers() -> None:
+    # on shutdown, so no queued chunk is dropped with the event loop
+    writers = _writers.pop(asyncio.get_running_loop(), {})
+    await asyncio.gather(*(writer.close() for writer in writers.values()))
+
+
+def get_batch_writer(collection) -> ChromaBatchWriter:
+    # by collection id: a compacted collection is a new collection under the old name
+    writers = _writers.setdefault(asyncio.get_running_loop(), {})
+    key = str(collection.id)
+    if key not in writers:
+        writers[key] = ChromaBatchWriter(
+            collection, settings.CHROMA_WRITE_BATCH_SIZE, settings.CHROMA_WRITE_LINGER_MS / 1000,
+            settings.CHROMA_WRITE_CONCURRENCY
+        )
+    return writers[key]
@@ -1,43 +1,272 @@
 import os
+import uuid
+import hashlib
+import weakref
 import asyncio
 import logging
-from typing import List
+import threading
+import functools
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, TYPE_CHECKING
 from fastapi import HTTPException
-from langchain_core.documents import Document
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+from app.config import settings
+from app.core.embeddings.initializers import get_ko_sbert_nli_embedding
+from app.core.retrievers.search_filter import SearchFilter
+from app.repositories.chroma_client import (
+    uses_chroma_server, chroma_server_url, get_chroma_http_client, get_batch_writer, vector_write_lock,
+    vector_write_count
+)
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# records read per request when a collection is copied during compaction
+VACUUM_PAGE_SIZE = 1000
+
+# persistent mode: how many operations run on each chromadb System of this process, and the Systems that
+# reset_client_cache dropped from chromadb's cache; a dropped System is stopped once its last operation returns
+_systems_lock = threading.Lock()
+_system_users: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
+_retired_systems: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+
+def _release_system(system) -> None:
+    with _systems_lock:
+        _system_users[system] -= 1
+        stop = _system_users[system] == 0 and system in _retired_systems
+    if stop:
+        system.stop()
+
 
 class ChromaRepository:
     def __init__(self, collection_name: str, chroma_directory: str):
-        self.ko_embedding = HuggingFaceEmbeddings(model_name="upskyy/kf-deberta-multitask")
+        # shared, process-wide model instead of loading DeBERTa again for every repository
+        self.ko_embedding = get_ko_sbert_nli_embedding()
         self.collection_name = collection_name
-        self.persist_directory = f"{chroma_directory}/{collection_name}"
-        os.makedirs(self.persist_directory, exist_ok=True)
-        self.vectorstore = Chroma(
-            persist_directory=self.persist_directory,
-            embedding_function=self.ko_embedding,
-            collection_name=collection_name,
-            collection_metadata={"hnsw:space": "cosine"}
-        )
+        self.chroma_directory = chroma_directory
+        if uses_chroma_server():
+            # the collection lives on the shared Chroma server; chroma_directory is the server's concern
+            self.persist_directory = f"{chroma_server_url()}/{collection_name}"
+        else:
+            self.persist_directory = f"{chroma_directory}/{collection_name}"
+            os.makedirs(self.persist_directory, exist_ok=True)
+        self._open()
+
+    def _open(self) -> None:
+        from chromadb.api.client import SharedSystemClient
+        from langchain_community.vectorstores import Chroma
+
+        # the collection is looked up (or created) by name, which must not happen between a vacuum's renames
+        with vector_write_lock(self.collection_name):
+            if uses_chroma_server():
+                self.vectorstore = Chroma(
+                    client=get_chroma_http_client(),
+                    embedding_function=self.ko_embedding,
+                    collection_name=self.collection_name,
+                    collection_metadata={"hnsw:space": "cosine"}
+                )
+                self._system = None
+            else:
+                self.vectorstore = Chroma(
+                    persist_directory=self.persist_directory,
+                    embedding_function=self.ko_embedding,
+                    collection_name=self.collection_name,
+                    collection_metadata={"hnsw:space": "cosine"}
+                )
+                self._system = SharedSystemClient._identifier_to_system[self.persist_directory]
         self.retriever = self.vectorstore.as_retriever()
 
-    async def add_documents(self, doc_chunks: List[Document]):
+    def _call(self, operation: Callable[[], T], write: bool = False) -> T:
+        # runs one operation against the store while holding the System it uses, so a cache reset cannot stop
+        # the System under it; a repository whose System was reset since it opened reopens the store first.
+        # Writes also hold the collection's write lock, so a vacuum cannot swap the collection under them
+        from chromadb.errors import InvalidCollectionException
+
+        for attempt in range(2):
+            while True:
+                with _systems_lock:
+                    system = self._system
+                    if system is None or system not in _retired_systems:
+                        if system is not None:
+                            _system_users[system] = _system_users.get(system, 0) + 1
+                        break
+                self._open()
+            try:
+                if not write:
+                    return operation()
+                with vector_write_lock(self.collection_name, count_write=True):
+                    return operation()
+            except InvalidCollectionException:
+                if attempt:
+                    raise
+            finally:
+                if system is not None:
+                    _release_system(system)
+            # a vacuum, maybe in another process, replaced the collection since this repository opened it
+            self._open()
+
+    @staticmethod
+    def reset_client_cache(collection_name: str, chroma_directory: str) -> None:
+        # chromadb shares one System per persist directory inside a process; forgetting it makes the next
+        # repository re-read the on-disk segments, including writes made by other processes. The old System is
+        # stopped, releasing its sqlite connection and HNSW segments, as soon as no operation runs on it. A
+        # Chroma server already serves every process the same, current collection
+        from chromadb.api.client import SharedSystemClient
+
+        if uses_chroma_server():
+            return
+        system = SharedSystemClient._identifier_to_system.pop(f"{chroma_directory}/{collection_name}", None)
+        if system is None:
+            return
+        with _systems_lock:
+            _retired_systems.add(system)
+            stop = not _system_users.get(system)
+        if stop:
+            system.stop()
+
+    async def add_documents(self, doc_chunks: List["Document"]):
         try:
             loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, self.vectorstore.add_documents, doc_chunks)
+            await loop.run_in_executor(None, self._call, lambda: self.vectorstore.add_documents(doc_chunks), True)
             logger.debug(f"Added {len(doc_chunks)} documents to {self.collection_name}")
         except Exception as e:
             logger.error(f"Error in add_documents: {e}", extra={"collection_name": self.collection_name})
             raise HTTPException(status_code=500, detail=str(e))
 
-    async def get_relevant_documents(self, query: str, top_k=10) -> List[Document]:
+    @staticmethod
+    def _records(doc_chunks: List["Document"], embeddings: List[List[float]]) -> Dict[str, list]:
+        return {
+            "ids": [str(uuid.uuid4()) for _ in doc_chunks],
+            "embeddings": [list(map(float, embedding)) for embedding in embeddings],
+            "documents": [doc.page_content for doc in doc_chunks],
+            "metadatas": [doc.metadata for doc in doc_chunks]
+        }
+
+    async def add_embedded_documents(self, doc_chunks: List["Document"], embeddings: List[List[float]]):
+        # for chunks the caller already embedded; add_documents would run the model over them a second time
+        if not doc_chunks:
+            return
+        try:
+            records = self._records(doc_chunks, embeddings)
+            if uses_chroma_server():
+                # coalesced with the writes of other ingests running in this process
+                await get_batch_writer(self.vectorstore._collection).add(**records)
+            else:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(
+                    None, self._call, lambda: self.vectorstore._collection.add(**records), True
+                )
+            logger.debug(f"Added {len(doc_chunks)} embedded documents to {self.collection_name}")
+        except Exception as e:
+            logger.error(f"Error in add_embedded_documents: {e}", extra={"collection_name": self.collection_name})
+            raise HTTPException(status_code=500, detail=str(e))
+
+    def _delete_sources(self, file_names: List[str]) -> int:
+        return self._call(functools.partial(self._delete_collection_sources, file_names), write=True)
+
+    def _delete_collection_sources(self, file_names: List[str]) -> int:
+        collection = self.vectorstore._collection
+        # chunks stored before file_name existed are found by their upload path
+        legacy_sources = [os.path.join(settings.UPLOAD_DIR, file_name) for file_name in file_names]
+        ids = collection.get(where={"$or": [{"file_name": {"$in": file_names}}, {"source": {"$in": legacy_sources}}]},
+                             include=[])["ids"]
+        for start in range(0, len(ids), VACUUM_PAGE_SIZE):
+            collection.delete(ids=ids[start:start + VACUUM_PAGE_SIZE])
+        return len(ids)
+
+    async def delete_sources(self, file_names: List[str]) -> int:
+        # removes every chunk of the files by id; returns the number removed
+        try:
+            loop = asyncio.get_running_loop()
+            deleted = await loop.run_in_executor(None, self._delete_sources, file_names)
+            logger.info(f"Deleted {deleted} chunks of {file_names} from {self.collection_name}")
+            return deleted
+        except Exception as e:
+            logger.error(f"Error in delete_sources: {e}", extra={"collection_name": self.collection_name})
+            raise HTTPException(status_code=500, detail=str(e))
+
+    @staticmethod
+    def _copy_collection(source, target) -> int:
+        copied = 0
+        while True:
+            page = source.get(limit=VACUUM_PAGE_SIZE, offset=copied,
+                              include=["embeddings", "documents", "metadatas"])
+            if not page["ids"]:
+                return copied
+            target.add(ids=page["ids"], embeddings=page["embeddings"], documents=page["documents"],
+                       metadatas=page["metadatas"])
+            copied += len(page["ids"])
+
+    def vacuum(self) -> bool:
+        return self._call(self._vacuum)
+
+    def _vacuum(self) -> bool:
+        # chroma only marks deleted vectors in its HNSW index, so the live records are copied into a fresh
+        # collection of the same client that then takes over the name; the dropped collection's segments are
+        # deleted with it. Returns False, leaving the collection as it was, when a write arrived during the copy
+        source = self.vectorstore._collection
+        client = self.vectorstore._client
+        writes = vector_write_count(self.collection_name)
+        # names that fit chroma's 63 characters and stay apart for collections sharing a long prefix
+        suffix = hashlib.sha1(self.collection_name.encode("utf-8")).hexdigest()[:8]
+        compact_name = f"{self.collection_name[:46]}-{suffix}-compact"
+        retired_name = f"{self.collection_name[:46]}-{suffix}-retired"
+        for name in (compact_name, retired_name):
+            try:
+                client.delete_collection(name)
+            except Exception:
+                pass
+        target = client.create_collection(compact_name, metadata=source.metadata, embedding_function=None)
+        self._copy_collection(source, target)
+
+        # no process writes to or looks up the collection until the name points at the copy
+        with vector_write_lock(self.collection_name, exclusive=True):
+            if vector_write_count(self.collection_name) != writes:
+                client.delete_collection(compact_name)
+                return False
+            # renamed rather than deleted first, so the name is without a collection only between the two renames
+            source.modify(name=retired_name)
+            target.modify(name=self.collection_name)
+            client.delete_collection(retired_name)
+        self.vectorstore._collection = target
+        return True
+
+    def _nearest_similarities(self, embeddings: List[List[float]],
+                              search_filter: Optional[SearchFilter] = None) -> List[float]:
+        return self._call(functools.partial(self._query_nearest_similarities, embeddings, search_filter))
+
+    def _query_nearest_similarities(self, embeddings: List[List[float]],
+                                    search_filter: Optional[SearchFilter] = None) -> List[float]:
+        if not embeddings or self.vectorstore._collection.count() == 0:
+            return [0.0] * len(embeddings)
+        results = self.vectorstore._collection.query(query_embeddings=[list(map(float, e)) for e in embeddings],
+                                                     n_results=1, include=["distances"],
+                                                     where=search_filter.chroma_where() if search_filter else None)
+        return [1 - distances[0] if distances else 0.0 for distances in results["distances"]]
+
+    async def nearest_similarities(self, embeddings: List[List[float]],
+                                   search_filter: Optional[SearchFilter] = None) -> List[float]:
+        # cosine similarity of each embedding to its nearest stored chunk among those the filter admits (0 when
+        # there is none)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._nearest_similarities, embeddings, search_filter)
+        except Exception as e:
+            logger.error(f"Error in nearest_similarities: {e}", extra={"collection_name": self.collection_name})
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def get_relevant_documents(self, query: str, top_k=10) -> List["Document"]:
+        from langchain_core.documents import Document
+
         try:
             logger.info(f"Searching in {self.collection_name} for query: {query}")
             loop = asyncio.get_running_loop()
-            results = await loop.run_in_executor(None, self.vectorstore.similarity_search_with_score, query, top_k)
+            results = await loop.run_in_executor(
+                None, self._call, lambda: self.vectorstore.similarity_search_with_score(query, top_k)
+            )
             docs_with_scores = [
                 Document(page_content=doc.page_content, metadata={**doc.metadata, 'cosine_similarity': 1 - distance})
                 for doc, distance in results
@@ -50,11 +279,73 @@ class ChromaRepository:
             logger.error(f"Error in get_relevant_documents: {e}", extra={"collection_name": self.collection_name})
             raise HTTPException(status_code=500, detail=str(e))
 
-    async def get_all_documents(self) -> List[Document]:
+    def _query(self, query_embeddings: List[List[float]], top_k: int, include_embeddings: bool = False,
+               search_filter: Optional[SearchFilter] = None
+               ) -> List[List[Tuple[float, "Document", Optional[List[float]]]]]:
+        from langchain_core.documents import Document
+
+        # a single multi-vector query against the collection: (distance, document, stored embedding) per hit,
+        # nearest first; stored passage embeddings come back on request. A filter becomes the where clause, so
+        # chroma narrows the candidates by metadata before the vector search
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else [])
+        where = search_filter.chroma_where() if search_filter else None
+        results = self._call(lambda: self.vectorstore._collection.query(
+            query_embeddings=query_embeddings, n_results=top_k, where=where, include=include
+        ))
+        hits = []
+        for row, (texts, metadatas, distances) in enumerate(
+                zip(results["documents"], results["metadatas"], results["distances"])):
+            embeddings = results["embeddings"][row] if include_embeddings else [None] * len(texts)
+            hits.append([
+                (distance, Document(page_content=text, metadata=metadata or {}), embedding)
+                for text, metadata, distance, embedding in zip(texts, metadatas, distances, embeddings)
+            ])
+        return hits
+
+    def _search_by_vectors(self, query_embeddings: List[List[float]], top_k: int, include_embeddings: bool = False,
+                           search_filter: Optional[SearchFilter] = None
+                           ) -> List[List[Tuple["Document", Optional[List[float]]]]]:
+        return [[(document, embedding) for _, document, embedding in row]
+                for row in self._query(query_embeddings, top_k, include_embeddings, search_filter)]
+
+    def _search(self, query: str, top_k: int, search_filter: Optional[SearchFilter] = None
+                ) -> Tuple[List[float], List[Tuple["Document", Optional[List[float]]]]]:
+        query_embedding = self.ko_embedding.embed_query(query)
+        return query_embedding, self._search_by_vectors([query_embedding], top_k, True, search_filter)[0]
+
+    def _search_batch(self, queries: List[str], top_k: int, search_filter: Optional[SearchFilter] = None):
+        # one forward pass for every query
+        query_embeddings = self.ko_embedding.embed_documents(queries)
+        return query_embeddings, self._search_by_vectors(query_embeddings, top_k, True, search_filter)
+
+    async def search_with_embeddings(self, query: str, top_k: int = 4, search_filter: Optional[SearchFilter] = None):
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._search, query, top_k, search_filter)
+        except Exception as e:
+            logger.error(f"Error in search_with_embeddings: {e}", extra={"collection_name": self.collection_name})
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def search_batch_with_embeddings(self, queries: List[str], top_k: int = 4,
+                                           search_filter: Optional[SearchFilter] = None):
+        try:
+            logger.info(f"Batch searching {len(queries)} queries in {self.collection_name}")
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._search_batch, queries, top_k, search_filter)
+        except Exception as e:
+            logger.error(f"Error in search_batch_with_embeddings: {e}",
+                         extra={"collection_name": self.collection_name})
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def get_all_documents(self) -> List["Document"]:
+        from langchain_core.documents import Document
+
         try:
             query = ""  # empty query to fetch all documents
             loop = asyncio.get_running_loop()
-            results = await loop.run_in_executor(None, self.vectorstore.similarity_search_with_score, query, 1000)
+            results = await loop.run_in_executor(
+                None, self._call, lambda: self.vectorstore.similarity_search_with_score(query, 1000)
+            )
             documents = [Document(page_content=doc.page_content, metadata=doc.metadata) for doc, _ in results]
             logger.info(f"Loaded {len(documents)} documents from {self.collection_name}")
             return documents
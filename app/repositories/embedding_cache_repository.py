@@ -0,0 +1,176 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence
+import numpy as np
+from app.core.utils.metrics import CACHE_EVICTIONS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+
+# Embedding vectors of one model in a fixed-size float32 array on disk (mmap'd, so lookups copy rows straight
+# out of the page cache), with a SQLite index from key to array slot. Once every slot is taken, new vectors
+# overwrite the least recently read ones. Each slot also carries a tag derived from its key, written after the
+# vector, so a reader never returns a slot that another process is overwriting at the same moment, nor one whose
+# vector was lost in a crash. Reads only record their time in memory; the times are written with the next put
+# or once ACCESS_BATCH of them have gathered, so a lookup does not take the SQLite write lock.
+class EmbeddingCacheRepository:
+    ACCESS_BATCH = 256
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.database_path = os.path.join(directory, "index.sqlite3")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.tags_path = os.path.join(directory, "tags.u64")
+        self._vectors: Optional[np.memmap] = None
+        self._tags: Optional[np.memmap] = None
+        self._read_at: Dict[str, float] = {}
+        self._read_at_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.database_path, timeout=10)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _slots(connection: sqlite3.Connection, keys: Sequence[str]) -> Dict[str, int]:
+        # in batches, to stay under SQLite's bound parameter limit
+        slots = {}
+        for start in range(0, len(keys), 500):
+            batch = list(keys[start:start + 500])
+            slots.update(connection.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        return slots
+
+    @staticmethod
+    def _tag(key: str) -> int:
+        # keys are hex digests; 0 marks a slot being written
+        return int(key[:15], 16) | 1
+
+    def _open_arrays(self, connection: sqlite3.Connection, dimension: Optional[int]) -> bool:
+        # maps the arrays, creating them on the first write; a changed dimension or size limit starts over
+        if self._vectors is not None and (dimension is None or self._vectors.shape[1] == dimension):
+            return True
+        meta = dict(connection.execute("SELECT name, value FROM meta").fetchall())
+        if dimension is None:
+            if "dimension" not in meta:
+                return False
+            dimension = meta["dimension"]
+        capacity = max(1, self.max_bytes // (dimension * 4))
+        if meta.get("dimension") != dimension or meta.get("capacity") != capacity:
+            logger.info(f"Creating embedding cache in {self.directory} with {capacity} slots of {dimension} floats")
+            connection.execute("DELETE FROM entries")
+            connection.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                                   [("dimension", dimension), ("capacity", capacity), ("entries", 0)])
+            # sparse files: disk space is only used as slots are filled
+            for path, size in ((self.vectors_path, capacity * dimension * 4), (self.tags_path, capacity * 8)):
+                with open(path, "wb") as file:
+                    file.truncate(size)
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dimension))
+        self._tags = np.memmap(self.tags_path, dtype=np.uint64, mode="r+", shape=(capacity,))
+        return True
+
+    def _take_read_times(self, at_least: int = 0) -> Dict[str, float]:
+        with self._read_at_lock:
+            if len(self._read_at) < max(at_least, 1):
+                return {}
+            read_at, self._read_at = self._read_at, {}
+        return read_at
+
+    @staticmethod
+    def _write_read_times(connection: sqlite3.Connection, read_at: Dict[str, float]) -> None:
+        connection.executemany("UPDATE entries SET accessed_at = ? WHERE key = ?",
+                               [(accessed_at, key) for key, accessed_at in read_at.items()])
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        with self._connect() as connection:
+            if not self._open_arrays(connection, None):
+                return {}
+            found = {}
+            for key, slot in self._slots(connection, keys).items():
+                if slot >= len(self._tags):
+                    continue
+                vector = np.array(self._vectors[slot])
+                if int(self._tags[slot]) == self._tag(key):
+                    found[key] = vector
+            if found:
+                now = time.time()
+                with self._read_at_lock:
+                    self._read_at.update((key, now) for key in found)
+                read_at = self._take_read_times(self.ACCESS_BATCH)
+                if read_at:
+                    self._write_read_times(connection, read_at)
+        return found
+
+    @staticmethod
+    def _entry_count(connection: sqlite3.Connection) -> int:
+        # kept in meta by put_many, so it is not counted over the whole table on every write
+        row = connection.execute("SELECT value FROM meta WHERE name = 'entries'").fetchone()
+        if row is None:
+            # a cache written before the count was tracked
+            return connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return row[0]
+
+    def put_many(self, vectors: Dict[str, Sequence[float]]) -> Optional[int]:
+        # returns the number of cached vectors after the write, or None when nothing was written
+        if not vectors:
+            return None
+        dimension = len(next(iter(vectors.values())))
+        with self._connect() as connection:
+            # the write lock is held while slots are chosen, so two processes never pick the same slot
+            connection.execute("BEGIN IMMEDIATE")
+            # before the least recently read slots are picked for reuse
+            self._write_read_times(connection, self._take_read_times())
+            self._open_arrays(connection, dimension)
+            capacity = len(self._tags)
+            items = list(vectors.items())[-capacity:]
+            existing = self._slots(connection, [key for key, _ in items])
+            items = [(key, vector) for key, vector in items if key not in existing]
+            if not items:
+                return None
+
+            used = self._entry_count(connection)
+            slots = list(range(used, min(capacity, used + len(items))))
+            evicted = len(items) - len(slots)
+            if evicted:
+                oldest = connection.execute(
+                    "SELECT key, slot FROM entries ORDER BY accessed_at LIMIT ?", (evicted,)
+                ).fetchall()
+                connection.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in oldest])
+                slots.extend(slot for _, slot in oldest)
+                CACHE_EVICTIONS_TOTAL.inc(evicted, cache="embeddings")
+
+            now = time.time()
+            for (key, vector), slot in zip(items, slots):
+                self._tags[slot] = 0
+                self._vectors[slot] = vector
+                self._tags[slot] = self._tag(key)
+            connection.executemany("INSERT INTO entries (key, slot, accessed_at) VALUES (?, ?, ?)",
+                                   [(key, slot, now) for (key, _), slot in zip(items, slots)])
+            entries = used + len(items) - evicted
+            connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('entries', ?)", (entries,))
+        return entries
+
+    def count(self) -> int:
+        with self._connect() as connection:
+            return self._entry_count(connection)
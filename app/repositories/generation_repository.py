@@ -0,0 +1,51 @@
+import os
+import logging
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where only a single worker is supported
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRepository:
+    # On-disk generation counter per collection. Writers bump it after the stores and the BM25 snapshot
+    # are updated; every worker compares it with the generation it has loaded and reloads when it moved.
+
+    def __init__(self, repository_path: str) -> None:
+        self.repository_path = repository_path
+        os.makedirs(self.repository_path, exist_ok=True)
+
+    def marker_path(self, collection_name: str) -> str:
+        return os.path.join(self.repository_path, f"{collection_name}.generation")
+
+    def read(self, collection_name: str) -> int:
+        try:
+            with open(self.marker_path(collection_name), "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    @contextmanager
+    def _locked(self, collection_name: str):
+        with open(f"{self.marker_path(collection_name)}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def bump(self, collection_name: str) -> int:
+        with self._locked(collection_name):
+            generation = self.read(collection_name) + 1
+            file_path = self.marker_path(collection_name)
+            tmp_path = f"{file_path}.tmp.{os.getpid()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(str(generation))
+            os.replace(tmp_path, file_path)
+        logger.info(f"Collection '{collection_name}' is now at generation {generation}")
+        return generation
@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Any
+from app.core.utils.metrics import CACHE_EVICTIONS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Parsed PDF pages in one SQLite file, keyed by the PDF's content hash rather than its path, so a re-upload
+# under another name or a re-chunk with other settings never parses the document again. The file is bounded
+# by max_bytes; the least recently read pages are evicted first.
+class PageCacheRepository:
+    def __init__(self, database_path: str, max_bytes: int) -> None:
+        self.database_path = database_path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "pdf_hash TEXT NOT NULL, variant TEXT NOT NULL, page_number INTEGER NOT NULL, "
+                "page TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL, "
+                "PRIMARY KEY (pdf_hash, variant, page_number))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.database_path, timeout=10)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get_pages(self, pdf_hash: str, variant: str) -> Dict[int, Dict[str, Any]]:
+        # whatever pages of the document are still cached, by page number
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT page_number, page FROM pages WHERE pdf_hash = ? AND variant = ?", (pdf_hash, variant)
+            ).fetchall()
+            if rows:
+                connection.execute(
+                    "UPDATE pages SET accessed_at = ? WHERE pdf_hash = ? AND variant = ?",
+                    (time.time(), pdf_hash, variant)
+                )
+        return {page_number: json.loads(page) for page_number, page in rows}
+
+    def save_pages(self, pdf_hash: str, variant: str, pages: Dict[int, Dict[str, Any]]) -> None:
+        now = time.time()
+        encoded = [(page_number, json.dumps(page, ensure_ascii=False)) for page_number, page in pages.items()]
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO pages (pdf_hash, variant, page_number, page, size, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(pdf_hash, variant, page_number, page, len(page.encode("utf-8")), now)
+                 for page_number, page in encoded]
+            )
+            self._evict(connection)
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted: List[tuple] = []
+        for pdf_hash, variant, page_number, size in connection.execute(
+                "SELECT pdf_hash, variant, page_number, size FROM pages ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((pdf_hash, variant, page_number))
+            total -= size
+        connection.executemany(
+            "DELETE FROM pages WHERE pdf_hash = ? AND variant = ? AND page_number = ?", evicted
+        )
+        CACHE_EVICTIONS_TOTAL.inc(len(evicted), cache="pdf_pages")
+        logger.info(f"Evicted {len(evicted)} pages from the page cache")
@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+# Conversation sessions in one SQLite file, shared by every worker process. Each row carries a version
+# so a background compaction never overwrites a turn that was saved after it read the session.
+class SessionRepository:
+    def __init__(self, database_path: str, ttl_seconds: float) -> None:
+        self.database_path = database_path
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, summary TEXT NOT NULL, turns TEXT NOT NULL, "
+                "version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.database_path, timeout=10)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT summary, turns, version FROM sessions WHERE session_id = ? AND updated_at >= ?",
+                (session_id, time.time() - self.ttl_seconds)
+            ).fetchone()
+        if row is None:
+            return None
+        summary, turns, version = row
+        return {"session_id": session_id, "summary": summary, "turns": json.loads(turns), "version": version}
+
+    def save(self, session_id: str, summary: str, turns: List[Dict[str, str]],
+             expected_version: Optional[int] = None) -> bool:
+        # expected_version None creates or overwrites; otherwise the write only happens if nobody saved in between,
+        # where version 0 is a session that does not exist (or has expired)
+        now = time.time()
+        encoded_turns = json.dumps(turns, ensure_ascii=False)
+        with self._connect() as connection:
+            if expected_version == 0:
+                cursor = connection.execute(
+                    "INSERT INTO sessions (session_id, summary, turns, version, updated_at) VALUES (?, ?, ?, 1, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, turns = excluded.turns, "
+                    "version = sessions.version + 1, updated_at = excluded.updated_at "
+                    "WHERE sessions.updated_at < ?",
+                    (session_id, summary, encoded_turns, now, now - self.ttl_seconds)
+                )
+                saved = cursor.rowcount == 1
+            elif expected_version is None:
+                connection.execute(
+                    "INSERT INTO sessions (session_id, summary, turns, version, updated_at) VALUES (?, ?, ?, 1, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, turns = excluded.turns, "
+                    "version = sessions.version + 1, updated_at = excluded.updated_at",
+                    (session_id, summary, encoded_turns, now)
+                )
+                saved = True
+            else:
+                cursor = connection.execute(
+                    "UPDATE sessions SET summary = ?, turns = ?, version = version + 1, updated_at = ? "
+                    "WHERE session_id = ? AND version = ?",
+                    (summary, encoded_turns, now, session_id, expected_version)
+                )
+                saved = cursor.rowcount == 1
+            connection.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl_seconds,))
+        return saved
+
+    def delete(self, session_id: str) -> bool:
+        with self._connect() as connection:
+            cursor = connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return cursor.rowcount == 1
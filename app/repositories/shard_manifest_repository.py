@@ -0,0 +1,76 @@
+import os
+import json
+import hashlib
+import logging
+from typing import List, Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+def shard_names(collection_name: str, shard_count: int) -> List[str]:
+    # physical Chroma collections / text files of a logical collection; an unsharded collection is its own shard
+    if shard_count <= 1:
+        return [collection_name]
+    names = []
+    for index in range(shard_count):
+        suffix = f"-s{index}"
+        names.append(f"{collection_name[:63 - len(suffix)]}{suffix}")
+    return names
+
+
+def route(source: str, shard_count: int) -> int:
+    # by source document, so all chunks of a file live in one shard and a file can be removed from one place
+    if shard_count <= 1:
+        return 0
+    return int(hashlib.sha1(source.encode("utf-8")).hexdigest()[:8], 16) % shard_count
+
+
+# The shard layout of each logical collection, as {collection}.shards.json next to its text store. It is written
+# once, when a collection is first ingested, and read by every writer and worker, so they all agree on the layout
+# even when COLLECTION_SHARDS changes later. Collections without a manifest are unsharded.
+class ShardManifestRepository:
+    def __init__(self, repository_path: str) -> None:
+        self.repository_path = repository_path
+        os.makedirs(self.repository_path, exist_ok=True)
+
+    def manifest_path(self, collection_name: str) -> str:
+        return os.path.join(self.repository_path, f"{collection_name}.shards.json")
+
+    def read(self, collection_name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.manifest_path(collection_name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def shard_count(self, collection_name: str) -> int:
+        manifest = self.read(collection_name)
+        return manifest["shards"] if manifest else 1
+
+    def shard_names(self, collection_name: str) -> List[str]:
+        return shard_names(collection_name, self.shard_count(collection_name))
+
+    def ensure(self, collection_name: str, shard_count: int) -> int:
+        # the layout of the collection, fixing it to shard_count if the collection is new
+        manifest = self.read(collection_name)
+        if manifest:
+            return manifest["shards"]
+        already_ingested = any(os.path.exists(os.path.join(self.repository_path, f"{collection_name}{suffix}"))
+                               for suffix in (".jsonl", ".generation"))
+        if shard_count <= 1 or already_ingested:
+            # data written before sharding stays where it is
+            return 1
+
+        manifest = {
+            "collection": collection_name,
+            "shards": shard_count,
+            "routing": "sha1(source) % shards",
+            "names": shard_names(collection_name, shard_count)
+        }
+        file_path = self.manifest_path(collection_name)
+        tmp_path = f"{file_path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, file_path)
+        logger.info(f"Collection '{collection_name}' is split into {shard_count} shards")
+        return shard_count
@@ -0,0 +1,107 @@
+import heapq
+import asyncio
+import logging
+from itertools import islice
+from typing import Dict, List, Optional, TYPE_CHECKING, Union
+from fastapi import HTTPException
+from app.config import settings
+from app.repositories.chroma_repository import ChromaRepository
+from app.repositories.chroma_client import uses_chroma_server, chroma_server_url
+from app.core.retrievers.search_filter import SearchFilter
+from app.repositories.shard_manifest_repository import ShardManifestRepository, shard_names, route
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+
+def merge_top_k(shard_hits: List[list], top_k: int) -> list:
+    # every shard returns its hits nearest first; a heap merge of the sorted lists yields the global top k
+    return [(document, embedding) for _, document, embedding in
+            islice(heapq.merge(*shard_hits, key=lambda hit: hit[0]), top_k)]
+
+
+# A logical collection split into several physical Chroma collections. Writes go to the shard of each chunk's
+# source document; a query is embedded once, sent to every shard in parallel, and the per-shard results are
+# merged by distance. Offers the same search and write methods as ChromaRepository.
+class ShardedChromaRepository:
+    def __init__(self, collection_name: str, chroma_directory: str, shard_count: int):
+        self.collection_name = collection_name
+        self.shard_count = shard_count
+        self.shards = [ChromaRepository(name, chroma_directory) for name in shard_names(collection_name, shard_count)]
+        self.ko_embedding = self.shards[0].ko_embedding
+        location = chroma_server_url() if uses_chroma_server() else chroma_directory
+        self.persist_directory = f"{location}/{collection_name}-s[0-{shard_count - 1}]"
+
+    async def _fan_out(self, method: str, *args) -> list:
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(loop.run_in_executor(None, getattr(shard, method), *args)
+                                      for shard in self.shards))
+
+    async def add_embedded_documents(self, doc_chunks: List["Document"], embeddings: List[List[float]]):
+        by_shard: Dict[int, tuple] = {}
+        for document, embedding in zip(doc_chunks, embeddings):
+            documents, vectors = by_shard.setdefault(route(document.metadata["source"], self.shard_count), ([], []))
+            documents.append(document)
+            vectors.append(embedding)
+        await asyncio.gather(*(self.shards[index].add_embedded_documents(documents, vectors)
+                               for index, (documents, vectors) in by_shard.items()))
+
+    async def delete_sources(self, file_names: List[str]) -> int:
+        # every shard is asked: a file's shard follows from its upload path, which callers need not know
+        return sum(await asyncio.gather(*(shard.delete_sources(file_names) for shard in self.shards)))
+
+    def vacuum(self) -> bool:
+        return all([shard.vacuum() for shard in self.shards])
+
+    async def nearest_similarities(self, embeddings: List[List[float]],
+                                   search_filter: Optional[SearchFilter] = None) -> List[float]:
+        try:
+            per_shard = await self._fan_out("_nearest_similarities", embeddings, search_filter)
+            return [max(similarities) for similarities in zip(*per_shard)]
+        except Exception as e:
+            logger.error(f"Error in nearest_similarities: {e}", extra={"collection_name": self.collection_name})
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def search_with_embeddings(self, query: str, top_k: int = 4, search_filter: Optional[SearchFilter] = None):
+        try:
+            loop = asyncio.get_running_loop()
+            query_embedding = await loop.run_in_executor(None, self.ko_embedding.embed_query, query)
+            per_shard = await self._fan_out("_query", [query_embedding], top_k, True, search_filter)
+            return query_embedding, merge_top_k([hits[0] for hits in per_shard], top_k)
+        except Exception as e:
+            logger.error(f"Error in search_with_embeddings: {e}", extra={"collection_name": self.collection_name})
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def search_batch_with_embeddings(self, queries: List[str], top_k: int = 4,
+                                           search_filter: Optional[SearchFilter] = None):
+        try:
+            logger.info(f"Batch searching {len(queries)} queries in {self.shard_count} shards "
+                        f"of {self.collection_name}")
+            loop = asyncio.get_running_loop()
+            query_embeddings = await loop.run_in_executor(None, self.ko_embedding.embed_documents, queries)
+            per_shard = await self._fan_out("_query", query_embeddings, top_k, True, search_filter)
+            return query_embeddings, [merge_top_k([hits[row] for hits in per_shard], top_k)
+                                      for row in range(len(queries))]
+        except Exception as e:
+            logger.error(f"Error in search_batch_with_embeddings: {e}",
+                         extra={"collection_name": self.collection_name})
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+def open_chroma_repository(collection_name: str, chroma_directory: Optional[str] = None,
+                           shard_count: Optional[int] = None) -> Union[ChromaRepository, ShardedChromaRepository]:
+    # the vector store of a logical collection, in the layout recorded in its shard manifest
+    chroma_directory = chroma_directory or settings.CHROMA_DIRECTORY
+    if shard_count is None:
+        shard_count = ShardManifestRepository(settings.TEXT_REPOSITORY_PATH).shard_count(collection_name)
+    if shard_count <= 1:
+        return ChromaRepository(collection_name, chroma_directory)
+    return ShardedChromaRepository(collection_name, chroma_directory, shard_count)
+
+
+def reset_vector_store_cache(collection_name: str, chroma_directory: Optional[str] = None) -> None:
+    chroma_directory = chroma_directory or settings.CHROMA_DIRECTORY
+    for name in ShardManifestRepository(settings.TEXT_REPOSITORY_PATH).shard_names(collection_name):
+        ChromaRepository.reset_client_cache(name, chroma_directory)
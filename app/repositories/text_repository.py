@@ -1,45 +1,230 @@
 import os
 import json
+import time
+import hashlib
 import logging
-from typing import List
-from langchain_core.documents import Document
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+from app.core.retrievers.search_filter import metadata_file_name
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where only a single worker is supported
+    fcntl = None
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 logger = logging.getLogger(__name__)
 
 
+def is_deleted(line_number: int, metadata: Dict, tombstones: Dict[str, int]) -> bool:
+    before = tombstones.get(metadata_file_name(metadata))
+    return before is not None and line_number < before
+
+
+def _document_key(page_content: str, metadata: Dict) -> bytes:
+    # a digest rather than the text itself, so the keys of a large collection fit in memory
+    return hashlib.sha1(f"{page_content}\0{json.dumps(metadata, sort_keys=True)}".encode("utf-8")).digest()
+
+
+# Keys of the live documents of one collection file, as of `offset` bytes into it. save_documents brings them up
+# to date under the collection lock before it writes, reading only what other processes appended since; a new
+# tombstone or a compaction (a new file) makes it read the whole file again.
+class DocumentKeys:
+    def __init__(self) -> None:
+        self.keys: Set[bytes] = set()
+        self.offset = 0
+        self.version: Optional[Tuple[int, int]] = None
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self.keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
 class TextRepository:
     def __init__(self, repository_path: str) -> None:
         self.repository_path = repository_path
         os.makedirs(self.repository_path, exist_ok=True)
 
-    def save_documents(self, documents: List[Document], collection_name: str) -> None:
-        file_path = os.path.join(self.repository_path, f"{collection_name}.jsonl")
+    def file_path(self, collection_name: str) -> str:
+        return os.path.join(self.repository_path, f"{collection_name}.jsonl")
+
+    def tombstone_path(self, collection_name: str) -> str:
+        return os.path.join(self.repository_path, f"{collection_name}.tombstones.jsonl")
+
+    @contextmanager
+    def _locked(self, collection_name: str):
+        # appends, deletes and compaction of one collection file are serialized across processes
+        with open(f"{self.file_path(collection_name)}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def document_key(document: "Document") -> bytes:
+        return _document_key(document.page_content, document.metadata)
 
-        existing_documents = self.load_documents(collection_name)
-        existing_docs_set = set(
-            (doc.page_content, json.dumps(doc.metadata, sort_keys=True)) for doc in existing_documents)
+    def _keys_version(self, collection_name: str, file_stat: os.stat_result) -> Tuple[int, int]:
+        try:
+            tombstones_size = os.path.getsize(self.tombstone_path(collection_name))
+        except FileNotFoundError:
+            tombstones_size = 0
+        return file_stat.st_ino, tombstones_size
 
-        with open(file_path, "a", encoding="utf-8") as f:
-            for doc in documents:
-                json_doc = json.dumps(
-                    {"page_content": doc.page_content, "metadata": doc.metadata},
-                    ensure_ascii=False
-                )
+    def _update_keys(self, collection_name: str, keys: DocumentKeys) -> None:
+        file_path = self.file_path(collection_name)
+        try:
+            file_stat = os.stat(file_path)
+        except FileNotFoundError:
+            keys.keys, keys.offset, keys.version = set(), 0, None
+            return
+        version = self._keys_version(collection_name, file_stat)
+        tombstones = {}
+        if version != keys.version or file_stat.st_size < keys.offset:
+            keys.keys, keys.offset = set(), 0
+            tombstones = self.read_tombstones(collection_name)
+        # lines past the offset are newer than every tombstone the keys were read with, so only a full read
+        # has documents to skip
+        with open(file_path, "rb") as f:
+            f.seek(keys.offset)
+            for line_number, line in enumerate(f):
+                if not line.endswith(b"\n"):
+                    # a line still being written outside the lock; it is read on the next update
+                    break
+                json_doc = json.loads(line)
+                if not (tombstones and is_deleted(line_number, json_doc["metadata"], tombstones)):
+                    keys.keys.add(_document_key(json_doc["page_content"], json_doc["metadata"]))
+                keys.offset += len(line)
+        keys.version = version
+
+    def load_document_keys(self, collection_name: str) -> DocumentKeys:
+        keys = DocumentKeys()
+        self._update_keys(collection_name, keys)
+        return keys
 
-                if (doc.page_content, json.dumps(doc.metadata, sort_keys=True)) not in existing_docs_set:
-                    f.write(json_doc + "\n")
+    def save_documents(self, documents: List["Document"], collection_name: str,
+                       existing_keys: Optional[DocumentKeys] = None) -> None:
+        # existing_keys lets a caller that saves many batches keep the keys between calls, so each call reads
+        # only what was appended since the last one; it is updated with the documents written here
+        file_path = self.file_path(collection_name)
+        keys = existing_keys if existing_keys is not None else DocumentKeys()
+
+        with self._locked(collection_name):
+            # checked under the lock, so documents another worker saved since the keys were read are not
+            # written a second time
+            self._update_keys(collection_name, keys)
+            with open(file_path, "ab") as f:
+                for doc in documents:
+                    key = self.document_key(doc)
+                    if key not in keys:
+                        line = json.dumps({"page_content": doc.page_content, "metadata": doc.metadata},
+                                          ensure_ascii=False) + "\n"
+                        f.write(line.encode("utf-8"))
+                        keys.keys.add(key)
+                f.flush()
+                file_stat = os.fstat(f.fileno())
+            keys.offset = file_stat.st_size
+            keys.version = self._keys_version(collection_name, file_stat)
         logger.info(f"Saved {len(documents)} documents in {file_path}")
 
-    def load_documents(self, collection_name: str) -> List[Document]:
-        file_path = os.path.join(self.repository_path, f"{collection_name}.jsonl")
+    def load_documents(self, collection_name: str, include_deleted: bool = False) -> List["Document"]:
+        # with include_deleted, documents are returned in file order, so a document's position is its line number
+        from langchain_core.documents import Document
+
+        file_path = self.file_path(collection_name)
         if not os.path.exists(file_path):
             return []
 
+        tombstones = {} if include_deleted else self.read_tombstones(collection_name)
         documents = []
         with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
+            for line_number, line in enumerate(f):
                 json_doc = json.loads(line)
+                if tombstones and is_deleted(line_number, json_doc["metadata"], tombstones):
+                    continue
                 documents.append(Document(page_content=json_doc["page_content"], metadata=json_doc["metadata"]))
 
         logger.info(f"Loaded {len(documents)} documents from {file_path}")
         return documents
+
+    def _read_tombstone_records(self, collection_name: str) -> List[Dict]:
+        try:
+            with open(self.tombstone_path(collection_name), "r", encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def read_tombstones(self, collection_name: str) -> Dict[str, int]:
+        # file name -> number of lines the collection file had when the file was deleted; its documents above
+        # that line are dead, anything it had re-ingested later is not
+        tombstones: Dict[str, int] = {}
+        for record in self._read_tombstone_records(collection_name):
+            tombstones[record["file_name"]] = max(tombstones.get(record["file_name"], 0), record["before"])
+        return tombstones
+
+    def dead_documents(self, collection_name: str) -> Tuple[int, int]:
+        # (deleted documents still in the file, all documents in the file)
+        dead = sum(record["documents"] for record in self._read_tombstone_records(collection_name))
+        file_path = self.file_path(collection_name)
+        if not os.path.exists(file_path):
+            return dead, 0
+        with open(file_path, "rb") as f:
+            return dead, sum(1 for _ in f)
+
+    def delete_sources(self, collection_name: str, file_names: List[str]) -> int:
+        # tombstones every live document of the files; the file itself is rewritten by compact()
+        file_path = self.file_path(collection_name)
+        if not os.path.exists(file_path):
+            return 0
+
+        with self._locked(collection_name):
+            tombstones = self.read_tombstones(collection_name)
+            wanted = set(file_names)
+            counts: Dict[str, int] = {}
+            line_count = 0
+            with open(file_path, "r", encoding="utf-8") as f:
+                for line_count, line in enumerate(f, start=1):
+                    metadata = json.loads(line)["metadata"]
+                    file_name = metadata_file_name(metadata)
+                    if file_name in wanted and not is_deleted(line_count - 1, metadata, tombstones):
+                        counts[file_name] = counts.get(file_name, 0) + 1
+            if counts:
+                with open(self.tombstone_path(collection_name), "a", encoding="utf-8") as f:
+                    for file_name, documents in counts.items():
+                        f.write(json.dumps({"file_name": file_name, "before": line_count, "documents": documents,
+                                            "deleted_at": time.time()}, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+        deleted = sum(counts.values())
+        logger.info(f"Tombstoned {deleted} documents of {sorted(counts)} in {file_path}")
+        return deleted
+
+    def compact(self, collection_name: str) -> int:
+        # rewrites the collection file without its deleted documents and drops the tombstones; returns the
+        # number of documents removed
+        file_path = self.file_path(collection_name)
+        with self._locked(collection_name):
+            tombstones = self.read_tombstones(collection_name)
+            if not tombstones or not os.path.exists(file_path):
+                return 0
+            removed = 0
+            tmp_path = f"{file_path}.tmp.{os.getpid()}"
+            with open(file_path, "r", encoding="utf-8") as source, open(tmp_path, "w", encoding="utf-8") as target:
+                for line_number, line in enumerate(source):
+                    if is_deleted(line_number, json.loads(line)["metadata"], tombstones):
+                        removed += 1
+                    else:
+                        target.write(line)
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(tmp_path, file_path)
+            os.remove(self.tombstone_path(collection_name))
+        logger.info(f"Compacted {file_path}: removed {removed} deleted documents")
+        return removed
@@ -1,119 +1,415 @@
+import json
+import asyncio
+import hashlib
 import logging
-from langchain.chains import LLMChain
-from langchain_openai import ChatOpenAI
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from app.config import settings
 from app.models.state import initial_app_state
 from app.services.search_service import SearchService
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from app.core.utils.tracing import span
+from app.core.utils.cache_manager import CacheManager
+from app.core.retrievers.context_builder import ContextBuilder
+from app.core.retrievers.search_filter import SearchFilter
+from app.core.embeddings.initializers import get_ko_sbert_nli_embedding
+from app.core.utils.tokens import split_history_by_tokens
+from app.core.utils.circuit_breaker import CircuitOpenError
+from app.core.llm.client_pool import get_chat_models, get_circuit_breaker, transient_errors
+from app.core.utils.metrics import (
+    LLM_CALL_SECONDS, ERRORS_TOTAL, ANSWER_FALLBACKS_TOTAL, LLM_CALLS_TOTAL, LLM_RETRIES_TOTAL
+)
 
 logger = logging.getLogger(__name__)
 
 BLACKLIST_RESPONSE = "유효한 답변을 찾지 못했습니다. 다른 질문을 해주세요."
+FOLLOW_UP_HEADER = "추가로 다음에 대해 알아보시겠습니까?"
+rewrite_cache = CacheManager(name="query_rewrite", max_size=settings.REWRITE_CACHE_SIZE)
+
+
+def parse_structured_answer(text: str) -> Optional[Tuple[str, List[str]]]:
+    # accepts the JSON object alone, wrapped in a code fence, or with stray text around it
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        payload = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    answer = payload.get("answer")
+    follow_ups = payload.get("follow_up_questions", [])
+    if not isinstance(answer, str) or not answer.strip() or not isinstance(follow_ups, list):
+        return None
+    follow_ups = [question.strip() for question in follow_ups if isinstance(question, str) and question.strip()]
+    return answer.strip(), follow_ups[:2]
+
+
+def merge_relevant_docs(first: Dict[str, Any], second: Dict[str, Any]) -> Dict[str, Any]:
+    if second["status"] == "error":
+        return first
+    if first["status"] == "error":
+        return second
+    seen = {doc["page_content"] for doc in first["results"]}
+    results = first["results"] + [doc for doc in second["results"] if doc["page_content"] not in seen]
+    passage_embeddings = {**(first.get("passage_embeddings") or {}), **(second.get("passage_embeddings") or {})}
+    # relevance is judged against the rewritten query, which carries the context the raw one refers to
+    return {**first, "results": results, "passage_embeddings": passage_embeddings,
+            "query_embedding": second.get("query_embedding")}
+
+
+def document_prompt():
+    from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", "아래 문맥을 사용하여 사용자의 질문에 한글로 답변해주세요. 문맥에서 최대한 많은 정보를 추출하고 필요하면 추론하세요:\n\n{context}"),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("user", "{input}")
+        ]
+    )
+
+
+def format_response(answer: str, follow_up_questions: List[str]) -> str:
+    if not follow_up_questions:
+        return answer
+    return f"{answer}\n\n{FOLLOW_UP_HEADER}\n" + "\n".join(follow_up_questions)
 
 
 class AnswerService:
-    def __init__(self, model_name: Optional[str] = "gpt-3.5-turbo"):
+    def __init__(self, model_name: Optional[str] = "gpt-3.5-turbo", llm=None, fallback_on_open_circuit: bool = True):
         self.model_name = model_name
-        self.llm = ChatOpenAI(model_name=self.model_name)
+        if llm is None:
+            llm, self.structured_llm = get_chat_models(model_name)
+        else:
+            self.structured_llm = llm
+        self.llm = llm
+        self.circuit_breaker = get_circuit_breaker(model_name)
+        # callers that retry on their own (bulk jobs) get CircuitOpenError instead of the fallback answer
+        self.fallback_on_open_circuit = fallback_on_open_circuit
 
-    async def get_answer(self, query: str, chat_history: List[Dict[str, Any]], collection_name: str):
-        logger.info(f"Query: {query}")
-        logger.info(f"Chat History: {chat_history}")
-        logger.info(f"Using collection: {collection_name}")
+    async def _invoke(self, prompt, inputs: Dict[str, Any], stage: str, llm=None) -> str:
+        from langchain.chains import LLMChain
 
-        search_service = SearchService(collection_name=collection_name, query=query, app_state=initial_app_state)
-        relevant_docs = await search_service.get_relevant_documents()
+        chain = LLMChain(llm=llm or self.llm, prompt=prompt)
+        retrying = AsyncRetrying(stop=stop_after_attempt(settings.LLM_MAX_RETRIES + 1),
+                                 wait=wait_random_exponential(multiplier=0.5, max=8),
+                                 retry=retry_if_exception_type(transient_errors()), reraise=True)
+        async for attempt in retrying:
+            with attempt:
+                if attempt.retry_state.attempt_number > 1:
+                    LLM_RETRIES_TOTAL.inc(model=self.model_name)
+                try:
+                    self.circuit_breaker.before_call()
+                except CircuitOpenError:
+                    LLM_CALLS_TOTAL.inc(model=self.model_name, outcome="rejected")
+                    raise
+                try:
+                    with span(f"llm.{stage}", model_name=self.model_name), LLM_CALL_SECONDS.time(stage=stage):
+                        result = await chain.ainvoke(inputs)
+                except transient_errors():
+                    LLM_CALLS_TOTAL.inc(model=self.model_name, outcome="error")
+                    self.circuit_breaker.record_failure()
+                    raise
+                except Exception:
+                    # the provider answered, just not usably (bad request, auth, unparsable output): it is up
+                    LLM_CALLS_TOTAL.inc(model=self.model_name, outcome="error")
+                    self.circuit_breaker.record_success()
+                    raise
+                except BaseException:
+                    self.circuit_breaker.release_probe()
+                    raise
+                LLM_CALLS_TOTAL.inc(model=self.model_name, outcome="success")
+                self.circuit_breaker.record_success()
+        return result.get("text", "") if isinstance(result, Dict) else ""
 
-        if relevant_docs["status"] == "error":
+    async def _stream(self, prompt, inputs: Dict[str, Any], stage: str) -> AsyncIterator[str]:
+        # no retries here: once tokens have reached the client the call cannot be replayed
+        try:
+            self.circuit_breaker.before_call()
+        except CircuitOpenError:
+            LLM_CALLS_TOTAL.inc(model=self.model_name, outcome="rejected")
+            raise
+        try:
+            with span(f"llm.{stage}", model_name=self.model_name), LLM_CALL_SECONDS.time(stage=stage):
+                async for chunk in self.llm.astream(prompt.format_messages(**inputs)):
+                    if chunk.content:
+                        yield chunk.content
+        except transient_errors():
+            LLM_CALLS_TOTAL.inc(model=self.model_name, outcome="error")
+            self.circuit_breaker.record_failure()
+            raise
+        except Exception:
+            LLM_CALLS_TOTAL.inc(model=self.model_name, outcome="error")
+            self.circuit_breaker.record_success()
+            raise
+        except BaseException:
+            # GeneratorExit or CancelledError when the client disconnects mid-stream
+            self.circuit_breaker.release_probe()
+            raise
+        LLM_CALLS_TOTAL.inc(model=self.model_name, outcome="success")
+        self.circuit_breaker.record_success()
+
+    async def get_answer(self, query: str, chat_history: List[Dict[str, Any]], collection_name: str,
+                         relevant_docs: Optional[Dict[str, Any]] = None, summary: str = "",
+                         fast: Optional[bool] = None, search_filter: Optional[SearchFilter] = None):
+        try:
+            return await self._get_answer(query, chat_history, collection_name, relevant_docs, summary, fast,
+                                          search_filter)
+        except CircuitOpenError:
+            if not self.fallback_on_open_circuit:
+                raise
+            logger.warning(f"LLM circuit for {self.model_name} is open, answering with the fallback response")
+            return BLACKLIST_RESPONSE
+
+    async def _get_answer(self, query: str, chat_history: List[Dict[str, Any]], collection_name: str,
+                          relevant_docs: Optional[Dict[str, Any]], summary: str, fast: Optional[bool],
+                          search_filter: Optional[SearchFilter] = None):
+        prepared = await self._prepare(query, chat_history, collection_name, relevant_docs, summary, search_filter)
+        if prepared is None:
+            return BLACKLIST_RESPONSE
+        prepared_chat_history, context = prepared
+
+        if fast is None:
+            fast = settings.ANSWER_FAST_MODE
+        if fast:
+            response = await self._get_structured_answer(query, prepared_chat_history, context)
+            if response is not None:
+                return response
+            ANSWER_FALLBACKS_TOTAL.inc()
+            logger.warning("Structured answer could not be parsed, falling back to the multi-call path")
+
+        final_content = await self._invoke(
+            document_prompt(),
+            {
+                "chat_history": prepared_chat_history,
+                "input": query,
+                "context": context,
+            },
+            stage="answer"
+        )
+        logger.info(f"Extracted final content: {final_content}")
+
+        if not final_content:
+            ERRORS_TOTAL.inc(component="answer")
+            logger.error("응답에 유효한 콘텐츠가 포함되어 있지 않음")
             return BLACKLIST_RESPONSE
 
-        context = "\n".join([doc["page_content"] for doc in relevant_docs["results"]])
-        logger.info(f"Retrieved context: {context}")
+        if final_content.strip() == BLACKLIST_RESPONSE:
+            return final_content.strip()
+
+        follow_up_questions = await self._get_follow_up_questions(final_content, prepared_chat_history, context, query)
+        return format_response(final_content.strip(), follow_up_questions)
+
+    async def stream_answer(self, query: str, chat_history: List[Dict[str, Any]], collection_name: str,
+                            summary: str = "", search_filter: Optional[SearchFilter] = None) -> AsyncIterator[str]:
+        # yields the answer as the LLM produces it, then the follow-up block; the chunks joined together
+        # equal what get_answer returns. Streaming always takes the multi-call path: a JSON answer is only
+        # usable once it is complete
+        try:
+            prepared = await self._prepare(query, chat_history, collection_name, None, summary, search_filter)
+            if prepared is None:
+                yield BLACKLIST_RESPONSE
+                return
+            prepared_chat_history, context = prepared
 
+            parts = []
+            async for chunk in self._stream(
+                    document_prompt(),
+                    {
+                        "chat_history": prepared_chat_history,
+                        "input": query,
+                        "context": context,
+                    },
+                    stage="answer"):
+                parts.append(chunk)
+                yield chunk
+            final_content = "".join(parts)
+            logger.info(f"Extracted final content: {final_content}")
+            if not final_content.strip():
+                ERRORS_TOTAL.inc(component="answer")
+                logger.error("응답에 유효한 콘텐츠가 포함되어 있지 않음")
+                yield BLACKLIST_RESPONSE
+                return
+            if final_content.strip() == BLACKLIST_RESPONSE:
+                return
+
+            follow_up_questions = await self._get_follow_up_questions(
+                final_content, prepared_chat_history, context, query
+            )
+            if follow_up_questions:
+                yield format_response("", follow_up_questions)
+        except CircuitOpenError:
+            if not self.fallback_on_open_circuit:
+                raise
+            logger.warning(f"LLM circuit for {self.model_name} is open, answering with the fallback response")
+            yield BLACKLIST_RESPONSE
+
+    async def _prepare(self, query: str, chat_history: List[Dict[str, Any]], collection_name: str,
+                       relevant_docs: Optional[Dict[str, Any]], summary: str,
+                       search_filter: Optional[SearchFilter] = None) -> Optional[Tuple[List, str]]:
+        # the windowed chat history and the prompt context, or None when nothing relevant was retrieved
+        from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+        logger.info(f"Query: {query}")
+        logger.debug(f"Chat History: {chat_history}")
+        logger.info(f"Using collection: {collection_name}")
+
+        # chat_history is chronological; only the newest turns within the token budget are sent to the LLM
+        _, recent_history = split_history_by_tokens(chat_history, settings.CHAT_HISTORY_TOKEN_BUDGET, self.model_name)
         prepared_chat_history = [
             HumanMessage(content=entry["content"]) if entry["role"] == "user" else AIMessage(content=entry["content"])
-            for entry in chat_history
+            for entry in recent_history
         ]
-        logger.info(f"Prepared Chat History: {prepared_chat_history}")
+        if summary:
+            prepared_chat_history.insert(0, SystemMessage(content=f"이전 대화 요약:\n{summary}"))
+        logger.debug(f"Prepared Chat History: {prepared_chat_history}")
 
-        retriever_prompt = ChatPromptTemplate.from_messages(
+        # the raw query is searched while the history-aware rewrite is generated; the rewrite only runs when there
+        # is history to resolve references against, and its results are merged into the raw query's
+        # (bulk jobs retrieve for many questions at once and pass the results in)
+        retrieval = self._retrieve(query, collection_name, search_filter=search_filter) \
+            if relevant_docs is None else None
+        rewrite = self.rewrite_query(query, recent_history, summary, prepared_chat_history) \
+            if prepared_chat_history else None
+        if retrieval is not None and rewrite is not None:
+            relevant_docs, search_query = await asyncio.gather(retrieval, rewrite)
+        else:
+            relevant_docs = await retrieval if retrieval is not None else relevant_docs
+            search_query = await rewrite if rewrite is not None else query
+
+        if search_query != query:
+            logger.info(f"Rewritten search query: {search_query}")
+            rewritten_docs = await self._retrieve(search_query, collection_name, stage="retrieval.rewritten_query",
+                                                  search_filter=search_filter)
+            relevant_docs = merge_relevant_docs(relevant_docs, rewritten_docs)
+
+        if relevant_docs["status"] == "error":
+            return None
+
+        context_builder = ContextBuilder(
+            get_ko_sbert_nli_embedding(), self.model_name, settings.CONTEXT_TOKEN_BUDGET,
+            lambda_mult=settings.CONTEXT_MMR_LAMBDA, duplicate_threshold=settings.CONTEXT_DUPLICATE_THRESHOLD
+        )
+        loop = asyncio.get_running_loop()
+        with span("context_build"):
+            context_docs = await loop.run_in_executor(
+                None, context_builder.build, search_query, relevant_docs["results"],
+                relevant_docs.get("query_embedding"), relevant_docs.get("passage_embeddings")
+            )
+        context = "\n".join([doc["page_content"] for doc in context_docs])
+        logger.debug(f"Retrieved context: {context}")
+        return prepared_chat_history, context
+
+    async def _get_follow_up_questions(self, final_content: str, prepared_chat_history: List, context: str,
+                                       query: str) -> List[str]:
+        from langchain.prompts import ChatPromptTemplate
+
+        follow_up_prompt = ChatPromptTemplate.from_messages(
             [
-                MessagesPlaceholder(variable_name="chat_history"),
-                ("user", "{input}"),
-                ("user", "대화에서 얻은 정보를 바탕으로 관련 문서를 검색하기 위한 쿼리를 생성해주세요.")
+                ("system", f"다음 답변을 바탕으로: '{final_content.strip()}'"),
+                ("user", "위의 내용을 바탕으로 추가로 궁금해할 수 있는 질문을 두 개만 생성하여 "
+                         "번호를 붙여주세요. 다만, 답변이 명확하지 않은 경우, 또는 답변을 하지 못했을 경우에는 후속 질문을 생성하지 말아주세요.")
             ]
         )
-        retriever_chain = LLMChain(llm=self.llm, prompt=retriever_prompt)
-        retriever_results = retriever_chain.invoke(
+        follow_up_question = (await self._invoke(
+            follow_up_prompt,
             {
                 "chat_history": prepared_chat_history,
+                "context": context,
                 "input": query,
-            }
-        )
-        retriever_results_content = (
-            "\n".join([doc["content"] for doc in retriever_results]) if isinstance(retriever_results, list) else ""
-        )
-        context_with_documents = f"{context}\n{retriever_results_content}"
-        logger.info(f"Combined context with documents: {context_with_documents}")
+            },
+            stage="follow_up"
+        )).strip()
+        logger.info(f"Follow-up Question: {follow_up_question}")
+        return [q.strip() for q in follow_up_question.split('\n')[:2] if q.strip()]
+
+    async def _retrieve(self, query: str, collection_name: str, stage: str = "retrieval",
+                        search_filter: Optional[SearchFilter] = None) -> Dict[str, Any]:
+        search_service = SearchService(collection_name=collection_name, query=query, app_state=initial_app_state,
+                                       search_filter=search_filter)
+        with span(stage, collection_name=collection_name):
+            return await search_service.get_relevant_documents(include_embeddings=True)
 
-        document_prompt = ChatPromptTemplate.from_messages(
+    async def rewrite_query(self, query: str, recent_history: List[Dict[str, Any]], summary: str,
+                            prepared_chat_history: List) -> str:
+        from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+        history_digest = hashlib.sha256(
+            json.dumps([summary, recent_history], ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        cache_key = (self.model_name, history_digest, query)
+        cached = rewrite_cache.get_from_cache(cache_key)
+        if cached is not None:
+            return cached
+
+        retriever_prompt = ChatPromptTemplate.from_messages(
             [
-                ("system", "아래 문맥을 사용하여 사용자의 질문에 한글로 답변해주세요. 문맥에서 최대한 많은 정보를 추출하고 필요하면 추론하세요:\n\n{context}"),
                 MessagesPlaceholder(variable_name="chat_history"),
-                ("user", "{input}")
+                ("user", "{input}"),
+                ("user", "대화에서 얻은 정보를 바탕으로 관련 문서를 검색하기 위한 쿼리를 생성해주세요. 설명 없이 검색 쿼리 한 줄만 출력하세요.")
             ]
         )
-        document_chain = LLMChain(llm=self.llm, prompt=document_prompt)
-        result = document_chain.invoke(
+        text = await self._invoke(
+            retriever_prompt,
             {
                 "chat_history": prepared_chat_history,
                 "input": query,
-                "context": context_with_documents,
-            }
+            },
+            stage="query_rewrite"
         )
-        final_content = result.get("text", "") if isinstance(result, Dict) else ""
-        logger.info(f"Extracted final content: {final_content}")
-
-        if not final_content:
-            logger.error("응답에 유효한 콘텐츠가 포함되어 있지 않음")
-            return BLACKLIST_RESPONSE
+        lines = [line.strip().strip('"\'') for line in text.strip().splitlines() if line.strip()]
+        rewritten = lines[0] if lines else query
+        rewrite_cache.add_to_cache(cache_key, rewritten)
+        return rewritten
 
-        chat_history.insert(0, {"role": "assistant", "content": final_content.strip()})
-        chat_history.insert(0, {"role": "user", "content": query})
+    async def _get_structured_answer(self, query: str, prepared_chat_history: List, context: str) -> Optional[str]:
+        from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 
-        if final_content.strip() == BLACKLIST_RESPONSE:
-            return final_content.strip()
-
-        follow_up_prompt = ChatPromptTemplate.from_messages(
+        structured_prompt = ChatPromptTemplate.from_messages(
             [
-                ("system", f"다음 답변을 바탕으로: '{final_content.strip()}'"),
-                ("user", "위의 내용을 바탕으로 추가로 궁금해할 수 있는 질문을 두 개만 생성하여 "
-                         "번호를 붙여주세요. 다만, 답변이 명확하지 않은 경우, 또는 답변을 하지 못했을 경우에는 후속 질문을 생성하지 말아주세요.")
+                ("system", "아래 문맥을 사용하여 사용자의 질문에 한글로 답변해주세요. 문맥에서 최대한 많은 정보를 추출하고 필요하면 추론하세요. "
+                           "그리고 답변을 바탕으로 사용자가 추가로 궁금해할 수 있는 질문을 두 개 만들어 번호를 붙여주세요. "
+                           "답변이 명확하지 않거나 답변을 하지 못한 경우에는 후속 질문을 빈 목록으로 두세요. "
+                           "반드시 다음 형식의 JSON 객체 하나만 출력하세요: "
+                           '{{"answer": "답변", "follow_up_questions": ["1. 질문", "2. 질문"]}}\n\n{context}'),
+                MessagesPlaceholder(variable_name="chat_history"),
+                ("user", "{input}")
             ]
         )
-        follow_up_chain = LLMChain(llm=self.llm, prompt=follow_up_prompt)
-        follow_up_result = follow_up_chain.invoke(
+        text = await self._invoke(
+            structured_prompt,
             {
                 "chat_history": prepared_chat_history,
-                "context": context_with_documents,
                 "input": query,
-            }
+                "context": context,
+            },
+            stage="structured_answer",
+            llm=self.structured_llm
         )
-        follow_up_question = follow_up_result.get("text", "").strip() if isinstance(follow_up_result, Dict) else ""
-        logger.info(f"Follow-up Question: {follow_up_question}")
+        parsed = parse_structured_answer(text)
+        if parsed is None:
+            return None
 
-        if follow_up_question:
-            follow_up_questions = follow_up_question.split('\n')[:2]
-            follow_up_questions = [q.strip() for q in follow_up_questions if q.strip()]
+        answer, follow_up_questions = parsed
+        logger.info(f"Extracted final content: {answer}")
+        if answer == BLACKLIST_RESPONSE:
+            return answer
+        return format_response(answer, follow_up_questions)
 
-            if follow_up_questions:
-                follow_up_list = "\n".join(follow_up_questions)
-                combined_response = f"{final_content.strip()}\n\n추가로 다음에 대해 알아보시겠습니까?\n{follow_up_list}"
-            else:
-                combined_response = final_content.strip()
-        else:
-            combined_response = final_content.strip()
+    async def summarize_history(self, summary: str, turns: List[Dict[str, Any]]) -> str:
+        from langchain.prompts import ChatPromptTemplate
 
-        chat_history.insert(0, {"role": "assistant", "content": combined_response})
-        return combined_response
+        conversation = "\n".join(
+            f"{'사용자' if entry['role'] == 'user' else '어시스턴트'}: {entry['content']}" for entry in turns
+        )
+        summary_prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", "기존 대화 요약과 그 이후의 대화를 하나의 요약으로 합쳐주세요. 이후 질문에 답하는 데 필요한 "
+                           "사실, 사용자의 관심사, 언급된 문서와 조건을 빠짐없이 포함하되 한글로 간결하게 작성하세요."),
+                ("user", "기존 요약:\n{summary}\n\n이후 대화:\n{conversation}")
+            ]
+        )
+        text = await self._invoke(summary_prompt, {"summary": summary or "없음", "conversation": conversation},
+                                  stage="summarize")
+        return text.strip()
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Optional, List, Dict, Any, Set
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from app.config import settings
+from app.models.state import AppState
+from app.services.answer_service import AnswerService
+from app.services.search_service import BatchSearchService
+from app.core.utils.circuit_breaker import CircuitOpenError
+from app.core.llm.client_pool import transient_errors
+from app.core.utils.rate_limiter import RateLimiter
+from app.core.utils.tokens import count_tokens
+from app.core.utils.metrics import BULK_ANSWERS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# completion tokens reserved per call when estimating a question's share of the tokens-per-minute budget
+COMPLETION_TOKEN_ALLOWANCE = 256
+
+
+def llm_calls_per_question(fast: bool) -> int:
+    # bulk questions carry no chat history, so get_answer skips the query rewrite: one structured call in fast
+    # mode, otherwise the answer and the follow-up questions
+    return 1 if fast else 2
+
+
+def read_questions(input_path: str) -> List[Dict[str, Any]]:
+    questions = []
+    with open(input_path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            question = record.get("question") or record.get("query")
+            if not question:
+                logger.warning(f"Skipping line {line_number} of {input_path}: no question")
+                continue
+            questions.append({"id": str(record.get("id", line_number)), "question": question})
+    return questions
+
+
+def read_completed_ids(output_path: str) -> Set[str]:
+    # the output file doubles as the checkpoint: anything answered there is not asked again on resume
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut off by a crash mid-write
+                continue
+            if "answer" in record:
+                completed.add(record["id"])
+    return completed
+
+
+def ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b"\n"
+
+
+class BulkAnswerJob:
+    def __init__(self, job_id: str, input_path: str, output_path: str, collection_name: str, app_state: AppState,
+                 model_name: str = "gpt-3.5-turbo", concurrency: int = settings.BULK_CONCURRENCY,
+                 batch_size: int = settings.BULK_BATCH_SIZE, max_attempts: int = settings.BULK_MAX_ATTEMPTS,
+                 requests_per_minute: int = settings.OPENAI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = settings.OPENAI_TOKENS_PER_MINUTE, llm=None):
+        self.job_id = job_id
+        self.input_path = input_path
+        self.output_path = output_path
+        self.collection_name = collection_name
+        self.app_state = app_state
+        self.model_name = model_name
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.answer_service = AnswerService(model_name=model_name, llm=llm, fallback_on_open_circuit=False)
+        # fixed for the job, so the calls reserved per question are the calls get_answer makes
+        self.fast = settings.ANSWER_FAST_MODE
+        self.llm_calls = llm_calls_per_question(self.fast)
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.total = 0
+        self.skipped = 0
+        self.answered = 0
+        self.failed = 0
+        self.task: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "collection_name": self.collection_name,
+            "model_name": self.model_name,
+            "total": self.total,
+            "skipped": self.skipped,
+            "answered": self.answered,
+            "failed": self.failed,
+            "error": self.error
+        }
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def run(self) -> Dict[str, Any]:
+        self.status = "running"
+        tasks: List[asyncio.Task] = []
+        try:
+            questions = read_questions(self.input_path)
+            completed = read_completed_ids(self.output_path)
+            pending = [item for item in questions if item["id"] not in completed]
+            self.total = len(questions)
+            self.skipped = len(questions) - len(pending)
+            logger.info(f"Bulk job {self.job_id}: {len(pending)} of {len(questions)} questions to answer")
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+            semaphore = asyncio.Semaphore(self.concurrency)
+            with open(self.output_path, "a", encoding="utf-8") as output:
+                if output.tell() > 0 and not ends_with_newline(self.output_path):
+                    # close off a line cut short by a crash so the next record starts on its own line
+                    output.write("\n")
+                for start in range(0, len(pending), self.batch_size):
+                    batch = pending[start:start + self.batch_size]
+                    search_service = BatchSearchService(
+                        self.collection_name, [item["question"] for item in batch], self.app_state
+                    )
+                    retrieved = await search_service.get_relevant_documents(include_embeddings=True)
+                    for item, result in zip(batch, retrieved["results"]):
+                        # waiting here keeps retrieval at most one batch ahead of the LLM calls
+                        await semaphore.acquire()
+                        tasks.append(asyncio.create_task(self._answer(item, result, output, semaphore)))
+                await asyncio.gather(*tasks)
+
+            self.status = "completed"
+            logger.info(f"Bulk job {self.job_id} finished: {self.answered} answered, {self.failed} failed")
+        except Exception as e:
+            for task in tasks:
+                task.cancel()
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Bulk job {self.job_id} failed: {e}", exc_info=True)
+        return self.to_dict()
+
+    def _estimate_tokens(self, question: str, documents: List[Dict[str, Any]]) -> int:
+        context_tokens = sum(count_tokens(doc["page_content"], self.model_name) for doc in documents)
+        question_tokens = count_tokens(question, self.model_name)
+        return context_tokens + self.llm_calls * (question_tokens + COMPLETION_TOKEN_ALLOWANCE)
+
+    async def _answer(self, item: Dict[str, Any], retrieved: Dict[str, Any], output,
+                      semaphore: asyncio.Semaphore) -> None:
+        started_at = time.perf_counter()
+        documents = retrieved["results"]
+        relevant_docs = {**retrieved, "status": "success" if documents else "error"}
+        estimated_tokens = self._estimate_tokens(item["question"], documents)
+        try:
+            # get_answer already retries each call on transient errors; a question is asked again only once the
+            # circuit is open or those retries ran out, and other errors fail it at once
+            async for attempt in AsyncRetrying(stop=stop_after_attempt(self.max_attempts),
+                                               wait=wait_random_exponential(multiplier=1, max=60),
+                                               retry=retry_if_exception_type((CircuitOpenError,) + transient_errors()),
+                                               reraise=True):
+                with attempt:
+                    await self.rate_limiter.acquire(estimated_tokens, requests=self.llm_calls)
+                    answer = await self.answer_service.get_answer(
+                        item["question"], [], self.collection_name, relevant_docs=relevant_docs, fast=self.fast
+                    )
+            record = {
+                "id": item["id"],
+                "question": item["question"],
+                "answer": answer,
+                "sources": sorted({doc["metadata"].get("source", "") for doc in documents}),
+                "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 1)
+            }
+            self.answered += 1
+            BULK_ANSWERS_TOTAL.inc(status="answered")
+        except Exception as e:
+            logger.error(f"Bulk job {self.job_id}: question {item['id']} failed: {e}")
+            record = {"id": item["id"], "question": item["question"], "error": str(e)}
+            self.failed += 1
+            BULK_ANSWERS_TOTAL.inc(status="failed")
+        finally:
+            semaphore.release()
+
+        async with self._write_lock:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
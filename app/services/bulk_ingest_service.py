@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Set
+from app.config import settings
+from app.models.state import initial_app_state
+from app.repositories.text_repository import TextRepository
+from app.repositories.sharded_chroma_repository import open_chroma_repository
+from app.core.utils.progress_utils import get_tqdm
+from app.core.utils.common import validate_collection_name
+from app.core.utils.metrics import CHUNKS_INGESTED_TOTAL, ERRORS_TOTAL
+from app.core.embeddings.initializers import get_ko_sbert_nli_embedding, publish_bm25_retriever
+from app.repositories.shard_manifest_repository import shard_names
+from app.services.bulk_answer_service import ends_with_newline
+from app.services.ingest_service import (
+    embed_unique_chunks, create_vector_chunks, create_bm25_chunks, ingest_shard_count,
+    text_shard_name
+)
+
+logger = logging.getLogger(__name__)
+
+
+def list_pdf_files(directory: str) -> List[str]:
+    # sorted, so the shards and the order of writes are the same on every run
+    paths = []
+    for root, _, file_names in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in file_names if name.lower().endswith(".pdf"))
+    return sorted(paths)
+
+
+def read_ingested_files(checkpoint_path: str) -> Set[str]:
+    # files whose chunks reached both stores; failed files are not recorded as ingested and are retried
+    ingested = set()
+    if not os.path.exists(checkpoint_path):
+        return ingested
+    with open(checkpoint_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut off by a crash mid-write
+                continue
+            if "error" not in record:
+                ingested.add(record["file"])
+    return ingested
+
+
+def _init_worker() -> None:
+    # only the parent draws a progress bar; each worker OCRs its own scanned pages instead of starting an OCR
+    # pool of its own, so the job runs one process per worker rather than workers x OCR_WORKERS
+    settings.PROGRESS_MODE = "metrics"
+    settings.OCR_WORKERS = 0
+
+
+def prepare_file(file_path: str, text_chunk_size: int) -> Dict[str, Any]:
+    # runs in a pool worker: PDF parsing (and OCR), chunking for both stores; never raises, so an unreadable
+    # file is reported instead of breaking the pool
+    try:
+        return {
+            "file": file_path,
+            "vector_chunks": create_vector_chunks(file_path),
+            "text_chunks": create_bm25_chunks(file_path, text_chunk_size)
+        }
+    except Exception as e:
+        return {"file": file_path, "error": getattr(e, "detail", None) or str(e)}
+
+
+# Offline ingest of a whole directory. Files are parsed and chunked in a process pool; this process is the only
+# writer: it embeds the chunks of several files per model call and writes both stores, then records the files
+# in the checkpoint. A rerun with the same checkpoint skips files already recorded there.
+class BulkIngestJob:
+    def __init__(self, directory: str, collection_name: str, checkpoint_path: str,
+                 workers: int = settings.BULK_INGEST_WORKERS, batch_size: int = settings.BULK_INGEST_BATCH_SIZE,
+                 text_chunk_size: int = 200):
+        self.directory = directory
+        self.collection_name = validate_collection_name(collection_name)
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.text_chunk_size = text_chunk_size
+        self.summary = {"files": 0, "skipped": 0, "ingested": 0, "failed": 0, "vector_chunks": 0, "text_chunks": 0}
+        self._pending: List[Dict[str, Any]] = []
+
+    def _record(self, records: List[Dict[str, Any]]) -> None:
+        with open(self.checkpoint_path, "a", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    async def _flush(self) -> None:
+        # writes the pending files to both stores, then checkpoints them; a crash in between re-ingests them
+        # on resume, where the vector dedup and the text keys keep the stores free of second copies
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        chunks = [chunk for prepared in pending for chunk in prepared["vector_chunks"]]
+        # every file is whole within one flush, so its deduplicator does not outlive it
+        kept, embeddings = await embed_unique_chunks(chunks, self.ko_embedding, self.chroma_repo,
+                                                     {} if settings.DEDUP_ENABLED else None)
+        await self.chroma_repo.add_embedded_documents([chunks[index] for index in kept], embeddings)
+        CHUNKS_INGESTED_TOTAL.inc(len(kept), store="vector")
+
+        text_documents = {}
+        for prepared in pending:
+            shard = text_shard_name(self.collection_name, self.shard_count, prepared["file"])
+            text_documents.setdefault(shard, []).extend(prepared["text_chunks"])
+        for shard, documents in text_documents.items():
+            self.text_repo.save_documents(documents, shard, existing_keys=self.text_keys[shard])
+        text_chunks = sum(len(documents) for documents in text_documents.values())
+        CHUNKS_INGESTED_TOTAL.inc(text_chunks, store="text")
+
+        self._record([{"file": prepared["file"], "vector_chunks": len(prepared["vector_chunks"]),
+                       "text_chunks": len(prepared["text_chunks"])} for prepared in pending])
+        self.summary["ingested"] += len(pending)
+        self.summary["vector_chunks"] += len(kept)
+        self.summary["text_chunks"] += text_chunks
+
+    async def run(self) -> Dict[str, Any]:
+        started_at = time.perf_counter()
+        files = list_pdf_files(self.directory)
+        ingested = read_ingested_files(self.checkpoint_path)
+        todo = [file_path for file_path in files if file_path not in ingested]
+        self.summary.update(files=len(files), skipped=len(files) - len(todo))
+        logger.info(f"Bulk ingest of {self.directory} into {self.collection_name}: {len(todo)} of {len(files)} "
+                    f"files to go, {self.workers} workers")
+        os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+        if os.path.exists(self.checkpoint_path) and os.path.getsize(self.checkpoint_path) \
+                and not ends_with_newline(self.checkpoint_path):
+            # close the line a crash cut off, so the next record starts on its own line
+            with open(self.checkpoint_path, "a", encoding="utf-8") as file:
+                file.write("\n")
+
+        loop = asyncio.get_running_loop()
+        self.ko_embedding = await loop.run_in_executor(None, get_ko_sbert_nli_embedding)
+        self.shard_count = ingest_shard_count(self.collection_name)
+        self.chroma_repo = open_chroma_repository(self.collection_name, settings.CHROMA_DIRECTORY,
+                                                  shard_count=self.shard_count)
+        self.text_repo = TextRepository(settings.TEXT_REPOSITORY_PATH)
+        self.text_keys = {shard: self.text_repo.load_document_keys(shard)
+                          for shard in shard_names(self.collection_name, self.shard_count)}
+
+        # spawned rather than forked: this process holds the embedding model and chromadb threads
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker)
+        try:
+            remaining = deque(todo)
+            in_flight = deque()
+            with get_tqdm(total=len(todo), desc="Bulk ingest") as pbar:
+                while remaining or in_flight:
+                    # a bounded window of parsed files waiting for the writer keeps memory flat
+                    while remaining and len(in_flight) < self.workers * 2:
+                        in_flight.append(loop.run_in_executor(pool, prepare_file, remaining.popleft(),
+                                                              self.text_chunk_size))
+                    prepared = await in_flight.popleft()
+                    pbar.update(1)
+                    if "error" in prepared:
+                        ERRORS_TOTAL.inc(component="ingest")
+                        logger.error(f"Skipping {prepared['file']}: {prepared['error']}")
+                        self._record([prepared])
+                        self.summary["failed"] += 1
+                        continue
+                    self._pending.append(prepared)
+                    if sum(len(pending["vector_chunks"]) for pending in self._pending) >= self.batch_size:
+                        await self._flush()
+                await self._flush()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        if self.summary["ingested"]:
+            # one BM25 rebuild at the end; the generation bump makes running servers reload the collection
+            await publish_bm25_retriever(initial_app_state, self.collection_name)
+        self.summary["seconds"] = round(time.perf_counter() - started_at, 2)
+        return self.summary
@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import logging
+from typing import IO, Any, Dict, List, Tuple
+from app.config import settings
+from app.models.state import AppState
+from app.repositories.text_repository import TextRepository
+from app.repositories.generation_repository import GenerationRepository
+from app.repositories.shard_manifest_repository import ShardManifestRepository
+from app.repositories.sharded_chroma_repository import open_chroma_repository
+from app.core.embeddings.initializers import get_bm25_retriever, publish_bm25_retriever
+from app.core.utils.common import validate_collection_name
+from app.core.utils.metrics import CHUNKS_DELETED_TOTAL, COMPACTIONS_TOTAL
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where only a single worker is supported
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_compaction_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _lock_compaction(collection_name: str) -> IO:
+    # one compaction of a collection at a time across workers; released when the returned file is closed
+    os.makedirs(settings.TEXT_REPOSITORY_PATH, exist_ok=True)
+    lock_file = open(os.path.join(settings.TEXT_REPOSITORY_PATH, f"{collection_name}.compaction.lock"), "a")
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+def dead_documents(collection_name: str) -> Tuple[int, int]:
+    # (deleted documents still stored, all stored documents) over the text shards of the collection
+    text_repo = TextRepository(settings.TEXT_REPOSITORY_PATH)
+    counts = [text_repo.dead_documents(name)
+              for name in ShardManifestRepository(settings.TEXT_REPOSITORY_PATH).shard_names(collection_name)]
+    return sum(dead for dead, _ in counts), sum(total for _, total in counts)
+
+
+def _publish_generation(app_state: AppState, collection_name: str) -> None:
+    # other workers reload the BM25 index (applying the new tombstones to their snapshot) and reopen the vector store
+    generation = GenerationRepository(settings.TEXT_REPOSITORY_PATH).bump(collection_name)
+    app_state.bm25_generations[collection_name] = generation
+    app_state.generation_checked_at[collection_name] = time.monotonic()
+
+
+async def delete_documents(collection_name: str, file_names: List[str], app_state: AppState) -> Dict[str, Any]:
+    # removes every chunk of the files: vectors are deleted by id, text store lines are tombstoned and masked out of
+    # the loaded BM25 index without rebuilding it
+    collection_name = validate_collection_name(collection_name)
+    file_names = sorted({os.path.basename(file_name) for file_name in file_names})
+    vectors = await open_chroma_repository(collection_name).delete_sources(file_names)
+
+    text_repo = TextRepository(settings.TEXT_REPOSITORY_PATH)
+    shards = ShardManifestRepository(settings.TEXT_REPOSITORY_PATH).shard_names(collection_name)
+    loop = asyncio.get_running_loop()
+    documents = sum(await asyncio.gather(*(loop.run_in_executor(None, text_repo.delete_sources, shard, file_names)
+                                           for shard in shards)))
+    CHUNKS_DELETED_TOTAL.inc(vectors, store="vector")
+    CHUNKS_DELETED_TOTAL.inc(documents, store="text")
+
+    if documents:
+        bm25_retriever = await get_bm25_retriever(app_state, collection_name)
+        if bm25_retriever:
+            if len(shards) == 1:
+                bm25_retriever.index.delete_documents(text_repo.read_tombstones(collection_name))
+            else:
+                bm25_retriever.index.delete_documents({shard: text_repo.read_tombstones(shard) for shard in shards})
+    if documents or vectors:
+        _publish_generation(app_state, collection_name)
+
+    dead, total = await loop.run_in_executor(None, dead_documents, collection_name)
+    dead_ratio = dead / total if total else 0.0
+    logger.info(f"Deleted {file_names} from {collection_name}: {vectors} vectors, {documents} text chunks, "
+                f"{dead_ratio:.0%} of the text store is dead")
+    return {
+        "collection_name": collection_name,
+        "file_names": file_names,
+        "deleted": {"vector": vectors, "text": documents},
+        "dead_ratio": round(dead_ratio, 4),
+        "compaction_due": dead > 0 and dead_ratio >= settings.COMPACTION_DEAD_RATIO
+    }
+
+
+async def compact_collection(collection_name: str, app_state: AppState, force: bool = False) -> Dict[str, Any]:
+    # rewrites the text store without its tombstoned lines, rebuilds the vector store from its live records and
+    # publishes a fresh BM25 index; skipped while less than COMPACTION_DEAD_RATIO of the collection is dead
+    collection_name = validate_collection_name(collection_name)
+    lock = _compaction_locks.setdefault(collection_name, asyncio.Lock())
+    async with lock:
+        loop = asyncio.get_running_loop()
+        lock_file = await loop.run_in_executor(None, _lock_compaction, collection_name)
+        try:
+            return await _compact(collection_name, app_state, force)
+        finally:
+            lock_file.close()
+
+
+async def _compact(collection_name: str, app_state: AppState, force: bool) -> Dict[str, Any]:
+    # counted under the lock, so a worker that waited for another's compaction finds nothing left to do
+    loop = asyncio.get_running_loop()
+    dead, total = await loop.run_in_executor(None, dead_documents, collection_name)
+    dead_ratio = dead / total if total else 0.0
+    summary = {"collection_name": collection_name, "dead_ratio": round(dead_ratio, 4), "compacted": False}
+    if not force and (not dead or dead_ratio < settings.COMPACTION_DEAD_RATIO):
+        COMPACTIONS_TOTAL.inc(result="skipped")
+        return summary
+
+    started_at = time.perf_counter()
+    chroma_repo = await loop.run_in_executor(None, open_chroma_repository, collection_name)
+    vacuumed = await loop.run_in_executor(None, chroma_repo.vacuum)
+    if not vacuumed:
+        # an ingest wrote during the copy; the text store is still compacted, the vectors on the next run
+        logger.warning(f"Vector store of {collection_name} changed during compaction, vacuum skipped")
+
+    text_repo = TextRepository(settings.TEXT_REPOSITORY_PATH)
+    shards = ShardManifestRepository(settings.TEXT_REPOSITORY_PATH).shard_names(collection_name)
+    removed = sum(await asyncio.gather(*(loop.run_in_executor(None, text_repo.compact, shard)
+                                         for shard in shards)))
+
+    if await publish_bm25_retriever(app_state, collection_name) is None:
+        # nothing left to index; still move the generation so workers reopen the vector store
+        app_state.bm25_retrievers.pop(collection_name, None)
+        _publish_generation(app_state, collection_name)
+
+    COMPACTIONS_TOTAL.inc(result="compacted" if vacuumed else "partial")
+    summary.update(compacted=True, vector_store_vacuumed=vacuumed, removed_text_chunks=removed,
+                   seconds=round(time.perf_counter() - started_at, 2))
+    logger.info(f"Compacted {collection_name}: {summary}")
+    return summary
@@ -1,70 +1,97 @@
+import os
 import re
-import tqdm
+import asyncio
 import logging
-import pdfplumber
-import numpy as np
-from typing import List
+from typing import List, Optional, Callable, Dict, Any, Tuple, TYPE_CHECKING
 from app.config import settings
 from fastapi import HTTPException
-from langchain_core.documents import Document
 from app.core.utils.progress_utils import get_tqdm
-from app.core.utils.cache_manager import CacheManager
-from app.repositories.text_repository import TextRepository
+from app.core.utils.metrics import (
+    PDF_PAGE_EXTRACT_SECONDS, CHUNKS_INGESTED_TOTAL, ERRORS_TOTAL, CACHE_HITS_TOTAL, CACHE_MISSES_TOTAL
+)
+from app.repositories.text_repository import TextRepository, DocumentKeys
+from app.repositories.page_cache_repository import PageCacheRepository, file_sha256
 from app.repositories.chroma_repository import ChromaRepository
-from app.core.preprocessors.table_processor import extract_table
+from app.repositories.sharded_chroma_repository import open_chroma_repository
+from app.repositories.shard_manifest_repository import ShardManifestRepository, shard_names, route
+from app.core.preprocessors.table_processor import extract_tables, outside_tables
+from app.core.preprocessors.ocr_processor import ocr_pages, text_less_pages
 from app.core.preprocessors.text_splitter import split_text_into_chunks
 from app.core.embeddings.initializers import get_ko_sbert_nli_embedding
 from app.core.preprocessors.header_processor import extract_headers_and_text
-from app.core.utils.common import validate_collection_name, calculate_cosine_similarity
+from app.core.preprocessors.deduplicator import ChunkDeduplicator
+from app.core.retrievers.search_filter import SearchFilter, metadata_file_name
+from app.core.utils.common import validate_collection_name
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
-cache_manager = CacheManager()
+# bumped whenever page extraction changes, so pages parsed by older code are not reused
+PAGE_EXTRACTION_VERSION = 2
+
+# called as progress(stage, completed_files, total_files) after each file of an ingest stage
+ProgressCallback = Callable[[str, int, int], None]
+
+
+def ingest_shard_count(collection_name: str) -> int:
+    # a new collection takes the configured layout; an existing one keeps the layout it was created with
+    return ShardManifestRepository(settings.TEXT_REPOSITORY_PATH).ensure(collection_name, settings.COLLECTION_SHARDS)
+
 
+def text_shard_name(collection_name: str, shard_count: int, file_path: str) -> str:
+    return shard_names(collection_name, shard_count)[route(file_path, shard_count)]
 
-async def process_and_store_vector(files: List[str], collection_name: str) -> None:
+
+async def process_and_store_vector(files: List[str], collection_name: str,
+                                   progress: Optional[ProgressCallback] = None) -> None:
     try:
         collection_name = validate_collection_name(collection_name)
-        chroma_repo = ChromaRepository(collection_name, settings.CHROMA_DIRECTORY)
+        chroma_repo = open_chroma_repository(collection_name, settings.CHROMA_DIRECTORY,
+                                             shard_count=ingest_shard_count(collection_name))
         ko_embedding = get_ko_sbert_nli_embedding()
         total_files = len(files)
 
         with get_tqdm(total=total_files, desc="Processing vector files") as pbar:
-            for file_path in files:
+            for file_index, file_path in enumerate(files, start=1):
                 try:
                     await process_file_vector(file_path, chroma_repo, ko_embedding)
                     logger.info(f"Finished processing vector for file: {file_path}")
                     pbar.update(1)
+                    if progress:
+                        progress("vector", file_index, total_files)
                 except Exception as e:
                     logger.error(f"Error in process_and_store_vector: {e}", extra={'file_path': file_path})
                     raise HTTPException(status_code=500, detail=str(e))
-                finally:
-                    cache_manager.clear_cache()
-                    logger.info("Cache cleared after ingestion process.")
     except Exception as e:
+        ERRORS_TOTAL.inc(component="ingest")
         logger.error(f"Unhandled error in process_and_store_vector: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def process_and_store_text(files: List[str], collection_name: str, chunk_size: int = 200) -> None:
+async def process_and_store_text(files: List[str], collection_name: str, chunk_size: int = 200,
+                                 progress: Optional[ProgressCallback] = None) -> None:
     try:
         collection_name = validate_collection_name(collection_name)
         text_repo = TextRepository(settings.TEXT_REPOSITORY_PATH)
+        shard_count = ingest_shard_count(collection_name)
         total_files = len(files)
 
         with get_tqdm(total=total_files, desc="Processing text files") as pbar:
-            for file_path in files:
+            for file_index, file_path in enumerate(files, start=1):
                 try:
-                    await process_file_text(file_path, text_repo, collection_name, chunk_size)
+                    text_collection = text_shard_name(collection_name, shard_count, file_path)
+                    await process_file_text(file_path, text_repo, text_collection, chunk_size)
                     logger.info(f"Finished processing text for file: {file_path}")
                     pbar.update(1)
+                    if progress:
+                        progress("text", file_index, total_files)
                 except Exception as e:
                     logger.error(f"Error in process_and_store_text: {e}", extra={'file_path': file_path})
                     raise HTTPException(status_code=500, detail=str(e))
-                finally:
-                    cache_manager.clear_cache()
-                    logger.info("Cache cleared after ingestion process.")
     except Exception as e:
+        ERRORS_TOTAL.inc(component="ingest")
         logger.error(f"Unhandled error in process_and_store_text: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -75,18 +102,18 @@ async def process_file_text(file_path: str, text_repo: TextRepository, collectio
         if not file_path:
             raise ValueError("File path must be provided")
         logger.info(f"Processing file (text): {file_path}")
-        text = extract_text_from_pdf(file_path)
-        tokens = tokenize_text(text)
-        logger.info(f"Tokenized text into {len(tokens)} tokens")
-        chunks = create_text_chunks(tokens, chunk_size)
+        # page extraction and waiting on OCR workers stay off the event loop
+        chunks = await asyncio.get_running_loop().run_in_executor(None, create_bm25_chunks, file_path, chunk_size)
         logger.info(f"Created {len(chunks)} chunks of size {chunk_size}")
         total_chunks = len(chunks)
 
+        # one key set for the whole file, so each chunk's save reads only what was appended since the last one
+        keys = DocumentKeys()
         with get_tqdm(total=total_chunks, desc=f"Processing {file_path}") as pbar:
-            for i, chunk in enumerate(chunks):
+            for i, document in enumerate(chunks):
                 logger.info(f"Processing chunk {i + 1}/{len(chunks)}")
-                document = Document(page_content=' '.join(chunk), metadata={"source": f"{file_path}_chunk_{i + 1}"})
-                text_repo.save_documents([document], collection_name)
+                text_repo.save_documents([document], collection_name, existing_keys=keys)
+                CHUNKS_INGESTED_TOTAL.inc(store="text")
                 pbar.update(1)
         logger.info(f"Total chunks processed: {len(chunks)}")
     except Exception as e:
@@ -94,29 +121,109 @@ async def process_file_text(file_path: str, text_repo: TextRepository, collectio
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def extract_text_from_pdf(file_path: str) -> str:
+def page_cache_variant() -> str:
+    ocr = f"ocr-{settings.OCR_DPI}-{settings.OCR_LANGUAGES}" if settings.OCR_ENABLED else "no-ocr"
+    return f"v{PAGE_EXTRACTION_VERSION}-{ocr}"
+
+
+def load_pdf_pages(file_path: str) -> List[Dict[str, Any]]:
+    # per page: "body" (the text outside tables, header-processed) and "tables" (markdown). Pages come from the
+    # page cache when this PDF's content was parsed before; only the missing ones are parsed, and both ingest
+    # stages share a single parse
+    import pdfplumber
+
+    page_cache = PageCacheRepository(settings.PAGE_CACHE_PATH, settings.PAGE_CACHE_MAX_MB * 1024 * 1024)
+    pdf_hash = file_sha256(file_path)
+    variant = page_cache_variant()
+    cached = page_cache.get_pages(pdf_hash, variant)
+
+    with pdfplumber.open(file_path) as pdf:
+        page_count = len(pdf.pages)
+        missing = [page_num for page_num in range(page_count) if page_num not in cached]
+        CACHE_HITS_TOTAL.inc(page_count - len(missing), cache="pdf_pages")
+        CACHE_MISSES_TOTAL.inc(len(missing), cache="pdf_pages")
+        if not missing:
+            return [cached[page_num] for page_num in range(page_count)]
+
+        scanned = [page_num for page_num in text_less_pages(pdf.pages) if page_num in missing]
+        ocr_texts = ocr_pages(file_path, scanned)
+        # a scanned page OCR could not read (no tesseract, failed batch, broken pool) is not cached, so the next
+        # ingest of this PDF tries it again
+        unread = {page_num for page_num in scanned if page_num not in ocr_texts} if settings.OCR_ENABLED else set()
+        parsed = {}
+        with get_tqdm(total=len(missing), desc=f"Extracting text and tables from {file_path}",
+                      dynamic_ncols=True) as pbar:
+            for page_num in missing:
+                pdf_page = pdf.pages[page_num]
+                with PDF_PAGE_EXTRACT_SECONDS.time():
+                    tables = extract_tables(pdf_page)
+                    # the text layer is read once: around the tables when there are any, else the whole page
+                    body_area = outside_tables(pdf_page, [bbox for _, bbox in tables]) if tables else pdf_page
+                    body = body_area.extract_text() or ocr_texts.get(page_num, "")
+                parsed[page_num] = {
+                    "body": extract_headers_and_text(body) if body else "",
+                    "tables": [markdown_table for markdown_table, _ in tables]
+                }
+                # pages do not reference each other; dropping the parsed objects keeps memory flat on long PDFs
+                pdf_page.close()
+                pbar.update(1)
+
+    if unread:
+        logger.warning(f"OCR could not read pages {sorted(unread)} of {file_path}; they are ingested without text")
+    page_cache.save_pages(pdf_hash, variant,
+                          {page_num: page for page_num, page in parsed.items() if page_num not in unread})
+    pages = {**cached, **parsed}
+    return [pages[page_num] for page_num in range(page_count)]
+
+
+def page_segments(file_path: str) -> List[Tuple[int, str, str]]:
+    # (1-based page, content type, text) for the body and each table of every page. Chunks are cut within a
+    # segment, so each one carries the page and content type that searches can be filtered on
     try:
-        with pdfplumber.open(file_path) as pdf:
-            page_count = len(pdf.pages)
-            complete_text = []
-
-            with get_tqdm(total=page_count, desc=f"Extracting text from {file_path}", dynamic_ncols=True) as pbar:
-                for pdf_page in pdf.pages:
-                    text = pdf_page.extract_text()
-                    if text:
-                        complete_text.append(text)
-                    pbar.update(1)
-            logger.info(f"Extracted text from PDF: {len(complete_text)} pages found")
-        return ' '.join(complete_text)
+        segments = []
+        for page_num, page in enumerate(load_pdf_pages(file_path), start=1):
+            if page["body"]:
+                segments.append((page_num, "text", page["body"]))
+            segments.extend((page_num, "table", markdown_table) for markdown_table in page["tables"])
+        logger.info(f"Extracted {len(segments)} text and table segments from PDF")
+        return segments
     except Exception as e:
-        logger.error(f"Error in extract_text_from_pdf: {e}", extra={'file_path': file_path})
+        logger.error(f"Error in page_segments: {e}", extra={'file_path': file_path})
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def chunk_metadata(file_path: str, page: int, content_type: str) -> Dict[str, Any]:
+    # "file_name", "page" and "content_type" are what a SearchFilter matches on
+    return {"source": file_path, "file_name": os.path.basename(file_path), "page": page, "content_type": content_type}
+
+
+def create_vector_chunks(file_path: str, chunk_size: int = 500, overlap: int = 50) -> List["Document"]:
+    from langchain_core.documents import Document
+
+    documents = []
+    for page, content_type, text in page_segments(file_path):
+        if content_type == "table":
+            text = f"Table extracted from page {page}:\n{text}"
+        documents.extend(Document(page_content=chunk, metadata=chunk_metadata(file_path, page, content_type))
+                         for chunk in split_text_into_chunks(text, chunk_size=chunk_size, overlap=overlap))
+    return documents
+
+
+def create_bm25_chunks(file_path: str, chunk_size: int = 200) -> List["Document"]:
+    from langchain_core.documents import Document
+
+    documents = []
+    for page, content_type, text in page_segments(file_path):
+        for tokens in create_text_chunks(tokenize_text(text), chunk_size):
+            metadata = {**chunk_metadata(file_path, page, content_type), "chunk": len(documents) + 1}
+            documents.append(Document(page_content=' '.join(tokens), metadata=metadata))
+    return documents
+
+
 def tokenize_text(text: str) -> List[str]:
     try:
         tokens = re.findall(r'\b\w+\b', text)
-        logger.info(f"Tokenized text, number of tokens: {len(tokens)}")
+        logger.debug(f"Tokenized text, number of tokens: {len(tokens)}")
         return tokens
     except Exception as e:
         logger.error(f"Error in tokenize_text: {e}")
@@ -125,55 +232,37 @@ def tokenize_text(text: str) -> List[str]:
 
 def create_text_chunks(tokens: List[str], chunk_size: int) -> List[List[str]]:
     chunks = [tokens[i:i + chunk_size] for i in range(0, len(tokens), chunk_size)]
-    logger.info(f"Generated {len(chunks)} chunks of size {chunk_size} each.")
+    logger.debug(f"Generated {len(chunks)} chunks of size {chunk_size} each.")
     return chunks
 
 
+def create_deduplicator() -> ChunkDeduplicator:
+    return ChunkDeduplicator(
+        num_perm=settings.DEDUP_NUM_PERM,
+        bands=settings.DEDUP_LSH_BANDS,
+        jaccard_threshold=settings.DEDUP_JACCARD_THRESHOLD,
+        cosine_threshold=settings.DEDUP_COSINE_THRESHOLD,
+        window_size=settings.DEDUP_WINDOW_SIZE
+    )
+
+
 async def process_file_vector(file_path: str, chroma_repo: ChromaRepository, ko_embedding) -> None:
     try:
         if not file_path:
             raise ValueError("File path must be provided")
         logger.info(f"Processing file: {file_path}")
-        complete_text = extract_text_and_tables(file_path)
-
-        chunks = split_text_into_chunks(complete_text, chunk_size=500, overlap=50)
+        chunks = await asyncio.get_running_loop().run_in_executor(None, create_vector_chunks, file_path)
 
         total_chunks = len(chunks)
-        page_count = len(pdfplumber.open(file_path).pages)
 
-        with get_tqdm(total=total_chunks + page_count, desc=f"Processing {file_path}", dynamic_ncols=True) as pbar:
-            await process_chunks_vector(chunks, file_path, ko_embedding, chroma_repo, pbar)
+        with get_tqdm(total=total_chunks, desc=f"Processing {file_path}", dynamic_ncols=True) as pbar:
+            await process_chunks_vector(chunks, file_path, ko_embedding, chroma_repo, pbar,
+                                        {} if settings.DEDUP_ENABLED else None)
     except Exception as e:
         logger.error(f"Error in process_file_vector: {e}", extra={'file_path': file_path})
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def extract_text_and_tables(file_path: str) -> str:
-    try:
-        complete_text = []
-        with pdfplumber.open(file_path) as pdf:
-            page_count = len(pdf.pages)
-
-            with get_tqdm(total=page_count, desc=f"Extracting text and tables from {file_path}",
-                          dynamic_ncols=True) as pbar:
-                for page_num, pdf_page in enumerate(pdf.pages):
-                    text = pdf_page.extract_text()
-                    if text:
-                        page_text = extract_headers_and_text(text)
-                        complete_text.append(page_text)
-                        cache_manager.add_to_cache(f"{file_path}_page_{page_num}", page_text)
-                    markdown_table = extract_table(pdf_page)
-                    if markdown_table:
-                        table_text = f"\nTable extracted from page {page_num}:\n{markdown_table}\n"
-                        complete_text.append(table_text)
-                        cache_manager.add_to_cache(f"{file_path}_page_{page_num}_table", table_text)
-                    pbar.update(1)
-        return '\n'.join(complete_text)
-    except Exception as e:
-        logger.error(f"Error in extract_text_and_tables: {e}", extra={'file_path': file_path})
-        raise HTTPException(status_code=500, detail=str(e))
-
-
 def split_text_into_chunks_with_logging(complete_text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
     try:
         chunks = split_text_into_chunks(complete_text, chunk_size, overlap)
@@ -185,22 +274,55 @@ def split_text_into_chunks_with_logging(complete_text: str, chunk_size: int = 50
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def process_chunks_vector(chunks: List[str], file_path: str, ko_embedding, chroma_repo: ChromaRepository,
-                                pbar: tqdm.tqdm) -> None:
+def _by_file(chunks: List["Document"], indices: List[int]) -> Dict[str, List[int]]:
+    by_file: Dict[str, List[int]] = {}
+    for index in indices:
+        by_file.setdefault(metadata_file_name(chunks[index].metadata), []).append(index)
+    return by_file
+
+
+async def embed_unique_chunks(chunks: List["Document"], ko_embedding, chroma_repo: ChromaRepository,
+                              deduplicators: Optional[Dict[str, ChunkDeduplicator]] = None):
+    # (indices of the chunks to store, their embeddings); near duplicates are dropped before and after embedding.
+    # deduplicators holds one deduplicator per file name, created here on a file's first chunk, and a chunk is
+    # only compared with chunks of its own file; None stores every chunk
+    kept = list(range(len(chunks)))
+    if deduplicators is not None:
+        kept = []
+        for file_name, indices in _by_file(chunks, list(range(len(chunks)))).items():
+            if file_name not in deduplicators:
+                deduplicators[file_name] = create_deduplicator()
+            texts = [chunks[index].page_content for index in indices]
+            kept.extend(indices[i] for i in deduplicators[file_name].filter_texts(texts))
+        kept.sort()
+    if not kept:
+        return [], []
+    loop = asyncio.get_running_loop()
+    embeddings = await loop.run_in_executor(None, ko_embedding.embed_documents,
+                                            [chunks[index].page_content for index in kept])
+    if deduplicators is not None:
+        embedding_of = dict(zip(kept, embeddings))
+        unique = []
+        for file_name, indices in _by_file(chunks, kept).items():
+            file_embeddings = [embedding_of[index] for index in indices]
+            similarities = await chroma_repo.nearest_similarities(file_embeddings, SearchFilter(sources=[file_name]))
+            unique.extend(indices[i] for i in deduplicators[file_name].filter_vectors(file_embeddings, similarities))
+        kept = sorted(unique)
+        embeddings = [embedding_of[index] for index in kept]
+    return kept, embeddings
+
+
+async def process_chunks_vector(chunks: List["Document"], file_path: str, ko_embedding, chroma_repo: ChromaRepository,
+                                pbar, deduplicators: Optional[Dict[str, ChunkDeduplicator]] = None) -> None:
     try:
-        for chunk_index, chunk in enumerate(chunks):
-            embeddings = ko_embedding.embed_documents([chunk])
-            embeddings = np.array(embeddings)
-            cosine_similarity = calculate_cosine_similarity(embeddings)
-            doc_obj = Document(
-                page_content=chunk,
-                metadata={"source": file_path, "cosine_similarity": cosine_similarity[0][0]}
-            )
-            await chroma_repo.add_documents([doc_obj])
-            pbar.update(1)
-            logger.debug(f"Processed and stored chunk {chunk_index + 1}/{len(chunks)} from file: {file_path}")
-            cache_manager.remove_from_cache(f"{file_path}_page_{chunk_index}")
-            cache_manager.remove_from_cache(f"{file_path}_page_{chunk_index}_table")
+        batch_size = settings.INGEST_BATCH_SIZE
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            kept, embeddings = await embed_unique_chunks(batch, ko_embedding, chroma_repo, deduplicators)
+            await chroma_repo.add_embedded_documents([batch[index] for index in kept], embeddings)
+            CHUNKS_INGESTED_TOTAL.inc(len(kept), store="vector")
+            pbar.update(len(batch))
+            logger.debug(f"Stored {len(kept)} chunks of {start + len(batch)}/{len(chunks)} from file: {file_path}")
     except Exception as e:
         logger.error(f"Error in process_chunks_vector: {e}", extra={'file_path': file_path})
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,11 +1,16 @@
 # search_service.py
 
+import asyncio
 import logging
-from typing import List, Dict
+from typing import List, Dict, Any, Optional
 from app.config import settings
 from fastapi import HTTPException
 from app.models.state import AppState
-from app.repositories.chroma_repository import ChromaRepository
+from app.repositories.sharded_chroma_repository import open_chroma_repository
+from app.core.embeddings.initializers import get_bm25_retriever
+from app.core.retrievers.search_filter import SearchFilter
+from app.core.utils.tracing import span
+from app.core.utils.metrics import DENSE_SEARCH_SECONDS, BM25_SEARCH_SECONDS, FUSION_SECONDS, ERRORS_TOTAL
 from app.core.utils.common import (
     context_reorder_documents,
     map_reordered_docs,
@@ -18,50 +23,120 @@ from app.core.utils.common import (
 logger = logging.getLogger(__name__)
 
 
+def fuse_results(dense_results: List, bm25_results: List, top_k: int) -> List[Dict]:
+    dense_documents = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in dense_results]
+    bm25_documents = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in bm25_results]
+
+    log_documents(dense_documents, "Dense")
+    log_documents(bm25_documents, "BM25")
+
+    reordered_dense_docs = context_reorder_documents(dense_documents)
+    reordered_dense_results = map_reordered_docs(reordered_dense_docs, dense_results)
+    combined_results = combine_results(reordered_dense_results, bm25_results, top_k)
+    return [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in combined_results]
+
+
 class SearchService:
-    def __init__(self, collection_name: str, query: str, app_state: AppState):
+    def __init__(self, collection_name: str, query: str, app_state: AppState,
+                 search_filter: Optional[SearchFilter] = None):
         self.collection_name = collection_name
         self.query = query
         self.app_state = app_state
-        chroma_repo = ChromaRepository(collection_name, chroma_directory=settings.CHROMA_DIRECTORY)
-        self.chroma_retriever = chroma_repo.retriever
-        self.bm25_retriever = self.app_state.bm25_retriever
-        if not self.bm25_retriever:
+        self.search_filter = search_filter
+        self.chroma_repo = open_chroma_repository(collection_name, settings.CHROMA_DIRECTORY)
+
+    async def get_relevant_documents(self, top_k: int = 8, include_embeddings: bool = False) -> Dict[str, Any]:
+        bm25_retriever = await get_bm25_retriever(self.app_state, self.collection_name)
+        if not bm25_retriever:
             logger.error("BM25 retriever is not initialized")
             raise HTTPException(status_code=500, detail="BM25 retriever is not initialized")
 
-    async def get_relevant_documents(self, top_k: int = 8) -> Dict[str, List[Dict]]:
         try:
-            logger.info(f"Searching for query: '{self.query}' with top_k: {top_k}")
-            dense_results = await self.chroma_retriever.aget_relevant_documents(query=self.query, k=top_k // 2)
+            logger.info(f"Searching for query: '{self.query}' with top_k: {top_k}, filter: {self.search_filter}")
+            with span("dense_search", top_k=top_k // 2), DENSE_SEARCH_SECONDS.time():
+                query_embedding, dense_hits = await self.chroma_repo.search_with_embeddings(
+                    self.query, top_k // 2, self.search_filter
+                )
+            dense_results = [doc for doc, _ in dense_hits]
             logger.info(f"Dense Results fetched: {len(dense_results)}")
 
-            bm25_all_results = self.bm25_retriever.get_relevant_documents(query=self.query)
+            with span("bm25_search"), BM25_SEARCH_SECONDS.time():
+                if self.search_filter:
+                    bm25_all_results = bm25_retriever.index.search(self.query, bm25_retriever.k, self.search_filter)
+                else:
+                    bm25_all_results = bm25_retriever.get_relevant_documents(query=self.query)
             logger.info(f"BM25 All Results fetched: {len(bm25_all_results)}")
             bm25_results = bm25_all_results[:top_k // 2]
             logger.info(f"BM25 Top Results: {len(bm25_results)}")
 
-            dense_documents = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in dense_results]
-            bm25_documents = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in bm25_results]
-
-            log_documents(dense_documents, "Dense")
-            log_documents(bm25_documents, "BM25")
-
-            reordered_dense_docs = context_reorder_documents(dense_documents)
-            reordered_dense_results = map_reordered_docs(reordered_dense_docs, dense_results)
-            combined_results = combine_results(reordered_dense_results, bm25_results, top_k)
+            with span("fusion"), FUSION_SECONDS.time():
+                json_docs = fuse_results(dense_results, bm25_results, top_k)
 
-            if not combined_results:
+            if not json_docs:
                 return empty_result()
 
-            json_docs = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in combined_results]
             log_json_docs(json_docs)
 
-            return {
+            result = {
                 "message": "Documents retrieved successfully.",
                 "results": json_docs,
                 "status": "success"
             }
+            if include_embeddings:
+                # for the answer path's context builder; never part of an API response
+                result["query_embedding"] = query_embedding
+                result["passage_embeddings"] = {doc.page_content: embedding for doc, embedding in dense_hits}
+            return result
         except Exception as e:
+            ERRORS_TOTAL.inc(component="search")
             logger.error(f"Unhandled error in get_relevant_documents: {e}", exc_info=True)
-            raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+class BatchSearchService:
+    def __init__(self, collection_name: str, queries: List[str], app_state: AppState,
+                 search_filter: Optional[SearchFilter] = None):
+        self.collection_name = collection_name
+        self.queries = queries
+        self.app_state = app_state
+        self.search_filter = search_filter
+        self.chroma_repo = open_chroma_repository(collection_name, settings.CHROMA_DIRECTORY)
+
+    async def get_relevant_documents(self, top_k: int = 8, include_embeddings: bool = False) -> Dict[str, Any]:
+        bm25_retriever = await get_bm25_retriever(self.app_state, self.collection_name)
+        if not bm25_retriever:
+            logger.error("BM25 retriever is not initialized")
+            raise HTTPException(status_code=500, detail="BM25 retriever is not initialized")
+
+        try:
+            logger.info(f"Batch searching {len(self.queries)} queries with top_k: {top_k}")
+            with span("dense_search_batch", queries=len(self.queries), top_k=top_k // 2):
+                query_embeddings, dense_hits = await self.chroma_repo.search_batch_with_embeddings(
+                    self.queries, top_k // 2, self.search_filter
+                )
+
+            loop = asyncio.get_running_loop()
+            with span("bm25_search_batch", queries=len(self.queries)):
+                bm25_batches = await loop.run_in_executor(
+                    None, bm25_retriever.index.search_batch, self.queries, top_k // 2, self.search_filter
+                )
+
+            results = []
+            with span("fusion_batch"):
+                for row, (query, bm25_results) in enumerate(zip(self.queries, bm25_batches)):
+                    dense_results = [doc for doc, _ in dense_hits[row]]
+                    item = {"query": query, "results": fuse_results(dense_results, bm25_results, top_k)}
+                    if include_embeddings:
+                        item["query_embedding"] = query_embeddings[row]
+                        item["passage_embeddings"] = {doc.page_content: embedding for doc, embedding in dense_hits[row]}
+                    results.append(item)
+
+            return {
+                "message": "Documents retrieved successfully.",
+                "results": results,
+                "status": "success"
+            }
+        except Exception as e:
+            ERRORS_TOTAL.inc(component="search")
+            logger.error(f"Unhandled error in batch get_relevant_documents: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
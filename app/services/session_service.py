@@ -0,0 +1,87 @@
+import logging
+from typing import Optional, List, Dict, Any, AsyncIterator
+from app.config import settings
+from app.repositories.session_repository import SessionRepository
+from app.services.answer_service import AnswerService, BLACKLIST_RESPONSE
+from app.core.retrievers.search_filter import SearchFilter
+from app.core.utils.tokens import count_tokens, split_history_by_tokens
+from app.core.utils.metrics import ERRORS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# times a turn is re-appended to a session that another turn or a compaction saved while it was being answered
+SAVE_ATTEMPTS = 5
+
+
+class SessionService:
+    def __init__(self, answer_service: AnswerService, repository: Optional[SessionRepository] = None,
+                 token_budget: int = settings.CHAT_HISTORY_TOKEN_BUDGET):
+        self.answer_service = answer_service
+        self.repository = repository or SessionRepository(settings.SESSION_DATABASE_PATH, settings.SESSION_TTL_SECONDS)
+        self.token_budget = token_budget
+
+    def get_session(self, session_id: str) -> Dict[str, Any]:
+        return self.repository.get(session_id) or {"session_id": session_id, "summary": "", "turns": [], "version": 0}
+
+    async def answer(self, query: str, session_id: str, collection_name: str, fast: Optional[bool] = None,
+                     search_filter: Optional[SearchFilter] = None) -> str:
+        session = self.get_session(session_id)
+        answer = await self.answer_service.get_answer(
+            query, session["turns"], collection_name, summary=session["summary"], fast=fast,
+            search_filter=search_filter
+        )
+        if answer != BLACKLIST_RESPONSE:
+            self.append_turn(session, query, answer)
+        return answer
+
+    async def stream_answer(self, query: str, session_id: str, collection_name: str,
+                            search_filter: Optional[SearchFilter] = None) -> AsyncIterator[str]:
+        session = self.get_session(session_id)
+        parts = []
+        async for chunk in self.answer_service.stream_answer(
+                query, session["turns"], collection_name, summary=session["summary"], search_filter=search_filter):
+            parts.append(chunk)
+            yield chunk
+        # only a fully streamed answer becomes part of the conversation
+        answer = "".join(parts)
+        if answer != BLACKLIST_RESPONSE:
+            self.append_turn(session, query, answer)
+
+    def append_turn(self, session: Dict[str, Any], query: str, answer: str) -> None:
+        # saved against the version the turn was answered from; if another turn or a compaction was saved in
+        # between, the turn is appended to the session as it is now instead of overwriting it
+        turn = [{"role": "user", "content": query}, {"role": "assistant", "content": answer}]
+        for _ in range(SAVE_ATTEMPTS):
+            if self.repository.save(session["session_id"], session["summary"], session["turns"] + turn,
+                                    expected_version=session["version"]):
+                return
+            session = self.get_session(session["session_id"])
+        ERRORS_TOTAL.inc(component="session")
+        logger.error(f"Dropped a turn of session {session['session_id']}: it kept changing while saving")
+
+    def needs_compaction(self, turns: List[Dict[str, str]]) -> bool:
+        model_name = self.answer_service.model_name
+        return sum(count_tokens(entry["content"], model_name) for entry in turns) > self.token_budget
+
+    async def compact(self, session_id: str) -> None:
+        # folds the oldest turns into the running summary until the rest fits in half the budget, so the
+        # summary call runs once every few turns rather than on every turn once a conversation is long
+        session = self.repository.get(session_id)
+        if session is None or not self.needs_compaction(session["turns"]):
+            return
+
+        older, recent = split_history_by_tokens(session["turns"], self.token_budget // 2, self.answer_service.model_name)
+        try:
+            summary = await self.answer_service.summarize_history(session["summary"], older)
+        except Exception as e:
+            ERRORS_TOTAL.inc(component="session")
+            logger.error(f"Failed to summarize session {session_id}: {e}")
+            return
+        if not summary:
+            return
+
+        if not self.repository.save(session_id, summary, recent, expected_version=session["version"]):
+            # a newer turn was saved meanwhile; the next turn compacts again from fresh state
+            logger.info(f"Skipped compaction of session {session_id}: it changed while summarizing")
+            return
+        logger.info(f"Compacted session {session_id}: folded {len(older)} messages into the summary")
@@ -0,0 +1,174 @@
+import os
+import random
+from typing import Dict, List, Sequence, Tuple
+
+# Minimal PDF writer for synthetic Korean manuals. Text is drawn with a non-embedded Identity-H CID font
+# whose codes are the UTF-16 code points and a ToUnicode CMap, which is all pdfplumber needs to extract it.
+# Tables are drawn as stroked cell rectangles so pdfplumber's line-based table finder picks them up.
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+FONT_SIZE = 10
+LINE_HEIGHT = 14
+CHARS_PER_LINE = 44
+
+NOUNS = [
+    "보험", "계약", "약관", "보장", "특약", "청약", "해지", "환급금", "보험료", "납입", "피보험자", "수익자",
+    "진단", "입원", "수술", "통원", "사고", "질병", "장해", "사망", "지급", "청구", "서류", "심사",
+    "면책", "기간", "갱신", "만기", "연금", "적립금", "이율", "공시", "대출", "원금", "이자", "고지",
+    "의무", "위반", "효력", "부활", "변경", "철회", "분쟁", "조정", "금융감독원", "고객센터", "상담", "접수",
+]
+VERBS = [
+    "확인합니다", "지급합니다", "적용됩니다", "포함됩니다", "제외됩니다", "청구할 수 있습니다", "안내합니다",
+    "보장합니다", "산출됩니다", "변경될 수 있습니다", "납입하여야 합니다", "심사합니다",
+]
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(NOUNS) for _ in range(rng.randint(3, 7))]
+    particles = ["은", "는", "이", "가", "을", "를", "의", "에", "로"]
+    phrase = " ".join(f"{word}{rng.choice(particles)}" for word in words)
+    return f"{phrase} {rng.choice(VERBS)}."
+
+
+def _table(rng: random.Random, page_number: int) -> List[List[str]]:
+    header = ["구분", "보장내용", "지급금액", "비고"]
+    rows = [header]
+    for i in range(rng.randint(3, 6)):
+        rows.append([
+            f"{rng.choice(NOUNS)}{i + 1}",
+            f"{rng.choice(NOUNS)} {rng.choice(NOUNS)}",
+            f"{rng.randint(1, 99) * 100}만원",
+            f"{page_number}쪽 참조",
+        ])
+    return rows
+
+
+def _wrap(text: str, width: int = CHARS_PER_LINE) -> List[str]:
+    lines, current = [], ""
+    for word in text.split(" "):
+        candidate = f"{current} {word}".strip()
+        if len(candidate) > width and current:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+
+def _hex(text: str) -> str:
+    return "<" + "".join(f"{ord(char):04X}" for char in text) + ">"
+
+
+def _text_op(x: float, y: float, text: str) -> str:
+    return f"BT /F1 {FONT_SIZE} Tf 1 0 0 1 {x:.2f} {y:.2f} Tm {_hex(text)} Tj ET"
+
+
+def _page_content(rng: random.Random, page_number: int, section: int) -> Tuple[str, str]:
+    ops: List[str] = []
+    y = PAGE_HEIGHT - MARGIN
+    plain: List[str] = []
+
+    header = f"{section}.{page_number} {rng.choice(NOUNS)} {rng.choice(NOUNS)} 안내"
+    ops.append(_text_op(MARGIN, y, header))
+    plain.append(header)
+    y -= LINE_HEIGHT * 2
+
+    for _ in range(rng.randint(2, 4)):
+        paragraph = " ".join(_sentence(rng) for _ in range(rng.randint(3, 6)))
+        for line in _wrap(paragraph):
+            ops.append(_text_op(MARGIN, y, line))
+            plain.append(line)
+            y -= LINE_HEIGHT
+        y -= LINE_HEIGHT // 2
+
+    if page_number % 2 == 0 and y > 250:
+        rows = _table(rng, page_number)
+        col_widths = [90, 160, 100, 100]
+        row_height = 20
+        y -= LINE_HEIGHT
+        for row in rows:
+            x = MARGIN
+            for width, cell in zip(col_widths, row):
+                ops.append(f"0.5 w {x} {y - 6} {width} {row_height} re S")
+                ops.append(_text_op(x + 4, y, cell))
+                x += width
+            plain.append(" ".join(row))
+            y -= row_height
+
+    return "\n".join(ops), "\n".join(plain)
+
+
+def _to_unicode_cmap(texts: Sequence[str]) -> bytes:
+    high_bytes = sorted({ord(char) >> 8 for text in texts for char in text} | {0})
+    ranges = "\n".join(f"<{high:02X}00> <{high:02X}FF> <{high:02X}00>" for high in high_bytes)
+    return (
+        "/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+        "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+        "1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n"
+        f"{len(high_bytes)} beginbfrange\n{ranges}\nendbfrange\n"
+        "endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend"
+    ).encode("ascii")
+
+
+def write_pdf(path: str, page_contents: List[str], plain_texts: Sequence[str]) -> None:
+    objects: Dict[int, bytes] = {}
+    page_ids = [6 + 2 * i for i in range(len(page_contents))]
+
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[2] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("ascii")
+    objects[3] = (b"<< /Type /Font /Subtype /Type0 /BaseFont /NanumGothic /Encoding /Identity-H "
+                  b"/DescendantFonts [4 0 R] /ToUnicode 5 0 R >>")
+    objects[4] = (b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /NanumGothic "
+                  b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+                  b"/DW 1000 /W [32 126 500] >>")
+    cmap = _to_unicode_cmap(plain_texts)
+    objects[5] = b"<< /Length %d >>\nstream\n" % len(cmap) + cmap + b"\nendstream"
+
+    for page_id, content in zip(page_ids, page_contents):
+        stream = content.encode("ascii")
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>").encode("ascii")
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output.extend(b"%d 0 obj\n" % object_id + objects[object_id] + b"\nendobj\n")
+
+    xref_offset = len(output)
+    size = max(objects) + 1
+    output.extend(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+    for object_id in range(1, size):
+        output.extend(b"%010d 00000 n \n" % offsets.get(object_id, 0))
+    output.extend(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_offset))
+
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+def generate_corpus(directory: str, num_documents: int, pages_per_document: int, seed: int = 42) -> List[str]:
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for doc_index in range(num_documents):
+        page_contents, plain_texts = [], []
+        for page_number in range(1, pages_per_document + 1):
+            content, plain = _page_content(rng, page_number, doc_index + 1)
+            page_contents.append(content)
+            plain_texts.append(plain)
+        path = os.path.join(directory, f"manual_{doc_index + 1:04d}.pdf")
+        write_pdf(path, page_contents, plain_texts)
+        paths.append(path)
+    return paths
+
+
+def generate_queries(num_queries: int, seed: int = 7) -> List[str]:
+    rng = random.Random(seed)
+    return [f"{rng.choice(NOUNS)} {rng.choice(NOUNS)} {rng.choice(NOUNS)}은 어떻게 되나요?" for _ in range(num_queries)]
@@ -0,0 +1,110 @@
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import argparse
+from aiohttp import web
+
+# OpenAI-compatible stand-in for load tests: answers /v1/chat/completions (plain and streaming)
+# after a configurable first-token latency, then emits tokens at a configurable rate.
+
+FOLLOW_UP_MARKER = "추가로 궁금해할 수 있는 질문"
+STRUCTURED_MARKER = '"follow_up_questions"'
+
+
+def _reply(messages) -> str:
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+    if STRUCTURED_MARKER in prompt:
+        return json.dumps({
+            "answer": f"문맥에 따르면 해당 보장은 약관에 정한 조건을 충족하는 경우 지급됩니다. (ref {digest})",
+            "follow_up_questions": [f"1. 보험금 청구 서류는 무엇인가요? ({digest})",
+                                    f"2. 해지 환급금은 어떻게 계산되나요? ({digest})"]
+        }, ensure_ascii=False)
+    if FOLLOW_UP_MARKER in prompt:
+        return f"1. 보험금 청구 서류는 무엇인가요? ({digest})\n2. 해지 환급금은 어떻게 계산되나요? ({digest})"
+    return (f"문맥에 따르면 해당 보장은 약관에 정한 조건을 충족하는 경우 지급되며, 청구 시 필요한 서류를 "
+            f"함께 제출해야 합니다. (ref {digest})")
+
+
+def _tokens(text: str):
+    words = text.split(" ")
+    return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+
+def _usage(messages, tokens) -> dict:
+    prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 2
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens)}
+
+
+def create_app(latency: float = 0.5, tokens_per_second: float = 50.0) -> web.Application:
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "gpt-3.5-turbo")
+        tokens = _tokens(_reply(messages))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        request.app["requests"] += 1
+
+        await asyncio.sleep(latency)
+
+        if not body.get("stream"):
+            if tokens_per_second:
+                await asyncio.sleep(len(tokens) / tokens_per_second)
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": _usage(messages, tokens),
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i, token in enumerate(tokens):
+            delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if tokens_per_second:
+                await asyncio.sleep(1 / tokens_per_second)
+        final = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        await response.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def models(request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": "gpt-3.5-turbo", "object": "model"}]})
+
+    app = web.Application()
+    app["requests"] = 0
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/v1/models", models)
+    return app
+
+
+async def start_fake_server(host: str, port: int, latency: float, tokens_per_second: float) -> web.AppRunner:
+    runner = web.AppRunner(create_app(latency, tokens_per_second), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat completion server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=500, help="delay before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="generation speed, 0 for instant")
+    args = parser.parse_args(argv)
+    web.run_app(create_app(args.latency_ms / 1000, args.tokens_per_second), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
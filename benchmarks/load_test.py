@@ -0,0 +1,272 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Optional, Tuple
+import aiohttp
+import numpy as np
+
+from benchmarks.corpus import generate_corpus, generate_queries
+from benchmarks.fake_openai_server import start_fake_server
+
+logger = logging.getLogger("load_test")
+
+REQUEST_TYPES = ("search", "answer", "ingest")
+LOOP_LAG_METRIC = "rag_event_loop_lag_seconds"
+BUCKET_PATTERN = re.compile(rf'^{LOOP_LAG_METRIC}_bucket{{le="([^"]+)"}} (\S+)$')
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in REQUEST_TYPES:
+            raise argparse.ArgumentTypeError(f"Unknown request type '{name}', expected one of {REQUEST_TYPES}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def parse_loop_lag_buckets(metrics_text: str) -> Tuple[Dict[float, float], float, float]:
+    buckets, total, count = {}, 0.0, 0.0
+    for line in metrics_text.splitlines():
+        match = BUCKET_PATTERN.match(line)
+        if match:
+            buckets[float(match.group(1))] = float(match.group(2))
+        elif line.startswith(f"{LOOP_LAG_METRIC}_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{LOOP_LAG_METRIC}_count"):
+            count = float(line.rsplit(" ", 1)[1])
+    return buckets, total, count
+
+
+def loop_lag_between(before: str, after: str) -> Dict[str, Optional[float]]:
+    buckets_before, sum_before, count_before = parse_loop_lag_buckets(before)
+    buckets_after, sum_after, count_after = parse_loop_lag_buckets(after)
+    count = count_after - count_before
+    if count <= 0:
+        return {"samples": 0}
+
+    def quantile(q: float) -> Optional[float]:
+        # upper bound of the first bucket that holds the q-quantile, like histogram_quantile without
+        # interpolation; None when it only falls into the +Inf bucket
+        for bound in sorted(buckets_after):
+            if buckets_after[bound] - buckets_before.get(bound, 0.0) >= q * count:
+                return bound * 1000 if bound != float("inf") else None
+        return None
+
+    return {
+        "samples": int(count),
+        "mean_ms": round((sum_after - sum_before) / count * 1000, 3),
+        "p50_le_ms": quantile(0.5),
+        "p99_le_ms": quantile(0.99),
+    }
+
+
+class LoadTest:
+    def __init__(self, args, base_url: str):
+        self.args = args
+        self.base_url = base_url.rstrip("/")
+        self.rng = random.Random(args.seed)
+        self.queries = generate_queries(500, seed=args.seed)
+        self.latencies: Dict[str, List[float]] = {name: [] for name in REQUEST_TYPES}
+        self.errors: Dict[str, int] = {name: 0 for name in REQUEST_TYPES}
+        self.client_loop_lag: List[float] = []
+        pdf_dir = tempfile.mkdtemp(prefix="rag-load-")
+        self.ingest_files = generate_corpus(pdf_dir, args.ingest_documents, args.ingest_pages, seed=args.seed)
+
+    async def search(self, session: aiohttp.ClientSession) -> None:
+        payload = {"query": self.rng.choice(self.queries), "collection_name": self.args.collection}
+        async with session.post(f"{self.base_url}/api/v1/search/search_data", json=payload) as response:
+            await response.read()
+            response.raise_for_status()
+
+    async def answer(self, session: aiohttp.ClientSession) -> None:
+        payload = {"query": self.rng.choice(self.queries), "chat_history": []}
+        async with session.post(f"{self.base_url}/api/v1/answer/answer_question", json=payload,
+                                params={"collection_name": self.args.collection}) as response:
+            await response.read()
+            response.raise_for_status()
+
+    async def ingest(self, session: aiohttp.ClientSession) -> None:
+        form = aiohttp.FormData()
+        path = self.rng.choice(self.ingest_files)
+        with open(path, "rb") as f:
+            form.add_field("files", f.read(), filename=os.path.basename(path), content_type="application/pdf")
+        form.add_field("collection_name", self.args.collection)
+        async with session.post(f"{self.base_url}/api/v1/ingest/ingest_data", data=form) as response:
+            await response.read()
+            response.raise_for_status()
+
+    async def worker(self, session: aiohttp.ClientSession, deadline: float) -> None:
+        names, weights = zip(*self.args.mix.items())
+        while time.perf_counter() < deadline:
+            name = self.rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                await getattr(self, name)(session)
+                self.latencies[name].append(time.perf_counter() - start)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.errors[name] += 1
+                logger.debug(f"{name} request failed: {e}")
+
+    async def monitor_client_loop(self, interval: float = 0.05) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.client_loop_lag.append(max(loop.time() - start - interval, 0.0))
+
+    async def scrape_metrics(self, session: aiohttp.ClientSession) -> str:
+        try:
+            async with session.get(f"{self.base_url}/metrics") as response:
+                return await response.text()
+        except aiohttp.ClientError:
+            return ""
+
+    async def run(self) -> Dict:
+        timeout = aiohttp.ClientTimeout(total=self.args.request_timeout)
+        connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            if self.args.seed_ingest:
+                await self.ingest(session)
+
+            metrics_before = await self.scrape_metrics(session)
+            monitor = asyncio.create_task(self.monitor_client_loop())
+            start = time.perf_counter()
+            deadline = start + self.args.duration
+            await asyncio.gather(*(self.worker(session, deadline) for _ in range(self.args.concurrency)))
+            elapsed = time.perf_counter() - start
+            monitor.cancel()
+            metrics_after = await self.scrape_metrics(session)
+
+        completed = sum(len(samples) for samples in self.latencies.values())
+        return {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "target": self.base_url,
+                "concurrency": self.args.concurrency,
+                "duration_s": round(elapsed, 3),
+                "mix": self.args.mix,
+                "llm_latency_ms": self.args.llm_latency_ms,
+                "tokens_per_second": self.args.tokens_per_second,
+            },
+            "throughput_rps": round(completed / elapsed, 3),
+            "requests": {
+                name: {**latency_summary(self.latencies[name]), "errors": self.errors[name]}
+                for name in self.args.mix
+            },
+            "server_event_loop_lag": loop_lag_between(metrics_before, metrics_after),
+            "client_event_loop_lag": latency_summary(self.client_loop_lag),
+        }
+
+
+async def wait_until_ready(base_url: str, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            try:
+                async with session.get(f"{base_url}/readiness") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"Backend at {base_url} did not become ready within {timeout}s")
+
+
+def start_backend(args, fake_base_url: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": fake_base_url,
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY") or "sk-load-test",
+        "PROGRESS_MODE": "metrics",
+        "ANONYMIZED_TELEMETRY": "False",
+    })
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port),
+           "--log-level", "warning"]
+    logger.info(f"Starting backend: {' '.join(cmd)}")
+    return subprocess.Popen(cmd, env=env)
+
+
+async def main_async(args) -> Dict:
+    fake = await start_fake_server("127.0.0.1", args.fake_port, args.llm_latency_ms / 1000, args.tokens_per_second)
+    fake_base_url = f"http://127.0.0.1:{args.fake_port}/v1"
+    logger.info(f"Fake OpenAI server listening on {fake_base_url}")
+
+    backend = None
+    base_url = args.target
+    try:
+        if not base_url:
+            backend = start_backend(args, fake_base_url)
+            base_url = f"http://127.0.0.1:{args.port}"
+        await wait_until_ready(base_url, args.startup_timeout)
+        return await LoadTest(args, base_url).run()
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait()
+        await fake.cleanup()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="HTTP load test against the API, with a local fake OpenAI server instead of the real provider"
+    )
+    parser.add_argument("--target", help="base URL of a running backend; by default one is started on --port "
+                                         "(point an external backend at the fake server with OPENAI_BASE_URL)")
+    parser.add_argument("--port", type=int, default=8010, help="port for the backend started by the harness")
+    parser.add_argument("--fake-port", type=int, default=8089, help="port for the fake OpenAI server")
+    parser.add_argument("--collection", default="load_test")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=60, help="seconds of load")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("search=6,answer=3,ingest=1"),
+                        help="weighted request mix, e.g. search=6,answer=3,ingest=1")
+    parser.add_argument("--llm-latency-ms", type=float, default=500, help="fake provider time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="fake provider generation speed")
+    parser.add_argument("--ingest-documents", type=int, default=3, help="generated PDFs used for ingest requests")
+    parser.add_argument("--ingest-pages", type=int, default=2)
+    parser.add_argument("--no-seed-ingest", dest="seed_ingest", action="store_false",
+                        help="do not ingest one document before the measurement starts")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = asyncio.run(main_async(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Dict, List
+import numpy as np
+
+# the suite must run without network access, chromadb would otherwise try to send telemetry
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+from app.config import settings
+from app.models.state import initial_app_state
+from app.core.utils.metrics import CHUNKS_INGESTED_TOTAL
+from app.services.search_service import SearchService
+from app.services.answer_service import AnswerService
+from app.services.ingest_service import process_and_store_vector, process_and_store_text
+from app.core.embeddings.initializers import override_embedding_model, publish_bm25_retriever
+from benchmarks.corpus import generate_corpus, generate_queries
+from benchmarks.stubs import HashingEmbeddings, StubChatModel
+
+logger = logging.getLogger("benchmarks")
+
+# metric name -> True when larger values are better
+COMPARED_METRICS = {
+    ("ingest_vector", "pages_per_second"): True,
+    ("ingest_vector", "chunks_per_second"): True,
+    ("ingest_text", "pages_per_second"): True,
+    ("ingest_text", "chunks_per_second"): True,
+    ("search", "p95_ms"): False,
+    ("search", "p99_ms"): False,
+    ("answer", "p95_ms"): False,
+    ("answer", "p99_ms"): False,
+    ("answer_fast", "p95_ms"): False,
+}
+
+
+def latency_stats(samples: List[float]) -> Dict[str, float]:
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+async def bench_ingest(ingest_fn, store: str, files: List[str], collection_name: str, pages: int) -> Dict[str, float]:
+    chunks_before = CHUNKS_INGESTED_TOTAL.value(store=store)
+    start = time.perf_counter()
+    await ingest_fn(files, collection_name)
+    elapsed = time.perf_counter() - start
+    chunks = CHUNKS_INGESTED_TOTAL.value(store=store) - chunks_before
+    return {
+        "seconds": round(elapsed, 3),
+        "pages": pages,
+        "chunks": int(chunks),
+        "pages_per_second": round(pages / elapsed, 3),
+        "chunks_per_second": round(chunks / elapsed, 3),
+    }
+
+
+async def bench_search(collection_name: str, queries: List[str]) -> Dict[str, float]:
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        await SearchService(collection_name, query, initial_app_state).get_relevant_documents()
+        samples.append(time.perf_counter() - start)
+    return latency_stats(samples)
+
+
+async def bench_answer(collection_name: str, queries: List[str], llm: StubChatModel,
+                       fast: bool = False) -> Dict[str, float]:
+    service = AnswerService(model_name="stub", llm=llm)
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        await service.get_answer(query, [], collection_name, fast=fast)
+        samples.append(time.perf_counter() - start)
+    return latency_stats(samples)
+
+
+async def run_size(num_documents: int, args, workdir: str, llm: StubChatModel) -> Dict:
+    collection_name = f"bench_{num_documents:05d}"
+    files = generate_corpus(os.path.join(workdir, "pdfs", collection_name), num_documents, args.pages, seed=args.seed)
+    pages = num_documents * args.pages
+
+    result = {"documents": num_documents, "pages": pages}
+    result["ingest_vector"] = await bench_ingest(process_and_store_vector, "vector", files, collection_name, pages)
+    result["ingest_text"] = await bench_ingest(process_and_store_text, "text", files, collection_name, pages)
+
+    await publish_bm25_retriever(initial_app_state, collection_name)
+    initial_app_state.ready = True
+
+    queries = generate_queries(args.queries, seed=args.seed)
+    await bench_search(collection_name, queries[:args.warmup])
+    result["search"] = await bench_search(collection_name, queries)
+    result["answer"] = await bench_answer(collection_name, queries[:args.answer_queries], llm)
+    result["answer_fast"] = await bench_answer(collection_name, queries[:args.answer_queries], llm, fast=True)
+    logger.info(f"{collection_name}: {json.dumps(result, ensure_ascii=False)}")
+    return result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_with_baseline(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    baseline_by_size = {entry["documents"]: entry for entry in baseline.get("results", [])}
+    regressions = []
+    for entry in report["results"]:
+        previous = baseline_by_size.get(entry["documents"])
+        if previous is None:
+            continue
+        for (section, metric), higher_is_better in COMPARED_METRICS.items():
+            current_value = entry[section][metric]
+            previous_value = previous.get(section, {}).get(metric)
+            if not previous_value:
+                continue
+            change = (current_value - previous_value) / previous_value
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"documents={entry['documents']} {section}.{metric}: "
+                                   f"{previous_value} -> {current_value} ({change:+.1%})")
+    return regressions
+
+
+async def run(args) -> Dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    settings.CHROMA_DIRECTORY = os.path.join(workdir, "chroma")
+    settings.TEXT_REPOSITORY_PATH = os.path.join(workdir, "textdb")
+    settings.UPLOAD_DIR = os.path.join(workdir, "pdfs")
+    settings.PROGRESS_MODE = "metrics"
+    override_embedding_model(HashingEmbeddings(cost_per_text=args.embedding_cost_ms / 1000))
+    llm = StubChatModel(latency=args.llm_latency_ms / 1000)
+
+    try:
+        results = [await run_size(size, args, workdir, llm) for size in args.sizes]
+    finally:
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parameters": {
+                "sizes": args.sizes,
+                "pages_per_document": args.pages,
+                "queries": args.queries,
+                "answer_queries": args.answer_queries,
+                "embedding_cost_ms": args.embedding_cost_ms,
+                "llm_latency_ms": args.llm_latency_ms,
+                "seed": args.seed,
+            },
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ingest/query benchmarks with stub embedding and chat models")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 20, 50], help="corpus sizes in documents")
+    parser.add_argument("--pages", type=int, default=10, help="pages per generated document")
+    parser.add_argument("--queries", type=int, default=100, help="search queries per corpus size")
+    parser.add_argument("--answer-queries", type=int, default=20, help="answer queries per corpus size")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed warmup queries")
+    parser.add_argument("--embedding-cost-ms", type=float, default=0.0, help="simulated embedding cost per text")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency per LLM call")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="keep stores in this directory instead of a temporary one")
+    parser.add_argument("--keep", action="store_true", help="do not delete the temporary working directory")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression vs. the baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        force=True)
+    logger.setLevel(logging.INFO)
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_with_baseline(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import json
+import time
+import zlib
+import hashlib
+from typing import Any, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.language_models.chat_models import BaseChatModel
+
+
+class HashingEmbeddings(Embeddings):
+    # Deterministic bag-of-words embeddings (feature hashing), so dense retrieval still prefers
+    # passages that share words with the query. cost_per_text simulates model inference time.
+
+    def __init__(self, dimension: int = 768, cost_per_text: float = 0.0):
+        self.dimension = dimension
+        self.cost_per_text = cost_per_text
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in text.split():
+            digest = zlib.crc32(token.encode("utf-8"))
+            vector[digest % self.dimension] += 1.0 if digest & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cost_per_text:
+            time.sleep(self.cost_per_text * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class StubChatModel(BaseChatModel):
+    # Deterministic chat model: answers with a fixed template derived from the prompt and can
+    # simulate provider latency and generation speed.
+    latency: float = 0.0
+    tokens_per_second: Optional[float] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        if '"follow_up_questions"' in prompt:
+            return json.dumps({
+                "answer": f"문맥에 따르면 해당 내용은 약관에 따라 지급됩니다. (ref {digest})",
+                "follow_up_questions": [f"1. 보험금 청구 서류는 무엇인가요? ({digest})",
+                                        f"2. 해지 환급금은 어떻게 계산되나요? ({digest})"]
+            }, ensure_ascii=False)
+        if "추가로 궁금해할 수 있는 질문" in prompt:
+            return f"1. 보험금 청구 서류는 무엇인가요? ({digest})\n2. 해지 환급금은 어떻게 계산되나요? ({digest})"
+        return f"문맥에 따르면 해당 내용은 약관에 따라 지급됩니다. (ref {digest})"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        content = self._reply(messages)
+        delay = self.latency
+        if self.tokens_per_second:
+            delay += len(content.split()) / self.tokens_per_second
+        if delay:
+            time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
@@ -73,7 +73,12 @@ class ApplicationRunner:
             if available_port != backend_port:
                 print(f"Port {backend_port} is not available. Using port {available_port} for backend.")
                 backend_port = available_port
-            backend_cmd = f'uvicorn app.main:app --host {os.getenv("HOST", "127.0.0.1")} --port {backend_port} --log-level info --access-log'
+            backend_host = os.getenv("HOST", "127.0.0.1")
+            workers = int(os.getenv('WORKERS', 1))
+            if workers > 1:
+                backend_cmd = f'{sys.executable} -m app.prefork --host {backend_host} --port {backend_port} --workers {workers}'
+            else:
+                backend_cmd = f'uvicorn app.main:app --host {backend_host} --port {backend_port} --log-level info --access-log'
             print(f"Starting backend with command: {backend_cmd}")
             ApplicationRunner.backend_process = subprocess.Popen(
                 backend_cmd,
@@ -9,4 +9,13 @@ load_dotenv(dotenv_path=env_path)
 
 BACKEND_HOST = os.getenv('BACKEND_HOST', '127.0.0.1')
 BACKEND_PORT = os.getenv('BACKEND_PORT', 8000)
-BASE_URL = f"http://{BACKEND_HOST}:{BACKEND_PORT}"
\ No newline at end of file
+BASE_URL = f"http://{BACKEND_HOST}:{BACKEND_PORT}"
+
+# (connect, read) timeouts in seconds; the read timeout bounds the wait between two streamed lines
+CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', 3))
+ANSWER_READ_TIMEOUT = float(os.getenv('ANSWER_READ_TIMEOUT', 120))
+INGEST_READ_TIMEOUT = float(os.getenv('INGEST_READ_TIMEOUT', 600))
+HEALTHCHECK_TIMEOUT = float(os.getenv('HEALTHCHECK_TIMEOUT', 2))
+# readiness polls per page load before the UI gives up and offers a manual retry
+HEALTHCHECK_MAX_ATTEMPTS = int(os.getenv('HEALTHCHECK_MAX_ATTEMPTS', 10))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
@@ -3,40 +3,44 @@ import time
 from pathlib import Path
 from dotenv import load_dotenv
 import streamlit as st
-import requests
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 sys.path.append(str(PROJECT_ROOT))
 
 from streamlit_app.templates.layout import render_sidebar, render_main_content
 from streamlit_app.components.submit_button import submit_button_with_state
-from streamlit_app.utils.request_handler import get_answer_from_api, ingest_files
-from streamlit_app.config import BASE_URL
+from streamlit_app.utils.request_handler import get_answer_from_api, ingest_files, is_backend_ready
+from streamlit_app.config import HEALTHCHECK_MAX_ATTEMPTS
 
 env_path = Path(__file__).resolve().parent / '.env.local'
 print(f"Loading environment variables from {env_path}")
 load_dotenv(dotenv_path=env_path)
 
-api_url = f"{BASE_URL}"
 
+def wait_for_backend() -> bool:
+    # a bounded number of polls with growing pauses; once ready the check is skipped for this browser session
+    if st.session_state.get("backend_ready"):
+        return True
+    with st.spinner("Waiting for backend to be ready..."):
+        for attempt in range(HEALTHCHECK_MAX_ATTEMPTS):
+            if is_backend_ready():
+                st.session_state["backend_ready"] = True
+                return True
+            time.sleep(min(0.5 * 2 ** attempt, 5))
+    return False
 
-def is_backend_ready(base_url):
-    try:
-        response = requests.get(f"{base_url}/healthcheck")
-        response.raise_for_status()
-        return response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        print(f"Backend health check failed: {e}")
-        return False
 
-
-while not is_backend_ready(api_url):
-    st.warning("Waiting for backend to be ready...")
-    time.sleep(1)
+if not wait_for_backend():
+    st.warning("백엔드가 아직 준비되지 않았습니다. 잠시 후 다시 시도해주세요.")
+    st.button("다시 시도")
+    st.stop()
 
 if "chat_history" not in st.session_state:
     st.session_state["chat_history"] = []
 
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = None
+
 if "is_processing" not in st.session_state:
     st.session_state["is_processing"] = False
 
@@ -67,28 +71,41 @@ if ingest_button:
 
 
 def handle_submit():
+    # the answer itself is fetched further down the script, where it can be rendered while it streams in
     query = st.session_state["user_query"]
     if query and not st.session_state["is_processing"]:
         st.session_state["is_processing"] = True
         st.session_state["previous_query"] = query
+        st.session_state["pending_query"] = query
         st.session_state["user_query"] = ""
 
-        with st.spinner('답변을 생성 중입니다...'):
-            answer = get_answer_from_api(query, st.session_state["chat_history"], st.session_state["collection_name"])
 
-        if answer == "Error occurred while fetching the answer.":
-            st.toast("Ingest를 먼저 진행해주세요.", icon="⚠️")
-        else:
-            st.session_state["chat_history"].append({"role": "user", "content": query})
-            st.session_state["chat_history"].append({"role": "assistant", "content": answer})
+def answer_pending_query():
+    query = st.session_state.pop("pending_query")
+    st.markdown(f"**User:** {query}")
+    placeholder = st.empty()
+    with st.spinner('답변을 생성 중입니다...'):
+        answer = get_answer_from_api(query, st.session_state["session_id"], st.session_state["collection_name"],
+                                     placeholder=placeholder)
+
+    if answer == "Error occurred while fetching the answer.":
+        st.toast("Ingest를 먼저 진행해주세요.", icon="⚠️")
+    else:
+        st.session_state["chat_history"].append({"role": "user", "content": query})
+        st.session_state["chat_history"].append({"role": "assistant", "content": answer})
 
-        st.session_state["is_processing"] = False
-        st.session_state["lock_widgets"] = False
+    st.session_state["is_processing"] = False
+    st.session_state["lock_widgets"] = False
+    # redraw with the inputs enabled again and the answer moved into the history below
+    st.experimental_rerun()
 
 
 user_query = render_main_content()
 submit_button_with_state("Submit", handle_submit)
 
+if st.session_state.get("pending_query"):
+    answer_pending_query()
+
 if st.session_state["collection_name"]:
     st.sidebar.info(f"현재 참조 중인 컬렉션: {st.session_state['collection_name']}")
 
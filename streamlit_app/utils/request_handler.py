@@ -1,25 +1,72 @@
+import json
 import requests
 import streamlit as st
-from streamlit_app.config import BASE_URL
+from requests.adapters import HTTPAdapter
+from streamlit_app.config import (
+    BASE_URL, CONNECT_TIMEOUT, ANSWER_READ_TIMEOUT, INGEST_READ_TIMEOUT, HEALTHCHECK_TIMEOUT, HTTP_POOL_SIZE
+)
 
+INGEST_STAGES = {"vector": "벡터 저장", "text": "텍스트 저장", "bm25": "검색 인덱스 갱신"}
 
-def get_answer_from_api(query: str, chat_history, collection_name: str):
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    # one keep-alive pool shared by every browser session of this Streamlit process
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _read_events(response: requests.Response):
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            yield json.loads(line)
+
+
+def is_backend_ready() -> bool:
     try:
-        response = requests.post(
-            f"{BASE_URL}/api/v1/answer/answer_question",
+        response = get_http_session().get(f"{BASE_URL}/readiness", timeout=(CONNECT_TIMEOUT, HEALTHCHECK_TIMEOUT))
+        return response.status_code == 200
+    except requests.exceptions.RequestException as e:
+        print(f"Backend health check failed: {e}")
+        return False
+
+
+def get_answer_from_api(query: str, session_id, collection_name: str, placeholder=None):
+    # streams the answer into the placeholder as it is generated and returns the complete text
+    answer = ""
+    try:
+        # the backend keeps the conversation; only the session id travels with each question
+        with get_http_session().post(
+            f"{BASE_URL}/api/v1/answer/answer_question_stream",
             json={
                 "query": query,
-                "chat_history": chat_history
+                "session_id": session_id
             },
             params={
                 "collection_name": collection_name
-            }
-        )
-        response.raise_for_status()
-        response_data = response.json()
-        message = response_data.get("data", {}).get("message", "No answer found.")
-        return message
-    except requests.RequestException as e:
+            },
+            stream=True,
+            timeout=(CONNECT_TIMEOUT, ANSWER_READ_TIMEOUT)
+        ) as response:
+            response.raise_for_status()
+            for event in _read_events(response):
+                if event["type"] == "token":
+                    answer += event["text"]
+                    if placeholder is not None:
+                        placeholder.markdown(f"**Assistant:** {answer}▌")
+                elif event["type"] == "done":
+                    if event.get("session_id"):
+                        st.session_state["session_id"] = event["session_id"]
+                    answer = event.get("message") or answer
+                else:
+                    raise requests.RequestException(event.get("message", "Streaming failed"))
+        if placeholder is not None:
+            placeholder.markdown(f"**Assistant:** {answer}")
+        return answer or "No answer found."
+    except (requests.RequestException, ValueError) as e:
         st.error(f"Failed to fetch answer: {e}")
         return "Error occurred while fetching the answer."
 
@@ -36,14 +83,31 @@ def ingest_files(files, collection_name):
     if not file_data:
         return "No files to ingest."
 
+    progress_bar = st.sidebar.progress(0.0, text="업로드 중...")
     try:
-        response = requests.post(
-            f"{BASE_URL}/api/v1/ingest/ingest_data",
+        with get_http_session().post(
+            f"{BASE_URL}/api/v1/ingest/ingest_data_stream",
             files=file_data,
-            data={"collection_name": collection_name}
-        )
-        response.raise_for_status()
-        return response.json().get("message", "Files ingested successfully.")
-    except requests.RequestException as e:
+            data={"collection_name": collection_name},
+            stream=True,
+            timeout=(CONNECT_TIMEOUT, INGEST_READ_TIMEOUT)
+        ) as response:
+            response.raise_for_status()
+            message = "Files ingested successfully."
+            for event in _read_events(response):
+                if event["type"] == "progress":
+                    # vector and text stages each take half of the bar; the index refresh closes it
+                    stage_offset = {"vector": 0.0, "text": 0.5, "bm25": 1.0}[event["stage"]]
+                    fraction = min(1.0, stage_offset + 0.5 * event["completed"] / max(event["total"], 1))
+                    progress_bar.progress(fraction, text=f"{INGEST_STAGES[event['stage']]} "
+                                                         f"({event['completed']}/{event['total']})")
+                elif event["type"] == "done":
+                    message = event.get("message", message)
+                else:
+                    raise requests.RequestException(event.get("message", "Ingest failed"))
+        progress_bar.progress(1.0, text="완료")
+        return message
+    except (requests.RequestException, ValueError) as e:
+        progress_bar.empty()
         st.error(f"Failed to ingest files: {e}")
         return "Error occurred while ingesting files."
@@ -0,0 +1,19 @@
+import pytest
+from app.config import settings
+from app.core.embeddings.initializers import override_embedding_model
+from benchmarks.stubs import HashingEmbeddings
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    # every store of the app under tmp_path, embedded with the deterministic stub model
+    monkeypatch.setattr(settings, "CHROMA_MODE", "persistent")
+    monkeypatch.setattr(settings, "CHROMA_DIRECTORY", str(tmp_path / "chroma"))
+    monkeypatch.setattr(settings, "TEXT_REPOSITORY_PATH", str(tmp_path / "text"))
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "pdfs"))
+    monkeypatch.setattr(settings, "PAGE_CACHE_PATH", str(tmp_path / "page_cache.sqlite3"))
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "PROGRESS_MODE", "metrics")
+    override_embedding_model(HashingEmbeddings(dimension=64))
+    yield tmp_path
+    override_embedding_model(None)
@@ -0,0 +1,156 @@
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from app.config import settings
+from app.models.state import AppState
+from app.api.v1.endpoints.ingest_data import router as ingest_data_router
+from app.api.v1.endpoints.bulk_answer import router as bulk_answer_router
+from langchain_core.documents import Document
+from app.repositories.text_repository import TextRepository
+from app.core.utils import metrics
+from app.core.utils.metrics import Counter, Gauge, Histogram
+from app.core.utils.tracing import Trace, TraceStore, span, start_trace, trace_store
+from app.main import trace_requests
+
+
+@pytest.fixture
+def client(stores):
+    app = FastAPI()
+    app.include_router(ingest_data_router, prefix="/api/v1/ingest")
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("payload", [
+    {},
+    {"source": "manual.pdf"},
+    {"collection_name": "default"},
+    {"collection_name": "", "source": "manual.pdf"},
+    {"collection_name": "default", "source": []},
+    {"collection_name": "default", "source": [""]},
+    {"collection_name": "default", "source": ["manual.pdf", 3]},
+    {"collection_name": "default", "source": {"file_name": "manual.pdf"}},
+])
+def test_delete_data_rejects_a_payload_without_collection_or_file_names(client, stores, payload):
+    text_repo = TextRepository(str(stores / "text"))
+    text_repo.save_documents([Document(page_content=f"보험금 청구 {i}", metadata={"file_name": "manual.pdf"})
+                              for i in range(4)], "default")
+
+    response = client.post("/api/v1/ingest/delete_data", json=payload)
+
+    assert response.status_code == 400
+    assert response.json()["code"] == "400_ERROR"
+    assert text_repo.dead_documents("default") == (0, 4)
+
+
+@pytest.mark.parametrize("job_id", ["..", ".", "a/b", "a.b", "x" * 65])
+def test_answer_job_id_must_not_leave_the_job_directory(tmp_path, monkeypatch, job_id):
+    monkeypatch.setattr(settings, "BULK_JOB_DIRECTORY", str(tmp_path / "jobs"))
+    app = FastAPI()
+    app.state.app_state = AppState(ready=True)
+    app.include_router(bulk_answer_router, prefix="/api/v1/bulk")
+    client = TestClient(app)
+
+    response = client.post("/api/v1/bulk/answer_jobs", data={"collection_name": "default", "job_id": job_id},
+                           files={"file": ("questions.jsonl", '{"question": "보험금 청구"}\n'.encode())})
+
+    assert response.status_code == 400
+    assert list(tmp_path.iterdir()) == []
+    assert client.get(f"/api/v1/bulk/answer_jobs/{job_id}/results").status_code == 404
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # metrics made by a test are rendered on their own and do not show up in the app's /metrics
+    monkeypatch.setattr(metrics, "_registry", [])
+
+
+def test_histogram_buckets_are_cumulative_up_to_inf(registry):
+    histogram = Histogram("rag_test_seconds", "Test latency", ["stage"], buckets=(1.0, 0.1))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, stage="answer")
+
+    assert metrics.render_metrics().splitlines() == [
+        "# HELP rag_test_seconds Test latency",
+        "# TYPE rag_test_seconds histogram",
+        'rag_test_seconds_bucket{stage="answer",le="0.1"} 2',
+        'rag_test_seconds_bucket{stage="answer",le="1.0"} 3',
+        'rag_test_seconds_bucket{stage="answer",le="+Inf"} 4',
+        'rag_test_seconds_sum{stage="answer"} 3.65',
+        'rag_test_seconds_count{stage="answer"} 4',
+    ]
+
+
+def test_label_values_are_escaped(registry):
+    counter = Counter("rag_test_total", "Test counter", ["file_name"])
+    counter.inc(file_name='C:\\약관\\"신규".pdf\n2')
+    gauge = Gauge("rag_test_gauge", "Test gauge")
+    gauge.set(float("inf"))
+
+    assert metrics.render_metrics().splitlines()[2::3] == [
+        'rag_test_total{file_name="C:\\\\약관\\\\\\"신규\\".pdf\\n2"} 1.0',
+        "rag_test_gauge +Inf",
+    ]
+    with pytest.raises(ValueError):
+        counter.inc(source="a.pdf")
+
+
+def test_spans_nest_within_a_trace_and_across_tasks():
+    async def retrieve(name):
+        with span(name):
+            await asyncio.sleep(0)
+
+    async def answer():
+        with span("answer", model_name="stub"):
+            await asyncio.gather(retrieve("retrieval"), retrieve("retrieval.rewritten_query"))
+        with pytest.raises(ValueError), span("follow_up"):
+            raise ValueError("bad request")
+
+    with span("outside") as record:
+        assert record is None
+    with start_trace("trace-test", "POST /answer") as trace:
+        asyncio.run(answer())
+
+    assert [(record["span_id"], record["parent_id"], record["name"]) for record in trace.spans] == [
+        (1, None, "answer"), (2, 1, "retrieval"), (3, 1, "retrieval.rewritten_query"), (4, None, "follow_up")]
+    assert trace.spans[3]["attributes"] == {"error": "bad request"}
+    assert all(record["duration_ms"] is not None for record in trace.spans)
+    assert trace.duration_ms is not None
+
+
+def test_trace_store_keeps_the_most_recent_traces():
+    store = TraceStore(max_size=2)
+    first, second, third = (Trace(request_id, "GET /") for request_id in ("r1", "r2", "r3"))
+    store.add(first)
+    store.add(second)
+    # adding a trace again makes it the most recent one
+    store.add(first)
+    store.add(third)
+
+    assert store.get("r2") is None
+    assert store.recent() == [third, first]
+    assert store.recent(limit=1) == [third]
+
+
+def test_streamed_response_is_traced_until_its_body_ends():
+    app = FastAPI()
+    app.middleware("http")(trace_requests)
+
+    @app.get("/stream")
+    def stream():
+        async def tokens():
+            for token in ("보험금", "청구"):
+                with span("llm.answer"):
+                    await asyncio.sleep(0.05)
+                yield token
+
+        return StreamingResponse(tokens(), media_type="application/x-ndjson")
+
+    response = TestClient(app).get("/stream", headers={"X-Request-ID": "stream-test"})
+
+    assert response.text == "보험금청구"
+    assert response.headers["X-Request-ID"] == "stream-test"
+    trace = trace_store.get("stream-test")
+    assert [record["name"] for record in trace.spans] == ["llm.answer", "llm.answer"]
+    assert trace.duration_ms >= 100
@@ -0,0 +1,360 @@
+import time
+import asyncio
+from types import SimpleNamespace
+import pytest
+from app.config import settings
+from app.repositories.chroma_repository import ChromaRepository
+from app.repositories import chroma_client
+from app.repositories.chroma_client import HostLeaseError, close_batch_writers, get_batch_writer, vector_write_lock
+from app.repositories.text_repository import TextRepository
+from app.repositories.embedding_cache_repository import EmbeddingCacheRepository
+from app.repositories.page_cache_repository import PageCacheRepository
+from app.core.embeddings.cached_embeddings import embedding_cache_key
+from app.core.embeddings.initializers import with_embedding_cache
+from app.repositories.session_repository import SessionRepository
+from app.services.session_service import SessionService
+from langchain_core.documents import Document
+from benchmarks.stubs import HashingEmbeddings
+
+
+def add_texts(repository, texts, file_name="manual.pdf"):
+    embeddings = repository.ko_embedding.embed_documents(texts)
+    repository._call(lambda: repository.vectorstore._collection.add(
+        ids=[f"{file_name}-{i}" for i in range(len(texts))], embeddings=embeddings, documents=texts,
+        metadatas=[{"source": f"/pdfs/{file_name}", "file_name": file_name, "page": 1} for _ in texts]
+    ))
+
+
+def file_documents(file_name, count):
+    return [Document(page_content=f"{file_name} 청크 {i}", metadata={"source": f"/pdfs/{file_name}",
+                                                                    "file_name": file_name, "page": 1})
+            for i in range(count)]
+
+
+def test_text_store_delete_reingest_delete_and_compact(tmp_path):
+    repository = TextRepository(str(tmp_path))
+    repository.save_documents(file_documents("a.pdf", 3) + file_documents("b.pdf", 2), "default")
+
+    assert repository.delete_sources("default", ["a.pdf"]) == 3
+    assert [doc.metadata["file_name"] for doc in repository.load_documents("default")] == ["b.pdf"] * 2
+    assert repository.dead_documents("default") == (3, 5)
+
+    # the re-ingested chunks are appended after the tombstone and stay alive
+    repository.save_documents(file_documents("a.pdf", 3), "default")
+    assert len(repository.load_documents("default")) == 5
+    # a second delete only counts the chunks of the re-ingest
+    assert repository.delete_sources("default", ["a.pdf"]) == 3
+    assert repository.delete_sources("default", ["a.pdf"]) == 0
+    assert repository.dead_documents("default") == (6, 8)
+
+    repository.save_documents(file_documents("a.pdf", 3), "default")
+    assert repository.compact("default") == 6
+    assert repository.read_tombstones("default") == {}
+    assert repository.dead_documents("default") == (0, 5)
+    assert [doc.page_content for doc in repository.load_documents("default", include_deleted=True)] == \
+        [doc.page_content for doc in file_documents("b.pdf", 2) + file_documents("a.pdf", 3)]
+    assert repository.compact("default") == 0
+
+
+def test_text_keys_held_across_saves_see_other_writers_and_deletes(tmp_path):
+    repository = TextRepository(str(tmp_path))
+    held = repository.load_document_keys("default")
+
+    # another worker saves the same chunks after the keys were read
+    repository.save_documents(file_documents("a.pdf", 3), "default")
+    repository.save_documents(file_documents("a.pdf", 3), "default", existing_keys=held)
+    assert len(repository.load_documents("default", include_deleted=True)) == 3
+
+    # a delete after the keys were read lets the file be ingested again
+    repository.delete_sources("default", ["a.pdf"])
+    repository.save_documents(file_documents("a.pdf", 3), "default", existing_keys=held)
+    assert len(repository.load_documents("default")) == 3
+
+    repository.compact("default")
+    repository.save_documents(file_documents("a.pdf", 3) + file_documents("b.pdf", 1), "default",
+                              existing_keys=held)
+    assert len(repository.load_documents("default", include_deleted=True)) == 4
+
+
+def test_reset_client_cache_stops_the_system_after_running_operations(stores):
+    repository = ChromaRepository("default", str(stores / "chroma"))
+    add_texts(repository, ["보험금 청구 절차", "해지 환급금"])
+    system = repository._system
+
+    def reset_during_operation():
+        ChromaRepository.reset_client_cache("default", str(stores / "chroma"))
+        # the operation still runs on the dropped System
+        assert system._running
+        return repository.vectorstore._collection.count()
+
+    assert repository._call(reset_during_operation) == 2
+    assert not system._running
+
+    # a repository opened before the reset reopens the store
+    assert repository._call(lambda: repository.vectorstore._collection.count()) == 2
+    assert repository._system is not system and repository._system._running
+
+
+def test_vacuum_keeps_repositories_opened_before_it_working(stores):
+    repository = ChromaRepository("default", str(stores / "chroma"))
+    add_texts(repository, ["보험금 청구 절차", "해지 환급금"])
+    add_texts(repository, ["약관 변경 안내"], file_name="other.pdf")
+    opened_before = ChromaRepository("default", str(stores / "chroma"))
+    assert asyncio.run(repository.delete_sources(["other.pdf"])) == 1
+
+    assert repository.vacuum()
+
+    client = repository.vectorstore._collection._client
+    assert [collection.name for collection in client.list_collections()] == ["default"]
+    # the stale repository finds the compacted collection by its name, for reads and writes alike
+    assert opened_before._call(lambda: opened_before.vectorstore._collection.count()) == 2
+    document = opened_before._query(opened_before.ko_embedding.embed_documents(["해지 환급금"]), 1)[0][0][1]
+    assert document.page_content == "해지 환급금"
+    asyncio.run(opened_before.add_embedded_documents([document], opened_before.ko_embedding.embed_documents(
+        [document.page_content])))
+    assert repository._call(lambda: repository.vectorstore._collection.count()) == 3
+
+
+def test_vacuum_is_abandoned_when_writes_keep_the_count(stores, monkeypatch):
+    repository = ChromaRepository("default", str(stores / "chroma"))
+    add_texts(repository, ["보험금 청구 절차", "해지 환급금"])
+    add_texts(repository, ["약관 변경 안내"], file_name="other.pdf")
+    writer = ChromaRepository("default", str(stores / "chroma"))
+    copy_collection = ChromaRepository._copy_collection
+
+    def copy_while_writing(source, target):
+        # one record deleted and one added during the copy: the count is unchanged but the contents are not
+        assert writer._delete_sources(["other.pdf"]) == 1
+        embedding = writer.ko_embedding.embed_documents(["새 약관"])
+        writer._call(lambda: writer.vectorstore._collection.add(
+            ids=["new"], embeddings=embedding, documents=["새 약관"], metadatas=[{"file_name": "new.pdf"}]
+        ), write=True)
+        return copy_collection(source, target)
+
+    monkeypatch.setattr(ChromaRepository, "_copy_collection", staticmethod(copy_while_writing))
+    assert not repository.vacuum()
+
+    collection = repository.vectorstore._collection
+    assert "new" in collection.get(include=[])["ids"]
+    assert [c.name for c in repository.vectorstore._client.list_collections()] == ["default"]
+
+    monkeypatch.setattr(ChromaRepository, "_copy_collection", staticmethod(copy_collection))
+    assert repository.vacuum()
+    assert sorted(repository.vectorstore._collection.get()["documents"]) == sorted(["보험금 청구 절차", "해지 환급금", "새 약관"])
+
+
+def test_batch_writer_sends_lingering_writes_on_close(stores, monkeypatch):
+    monkeypatch.setattr(settings, "CHROMA_WRITE_LINGER_MS", 60_000)
+    repository = ChromaRepository("default", str(stores / "chroma"))
+    collection = repository.vectorstore._collection
+    texts = ["보험금 청구 절차", "해지 환급금"]
+    embeddings = repository.ko_embedding.embed_documents(texts)
+
+    async def write_and_shut_down():
+        writes = [asyncio.create_task(get_batch_writer(collection).add(
+            ids=[f"chunk-{i}"], embeddings=[embedding], documents=[text], metadatas=[{"file_name": "manual.pdf"}]
+        )) for i, (text, embedding) in enumerate(zip(texts, embeddings))]
+        await asyncio.sleep(0)
+        assert collection.count() == 0
+        await close_batch_writers()
+        await asyncio.gather(*writes)
+
+    asyncio.run(write_and_shut_down())
+    assert collection.count() == 2
+
+
+class LeaseServer:
+    # the part of a Chroma client the host lease uses
+    def __init__(self):
+        self.collections = {}
+
+    def create_collection(self, name, metadata, embedding_function):
+        if name in self.collections:
+            raise ValueError(f"Collection {name} already exists")
+        self.collections[name] = SimpleNamespace(metadata=metadata, modify=lambda metadata: setattr(
+            self.collections[name], "metadata", metadata))
+        return self.collections[name]
+
+    def get_collection(self, name, embedding_function):
+        return self.collections[name]
+
+
+def test_chroma_server_is_used_from_one_host_at_a_time(stores, monkeypatch):
+    server = LeaseServer()
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(settings, "CHROMA_MODE", "http")
+    monkeypatch.setattr(chroma_client, "get_chroma_http_client", lambda: server)
+    monkeypatch.setattr(chroma_client, "time", SimpleNamespace(time=lambda: clock.now))
+
+    def lock_from(host):
+        # a fresh process on the host
+        monkeypatch.setattr(chroma_client, "_lease_renewed_at", 0.0)
+        monkeypatch.setattr(chroma_client.socket, "gethostname", lambda: host)
+        with vector_write_lock("default", count_write=True):
+            pass
+
+    lock_from("api-1")
+    clock.now += 60
+    lock_from("api-1")
+    with pytest.raises(HostLeaseError):
+        lock_from("api-2")
+
+    # the first host stopped; once its lease lapses another host may take over
+    clock.now += settings.CHROMA_HOST_LEASE_SECONDS
+    lock_from("api-2")
+    assert server.collections["rag-host-lease"].metadata["host"] == "api-2"
+
+    monkeypatch.setattr(settings, "CHROMA_HOST_LEASE_SECONDS", 0)
+    lock_from("api-3")
+
+
+def test_session_save_with_expected_version(tmp_path):
+    repository = SessionRepository(str(tmp_path / "sessions.sqlite3"), ttl_seconds=60)
+
+    assert repository.save("s1", "", [{"role": "user", "content": "a"}], expected_version=0)
+    assert not repository.save("s1", "", [], expected_version=0)
+    assert not repository.save("s1", "", [], expected_version=2)
+    assert repository.save("s1", "요약", [], expected_version=1)
+    assert repository.get("s1") == {"session_id": "s1", "summary": "요약", "turns": [], "version": 2}
+
+
+class InterleavedAnswerService:
+    # answers every query only after all of them were asked, so their turns are saved concurrently
+    model_name = "gpt-4o-mini"
+
+    def __init__(self, queries):
+        self.pending = set(queries)
+        self.asked = asyncio.Event()
+
+    async def get_answer(self, query, turns, collection_name, **kwargs):
+        self.pending.discard(query)
+        if not self.pending:
+            self.asked.set()
+        await self.asked.wait()
+        return f"answer to {query}"
+
+
+def test_concurrent_turns_of_one_session_are_all_kept(tmp_path):
+    queries = ["q1", "q2", "q3"]
+    repository = SessionRepository(str(tmp_path / "sessions.sqlite3"), ttl_seconds=60)
+    service = SessionService(InterleavedAnswerService(queries), repository)
+
+    async def ask_all():
+        await asyncio.gather(*(service.answer(query, "s1", "default") for query in queries))
+
+    asyncio.run(ask_all())
+
+    turns = repository.get("s1")["turns"]
+    assert sorted(entry["content"] for entry in turns if entry["role"] == "user") == queries
+    assert len(turns) == 6
+
+
+def cache_key(text):
+    return embedding_cache_key("documents", text)
+
+
+def parsed_pages(text, count):
+    return {page_number: {"body": f"{text} {page_number}", "tables": []} for page_number in range(count)}
+
+
+def cached_bytes(repository):
+    with repository._connect() as connection:
+        return connection.execute("SELECT SUM(size) FROM pages").fetchone()[0]
+
+
+def test_page_cache_evicts_least_recently_read_documents_to_stay_in_size(tmp_path):
+    # every page below is 51 bytes of JSON; room for five of them
+    page_size = len('{"body": "보험금 청구 안내 0", "tables": []}'.encode("utf-8"))
+    repository = PageCacheRepository(str(tmp_path / "pages.sqlite3"), max_bytes=page_size * 5)
+    repository.save_pages("a", "v2-no-ocr", parsed_pages("보험금 청구 안내", 2))
+    time.sleep(0.01)
+    repository.save_pages("b", "v2-no-ocr", parsed_pages("해지 환급금 안내", 2))
+    time.sleep(0.01)
+    assert repository.get_pages("a", "v2-no-ocr") == parsed_pages("보험금 청구 안내", 2)
+    time.sleep(0.01)
+
+    repository.save_pages("c", "v2-no-ocr", parsed_pages("보장 기간 설명서", 2))
+
+    # pages are evicted one at a time, only as many as it takes to fit
+    assert len(repository.get_pages("b", "v2-no-ocr")) == 1
+    assert repository.get_pages("a", "v2-no-ocr") == parsed_pages("보험금 청구 안내", 2)
+    assert repository.get_pages("c", "v2-no-ocr") == parsed_pages("보장 기간 설명서", 2)
+    assert cached_bytes(repository) == page_size * 5
+    # pages parsed with other settings are kept apart
+    assert repository.get_pages("a", "v2-ocr-300-kor") == {}
+
+    # a document larger than the whole cache pushes out everything else and keeps what fits
+    repository.save_pages("d", "v2-no-ocr", parsed_pages("약관 보장 설명서", 6))
+    assert cached_bytes(repository) == page_size * 5
+    assert repository.get_pages("a", "v2-no-ocr") == {}
+    assert len(repository.get_pages("d", "v2-no-ocr")) == 5
+
+
+def test_embedding_cache_put_and_get(tmp_path):
+    repository = EmbeddingCacheRepository(str(tmp_path), max_bytes=4 * 4 * 10)
+    vectors = {cache_key("a"): [1.0, 0.0, 0.0, 0.0], cache_key("b"): [0.0, 1.0, 0.0, 0.0]}
+
+    assert repository.put_many(vectors) == 2
+    assert repository.put_many(vectors) is None
+
+    found = repository.get_many([cache_key("a"), cache_key("b"), cache_key("c")])
+    assert {key: vector.tolist() for key, vector in found.items()} == vectors
+    assert repository.count() == 2
+
+
+def test_embedding_cache_reuses_least_recently_read_slots(tmp_path):
+    # room for three vectors of four floats
+    repository = EmbeddingCacheRepository(str(tmp_path), max_bytes=4 * 4 * 3)
+    keys = [cache_key(text) for text in "abcd"]
+    for index, key in enumerate(keys[:3]):
+        repository.put_many({key: [float(index)] * 4})
+    time.sleep(0.01)
+    repository.get_many([keys[0]])
+
+    assert repository.put_many({keys[3]: [3.0] * 4}) == 3
+
+    found = repository.get_many(keys)
+    assert sorted(found) == sorted([keys[0], keys[2], keys[3]])
+    assert found[keys[3]].tolist() == [3.0] * 4
+    assert found[keys[0]].tolist() == [0.0] * 4
+
+
+def test_embedding_cache_reads_do_not_write_until_the_next_put(tmp_path):
+    repository = EmbeddingCacheRepository(str(tmp_path), max_bytes=4 * 4 * 10)
+    repository.put_many({cache_key("a"): [1.0] * 4})
+
+    def accessed_at():
+        with repository._connect() as connection:
+            return connection.execute("SELECT accessed_at FROM entries").fetchone()[0]
+
+    written = accessed_at()
+    time.sleep(0.01)
+    repository.get_many([cache_key("a")])
+    assert accessed_at() == written
+
+    repository.put_many({cache_key("b"): [2.0] * 4})
+    with repository._connect() as connection:
+        assert connection.execute(
+            "SELECT accessed_at FROM entries WHERE key = ?", (cache_key("a"),)
+        ).fetchone()[0] > written
+
+
+def test_query_embeddings_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_DIRECTORY", str(tmp_path))
+    embedding = with_embedding_cache(HashingEmbeddings(dimension=8), "upskyy/kf-deberta-multitask@rev1")
+
+    assert embedding.embed_query("보험금 청구") == HashingEmbeddings(dimension=8).embed_query("보험금 청구")
+    assert embedding.repository.count() == 0
+
+
+def test_embedding_cache_is_kept_per_model_revision(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_DIRECTORY", str(tmp_path))
+    model = HashingEmbeddings(dimension=8)
+    first_revision = with_embedding_cache(model, "upskyy/kf-deberta-multitask@rev1")
+    first_revision.embed_documents(["보험금 청구"])
+
+    second_revision = with_embedding_cache(model, "upskyy/kf-deberta-multitask@rev2")
+
+    assert second_revision.repository.directory != first_revision.repository.directory
+    assert second_revision.repository.get_many([cache_key("보험금 청구")]) == {}
+    assert first_revision.repository.get_many([cache_key("보험금 청구")])
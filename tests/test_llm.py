@@ -0,0 +1,299 @@
+import json
+import asyncio
+from types import SimpleNamespace
+from typing import Any, List
+import pytest
+from tenacity import wait_none
+from langchain.prompts import ChatPromptTemplate
+from app.config import settings
+from app.models.state import AppState
+from app.core.utils import rate_limiter
+from app.core.utils.rate_limiter import RateLimiter
+from app.core.utils.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, HALF_OPEN, OPEN
+from app.services import answer_service, bulk_answer_service
+from app.services.bulk_answer_service import BulkAnswerJob
+from app.services.answer_service import AnswerService, FOLLOW_UP_HEADER, parse_structured_answer
+from app.core.utils.metrics import ANSWER_FALLBACKS_TOTAL, CACHE_HITS_TOTAL
+from benchmarks.stubs import HashingEmbeddings, StubChatModel
+
+PROMPT = ChatPromptTemplate.from_messages([("user", "{input}")])
+
+
+class RaisingChatModel(StubChatModel):
+    error: Any = None
+
+    async def _agenerate(self, *args, **kwargs):
+        if self.error is None:
+            await asyncio.Event().wait()
+        raise self.error
+
+
+def half_open_service(model_name, llm):
+    service = AnswerService(model_name, llm=llm)
+    service.circuit_breaker = CircuitBreaker(model_name, failure_threshold=1, reset_timeout=0)
+    service.circuit_breaker.record_failure()
+    assert service.circuit_breaker.state == OPEN
+    return service
+
+
+def test_circuit_breaker_probe_outcomes():
+    breaker = CircuitBreaker("breaker-test", failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    breaker.release_probe()
+    assert breaker.state == OPEN
+
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_probe_failing_with_a_non_transient_error_closes_the_circuit():
+    service = half_open_service("probe-bad-request", RaisingChatModel(error=ValueError("bad request")))
+
+    with pytest.raises(ValueError):
+        asyncio.run(service._invoke(PROMPT, {"input": "q"}, stage="answer"))
+
+    assert service.circuit_breaker.state == CLOSED
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    service = half_open_service("probe-cancelled", RaisingChatModel())
+
+    async def cancel_probe():
+        task = asyncio.create_task(service._invoke(PROMPT, {"input": "q"}, stage="answer"))
+        await asyncio.sleep(0.05)
+        assert service.circuit_breaker.state == HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+
+    assert service.circuit_breaker.state == OPEN
+    service.llm = StubChatModel()
+    assert asyncio.run(service._invoke(PROMPT, {"input": "q"}, stage="answer"))
+    assert service.circuit_breaker.state == CLOSED
+
+
+def test_stream_closed_by_a_disconnecting_client_releases_the_probe():
+    service = half_open_service("probe-stream", StubChatModel())
+
+    async def disconnect_after_first_chunk():
+        stream = service._stream(PROMPT, {"input": "q"}, stage="answer")
+        assert await stream.__anext__()
+        assert service.circuit_breaker.state == HALF_OPEN
+        await stream.aclose()
+
+    asyncio.run(disconnect_after_first_chunk())
+
+    assert service.circuit_breaker.state == OPEN
+
+
+def test_rate_limiter_waits_for_the_budget_to_refill(monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(rate_limiter, "asyncio", SimpleNamespace(Lock=asyncio.Lock, sleep=sleep))
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+
+    async def acquire_all():
+        await limiter.acquire(600, requests=2)
+        # tokens run out first: 300 tokens take half a minute to refill
+        await limiter.acquire(300, requests=1)
+        # a call larger than the whole budget waits for a full bucket instead of forever
+        await limiter.acquire(10_000, requests=1)
+
+    asyncio.run(acquire_all())
+    assert waits == pytest.approx([30.0, 60.0])
+
+
+class StubBatchSearchService:
+    def __init__(self, collection_name, queries, app_state):
+        self.queries = queries
+
+    async def get_relevant_documents(self, include_embeddings=False):
+        return {"results": [{"results": [{"page_content": f"{query} 관련 문서", "metadata": {"source": "/pdfs/a.pdf"}}]}
+                            for query in self.queries]}
+
+
+def bulk_job(tmp_path, monkeypatch, get_answer, fast=False):
+    monkeypatch.setattr(settings, "ANSWER_FAST_MODE", fast)
+    monkeypatch.setattr(bulk_answer_service, "BatchSearchService", StubBatchSearchService)
+    monkeypatch.setattr(bulk_answer_service, "wait_random_exponential", lambda **kwargs: wait_none())
+    job = BulkAnswerJob("job", str(tmp_path / "questions.jsonl"), str(tmp_path / "answers.jsonl"), "default",
+                        AppState(ready=True), max_attempts=3, llm=StubChatModel())
+    job.answer_service.get_answer = get_answer
+    return job
+
+
+def test_bulk_job_resumes_from_its_answers_file(tmp_path, monkeypatch):
+    (tmp_path / "questions.jsonl").write_text(
+        "".join(json.dumps({"id": number, "question": f"질문 {number}"}) + "\n" for number in range(1, 5)))
+    # 1 was answered; 2 failed and is asked again; 3 was cut off by a crash in the middle of its line
+    (tmp_path / "answers.jsonl").write_text(
+        json.dumps({"id": "1", "question": "질문 1", "answer": "답변 1"}) + "\n"
+        + json.dumps({"id": "2", "question": "질문 2", "error": "timeout"}) + "\n" + '{"id": "3", "ans')
+    asked = []
+
+    async def get_answer(query, chat_history, collection_name, relevant_docs=None, fast=None):
+        asked.append(query)
+        return f"{query} 답변"
+
+    summary = asyncio.run(bulk_job(tmp_path, monkeypatch, get_answer).run())
+
+    assert sorted(asked) == ["질문 2", "질문 3", "질문 4"]
+    assert summary["status"] == "completed"
+    assert (summary["total"], summary["skipped"], summary["answered"]) == (4, 1, 3)
+    lines = (tmp_path / "answers.jsonl").read_text().splitlines()
+    assert lines[2] == '{"id": "3", "ans'
+    assert sorted(json.loads(line)["id"] for line in lines[3:]) == ["2", "3", "4"]
+    assert bulk_answer_service.read_completed_ids(str(tmp_path / "answers.jsonl")) == {"1", "2", "3", "4"}
+
+
+@pytest.mark.parametrize("fast, calls", [(True, 1), (False, 2)])
+def test_bulk_question_is_retried_only_on_an_open_circuit(tmp_path, monkeypatch, fast, calls):
+    (tmp_path / "questions.jsonl").write_text(
+        json.dumps({"id": "open", "question": "열린 회로"}) + "\n" + json.dumps({"id": "bad", "question": "잘못된 요청"}) + "\n")
+    attempts = {}
+
+    async def get_answer(query, chat_history, collection_name, relevant_docs=None, fast=None):
+        attempts[query] = attempts.get(query, 0) + 1
+        if query == "잘못된 요청":
+            raise ValueError("bad request")
+        if attempts[query] == 1:
+            raise CircuitOpenError("open")
+        return "답변"
+
+    job = bulk_job(tmp_path, monkeypatch, get_answer, fast)
+    reserved = []
+    acquire = job.rate_limiter.acquire
+
+    async def record_acquire(tokens, requests=1):
+        reserved.append(requests)
+        await acquire(tokens, requests)
+
+    job.rate_limiter.acquire = record_acquire
+    summary = asyncio.run(job.run())
+
+    assert attempts == {"열린 회로": 2, "잘못된 요청": 1}
+    assert (summary["answered"], summary["failed"]) == (1, 1)
+    assert reserved == [calls] * 3
+
+
+class ScriptedChatModel(StubChatModel):
+    # answers the structured answer prompt with structured_reply and records every prompt it is sent
+    structured_reply: str = ""
+    prompts: List[str] = []
+
+    def _reply(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        self.prompts.append(prompt)
+        if '"follow_up_questions"' in prompt:
+            return self.structured_reply
+        return super()._reply(messages)
+
+
+def scripted_service(model_name, structured_reply=""):
+    service = AnswerService(model_name, llm=ScriptedChatModel(structured_reply=structured_reply))
+
+    async def prepare(*args):
+        return [], "보험금은 청구 후 3영업일 안에 지급됩니다."
+
+    service._prepare = prepare
+    return service
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('```json\n{"answer": " 3영업일 ", "follow_up_questions": ["1. 서류", " ", "2. 기한", "3. 해지"]}\n```',
+     ("3영업일", ["1. 서류", "2. 기한"])),
+    ('답변입니다: {"answer": "3영업일"}', ("3영업일", [])),
+    ('{"answer": "3영업일", "follow_up_questions": "1. 서류"}', None),
+    ('{"answer": "  ", "follow_up_questions": []}', None),
+    ('{"answer": 3영업일}', None),
+    ('{"answer": "3영업일", ', None),
+    ("3영업일 안에 지급됩니다.", None),
+])
+def test_parse_structured_answer(text, expected):
+    assert parse_structured_answer(text) == expected
+
+
+def test_unparsable_structured_answer_falls_back_to_separate_calls():
+    service = scripted_service("fallback-test", '{"answer": "3영업일 안에", "follow_up_questions": [')
+    fallbacks = ANSWER_FALLBACKS_TOTAL.value()
+
+    response = asyncio.run(service.get_answer("보험금 지급 기한", [], "default", fast=True))
+
+    assert ANSWER_FALLBACKS_TOTAL.value() == fallbacks + 1
+    # the structured call, then the answer and its follow-up questions
+    assert len(service.llm.prompts) == 3
+    assert response.startswith("문맥에 따르면") and FOLLOW_UP_HEADER in response
+
+
+def test_structured_answer_without_follow_ups_is_not_a_fallback():
+    service = scripted_service("fallback-test", '{"answer": "3영업일 안에 지급됩니다."}')
+    fallbacks = ANSWER_FALLBACKS_TOTAL.value()
+
+    assert asyncio.run(service.get_answer("보험금 지급 기한", [], "default", fast=True)) == "3영업일 안에 지급됩니다."
+    assert ANSWER_FALLBACKS_TOTAL.value() == fallbacks
+    assert len(service.llm.prompts) == 1
+
+
+HISTORY = [{"role": "user", "content": "암 보험 가입 조건을 알려주세요"},
+           {"role": "assistant", "content": "만 60세 이하라면 가입할 수 있습니다."}]
+
+
+def rewrite_service(monkeypatch):
+    monkeypatch.setattr(answer_service, "get_ko_sbert_nli_embedding", lambda: HashingEmbeddings(dimension=8))
+    answer_service.rewrite_cache.clear_cache()
+    service = AnswerService("rewrite-test", llm=ScriptedChatModel())
+    service.searched = []
+
+    async def retrieve(query, collection_name, stage="retrieval", search_filter=None):
+        service.searched.append(stage)
+        return {"status": "success", "results": [{"page_content": f"{query} 관련 문서", "metadata": {}}]}
+
+    service._retrieve = retrieve
+    return service
+
+
+def test_query_is_rewritten_only_when_there_is_history(monkeypatch):
+    service = rewrite_service(monkeypatch)
+
+    asyncio.run(service._prepare("보험금 지급 기한", [], "default", None, ""))
+    assert service.searched == ["retrieval"]
+    assert service.llm.prompts == []
+
+    _, context = asyncio.run(service._prepare("그럼 지급 기한은?", HISTORY, "default", None, ""))
+    assert service.searched[1:] == ["retrieval", "retrieval.rewritten_query"]
+    assert len(service.llm.prompts) == 1
+    # the passages found for the raw and the rewritten query both reach the context
+    assert "그럼 지급 기한은? 관련 문서" in context and context.count("관련 문서") == 2
+
+
+def test_rewrite_is_cached_per_history_and_query(monkeypatch):
+    service = rewrite_service(monkeypatch)
+    hits = CACHE_HITS_TOTAL.value(cache="query_rewrite")
+
+    async def rewrite(query, history):
+        return await service.rewrite_query(query, history, "", [])
+
+    first = asyncio.run(rewrite("그럼 지급 기한은?", HISTORY))
+    assert asyncio.run(rewrite("그럼 지급 기한은?", HISTORY)) == first
+    assert len(service.llm.prompts) == 1
+    assert CACHE_HITS_TOTAL.value(cache="query_rewrite") == hits + 1
+
+    # another question, or the same one after another exchange, is rewritten again
+    asyncio.run(rewrite("해지하면 환급금은?", HISTORY))
+    asyncio.run(rewrite("그럼 지급 기한은?", HISTORY + [{"role": "user", "content": "갱신형인가요?"}]))
+    assert len(service.llm.prompts) == 3
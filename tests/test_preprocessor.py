@@ -0,0 +1,145 @@
+import asyncio
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from app.config import settings
+from app.services import ingest_service
+from app.repositories.page_cache_repository import PageCacheRepository, file_sha256
+from app.core.preprocessors import ocr_processor
+from app.core.preprocessors.table_processor import extract_tables, outside_tables, render_markdown_table
+from app.core.preprocessors.deduplicator import ChunkDeduplicator, MinHasher, MinHashLSH, estimated_jaccard
+from app.core.retrievers.search_filter import SearchFilter
+from app.repositories.sharded_chroma_repository import open_chroma_repository
+from benchmarks.corpus import generate_corpus
+
+
+def cached_pages(file_path):
+    page_cache = PageCacheRepository(settings.PAGE_CACHE_PATH, settings.PAGE_CACHE_MAX_MB * 1024 * 1024)
+    return set(page_cache.get_pages(file_sha256(file_path), ingest_service.page_cache_variant()))
+
+
+def test_scanned_page_is_cached_only_once_ocr_read_it(stores, monkeypatch):
+    [file_path] = generate_corpus(str(stores / "pdfs"), 1, 3)
+    monkeypatch.setattr(settings, "OCR_ENABLED", True)
+    # page 1 is treated as a scanned page
+    monkeypatch.setattr(ingest_service, "text_less_pages", lambda pages: [1])
+
+    monkeypatch.setattr(ingest_service, "ocr_pages", lambda path, page_numbers: {})
+    assert len(ingest_service.load_pdf_pages(file_path)) == 3
+    assert cached_pages(file_path) == {0, 2}
+
+    monkeypatch.setattr(ingest_service, "ocr_pages",
+                        lambda path, page_numbers: {page: "스캔 본문" for page in page_numbers})
+    ingest_service.load_pdf_pages(file_path)
+    assert cached_pages(file_path) == {0, 1, 2}
+
+
+CHUNK = ("보험금 청구는 사고가 발생한 날로부터 3년 이내에 청구서와 진단서, 입원 확인서를 함께 제출해야 하며 "
+         "회사는 서류를 접수한 날부터 3영업일 이내에 보험금을 지급합니다.")
+OTHER_CHUNK = "해지 환급금은 납입한 보험료에서 사업비를 뺀 금액입니다."
+
+
+def test_minhash_estimates_similarity():
+    minhasher = MinHasher()
+    signature = minhasher.signature(CHUNK)
+
+    assert estimated_jaccard(signature, minhasher.signature("  " + CHUNK.upper() + " ")) == 1.0
+    assert estimated_jaccard(signature, minhasher.signature(CHUNK.replace("3년", "5년"))) > 0.8
+    assert estimated_jaccard(signature, minhasher.signature(OTHER_CHUNK)) < 0.2
+
+
+def test_lsh_finds_near_duplicates_only():
+    minhasher = MinHasher()
+    lsh = MinHashLSH(128, 16)
+    first = lsh.add(minhasher.signature(CHUNK))
+
+    assert lsh.query(minhasher.signature(CHUNK.replace("3년", "5년")), 0.8) == first
+    assert lsh.query(minhasher.signature(OTHER_CHUNK), 0.8) is None
+    with pytest.raises(ValueError):
+        MinHashLSH(128, 12)
+
+
+def test_deduplicator_drops_near_copied_texts():
+    deduplicator = ChunkDeduplicator()
+    chunks = [CHUNK, OTHER_CHUNK, CHUNK.replace("3년", "5년"), CHUNK]
+
+    assert deduplicator.filter_texts(chunks) == [0, 1]
+
+
+def test_deduplicator_cosine_threshold():
+    deduplicator = ChunkDeduplicator(cosine_threshold=0.98)
+    near = [1.0, 0.1, 0.0]    # cosine ~0.995 to the first vector
+    apart = [1.0, 0.3, 0.0]   # cosine ~0.958
+
+    assert deduplicator.filter_vectors([[1.0, 0.0, 0.0], near, apart]) == [0, 2]
+    # the stored collection's nearest neighbour counts with the same threshold
+    assert deduplicator.filter_vectors([[0.0, 0.0, 1.0], [0.0, 1.0, 1.0]], [0.99, 0.5]) == [1]
+
+
+def test_deduplicator_window_forgets_oldest_vectors():
+    deduplicator = ChunkDeduplicator(window_size=2)
+    basis = np.eye(4).tolist()
+
+    assert deduplicator.filter_vectors(basis[:3]) == [0, 1, 2]
+    # the first vector was evicted from the two-slot ring buffer, the third is still in it
+    assert deduplicator.filter_vectors([basis[0], basis[2]]) == [0]
+
+
+def test_ocr_runs_in_process_without_a_pool(monkeypatch):
+    monkeypatch.setattr(settings, "OCR_ENABLED", True)
+    monkeypatch.setattr(settings, "OCR_WORKERS", 0)
+    monkeypatch.setattr(settings, "OCR_BATCH_SIZE", 2)
+    monkeypatch.setattr(ocr_processor, "get_ocr_pool", lambda: pytest.fail("no OCR pool in-process"))
+    monkeypatch.setattr(ocr_processor, "ocr_page_batch",
+                        lambda file_path, pages, *options: [(page, f"page {page}", False, 0.0) for page in pages])
+
+    assert ocr_processor.ocr_pages("scan.pdf", [0, 2, 5]) == {0: "page 0", 2: "page 2", 5: "page 5"}
+
+
+def test_boilerplate_shared_by_two_files_survives_deleting_one(stores, monkeypatch):
+    bodies = {"a.pdf": "약관 a 의 고유한 본문 내용입니다.", "b.pdf": "상품 설명서 b 만 가진 보장 내용입니다."}
+
+    def vector_chunks(file_path):
+        # the shared chunk appears twice in each file; only the copy within the same file is dropped
+        file_name = file_path.rsplit("/", 1)[-1]
+        return [Document(page_content=text, metadata=ingest_service.chunk_metadata(file_path, 1, "text"))
+                for text in (CHUNK, bodies[file_name], CHUNK)]
+
+    monkeypatch.setattr(ingest_service, "create_vector_chunks", vector_chunks)
+    asyncio.run(ingest_service.process_and_store_vector(["/pdfs/a.pdf", "/pdfs/b.pdf"], "default"))
+    repository = open_chroma_repository("default")
+    assert asyncio.run(repository.delete_sources(["a.pdf"])) == 2
+
+    _, hits = asyncio.run(repository.search_with_embeddings(CHUNK, 10, SearchFilter(sources=["b.pdf"])))
+
+    assert sorted(document.page_content for document, _ in hits) == sorted([CHUNK, bodies["b.pdf"]])
+
+
+def test_render_markdown_table():
+    rows = [["구분", "지급금액", None], [], ["입원\n1일", "10|20만원"], ["수술", "", "", "비고"]]
+
+    assert render_markdown_table(rows) == "\n".join([
+        "| 구분 | 지급금액 |  |  |",
+        "| --- | --- | --- | --- |",
+        "| 입원 1일 | 10\\|20만원 |  |  |",
+        "| 수술 |  |  | 비고 |",
+    ])
+    assert render_markdown_table([[None, ""], [" "]]) is None
+    assert render_markdown_table([]) is None
+
+
+def test_table_cells_are_left_out_of_the_page_body(stores):
+    import pdfplumber
+
+    [file_path] = generate_corpus(str(stores / "pdfs"), 1, 2)
+    with pdfplumber.open(file_path) as pdf:
+        page = pdf.pages[1]
+        [(markdown_table, bbox)] = extract_tables(page)
+        body = outside_tables(page, [bbox]).extract_text()
+        full_text = page.extract_text()
+
+    assert markdown_table.startswith("| 구분 | 보장내용 | 지급금액 | 비고 |\n| --- | --- | --- | --- |\n")
+    assert "보장내용" in full_text and "보장내용" not in body
+    # the text above the table stays in the body
+    assert full_text.splitlines()[0] == body.splitlines()[0]
+    assert len(body) < len(full_text)
@@ -0,0 +1,264 @@
+import random
+import asyncio
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from app.core.retrievers import bm25_index, context_builder
+from app.core.retrievers.bm25_index import BM25Index, ShardedBM25Index
+from app.core.retrievers.search_filter import SearchFilter
+from app.core.retrievers.context_builder import ContextBuilder
+from app.core.embeddings.initializers import build_bm25_index
+from app.repositories.text_repository import TextRepository
+from app.repositories.chroma_repository import ChromaRepository
+from app.repositories.sharded_chroma_repository import ShardedChromaRepository
+from app.repositories.shard_manifest_repository import route
+from app.repositories import bm25_snapshot_repository
+from app.repositories.bm25_snapshot_repository import BM25SnapshotRepository
+
+QUERIES = ["보험금 청구 절차", "해지 환급금", "청구 서류 제출", "없는단어"]
+
+
+def make_documents(count, file_name="manual.pdf", offset=0):
+    words = ["보험금", "청구", "절차", "해지", "환급금", "서류", "제출", "약관", "보장", "기간"]
+    return [
+        Document(page_content=" ".join(words[(i * 7 + j) % len(words)] for j in range(3 + i % 5)),
+                 metadata={"source": f"/pdfs/{file_name}", "file_name": file_name, "page": 1 + i % 4,
+                           "content_type": "table" if i % 3 == 0 else "text", "chunk": offset + i})
+        for i in range(count)
+    ]
+
+
+def test_snapshot_round_trip_keeps_top_k(tmp_path):
+    index = BM25Index.from_documents(make_documents(40))
+    repository = BM25SnapshotRepository(str(tmp_path))
+    fingerprint = {"size": 1, "mtime_ns": 1}
+    repository.save("default", index, fingerprint)
+    repository.source_fingerprint = lambda collection_name: fingerprint
+
+    loaded = repository.load("default")
+
+    assert loaded is not None
+    assert loaded.corpus_size == index.corpus_size
+    assert loaded.vocabulary == index.vocabulary
+    search_filter = SearchFilter(page_from=2, content_type="table")
+    for query in QUERIES:
+        assert loaded.top_k(query, 5) == index.top_k(query, 5)
+        assert loaded.top_k(query, 5, search_filter) == index.top_k(query, 5, search_filter)
+    assert loaded.get_document(3) == index.get_document(3)
+
+
+def test_stale_snapshot_is_rebuilt(tmp_path):
+    text_repo = TextRepository(str(tmp_path))
+    text_repo.save_documents(make_documents(20), "default")
+    assert build_bm25_index("default", str(tmp_path)).corpus_size == 20
+    assert BM25SnapshotRepository(str(tmp_path)).load("default") is not None
+
+    text_repo.save_documents(make_documents(5, "other.pdf"), "default")
+
+    assert BM25SnapshotRepository(str(tmp_path)).load("default") is None
+    assert build_bm25_index("default", str(tmp_path)).corpus_size == 25
+    assert BM25SnapshotRepository(str(tmp_path)).load("default").corpus_size == 25
+
+
+def test_snapshot_of_another_version_is_ignored(tmp_path, monkeypatch):
+    TextRepository(str(tmp_path)).save_documents(make_documents(10), "default")
+    build_bm25_index("default", str(tmp_path))
+
+    monkeypatch.setattr(bm25_snapshot_repository, "SNAPSHOT_VERSION", bm25_snapshot_repository.SNAPSHOT_VERSION + 1)
+
+    assert BM25SnapshotRepository(str(tmp_path)).load("default") is None
+
+
+def test_batch_top_k_scored_in_slices_matches_single_queries(monkeypatch):
+    index = BM25Index.from_documents(make_documents(50))
+    # room for the scores of two queries at a time
+    monkeypatch.setattr(bm25_index, "BATCH_SCORES_MAX_BYTES", 2 * index.corpus_size * 8)
+    queries = QUERIES + ["보장 기간", "약관 서류"]
+
+    assert index.top_k_batch(queries, 5) == [index.top_k(query, 5) for query in queries]
+
+
+def test_route_is_stable():
+    # the shard of a file is recorded implicitly in where its chunks were written; it must never change
+    assert [route("app/database/pdfs/manual_0001.pdf", 4), route("app/database/pdfs/약관.pdf", 4),
+            route("/data/a.pdf", 4)] == [2, 0, 2]
+    assert [route("app/database/pdfs/manual_0001.pdf", 7), route("app/database/pdfs/약관.pdf", 7),
+            route("/data/a.pdf", 7)] == [4, 2, 0]
+    assert route("/data/a.pdf", 1) == 0
+
+
+def sharded_documents(shard_count):
+    rng = random.Random(7)
+    words = "보험금 청구 절차 해지 환급금 서류 제출 약관 보장 기간 납입 면책 특약 갱신 진단서".split()
+    documents = [document for index in range(8)
+                 for document in make_documents(12, f"manual_{index}.pdf", offset=index * 12)]
+    for document in documents:
+        document.page_content = " ".join(rng.choice(words) for _ in range(rng.randint(4, 12)))
+    shards = [[] for _ in range(shard_count)]
+    for document in documents:
+        shards[route(document.metadata["source"], shard_count)].append(document)
+    return documents, shards
+
+
+def test_filtered_top_k_matches_brute_force():
+    documents, _ = sharded_documents(1)
+    for document in documents[::10]:
+        del document.metadata["page"]
+    index = BM25Index.from_documents(documents)
+    index.delete_documents({"manual_3.pdf": 40})
+    rng = random.Random(11)
+    file_names = [f"manual_{number}.pdf" for number in range(9)]
+
+    def admitted(doc_id, search_filter):
+        metadata = documents[doc_id].metadata
+        page = metadata.get("page")
+        return (doc_id >= 40 or metadata["file_name"] != "manual_3.pdf") \
+            and (not search_filter.sources or metadata["file_name"] in search_filter.sources) \
+            and (search_filter.page_from is None or page is not None and page >= search_filter.page_from) \
+            and (search_filter.page_to is None or page is not None and page <= search_filter.page_to) \
+            and (not search_filter.content_type or metadata["content_type"] == search_filter.content_type)
+
+    for _ in range(200):
+        page_from = rng.choice([None, 1, 2, 3])
+        search_filter = SearchFilter(
+            sources=rng.sample(file_names, rng.randint(1, 3)) if rng.random() < 0.7 else None,
+            page_from=page_from,
+            page_to=rng.choice([None, max(page_from or 1, rng.randint(1, 4))]),
+            content_type=rng.choice([None, "text", "table"]))
+        query = rng.choice(QUERIES)
+        scores = index.get_scores(query)
+        expected = sorted((scores[doc_id] for doc_id in range(len(documents)) if admitted(doc_id, search_filter)),
+                          reverse=True)[:10]
+
+        hits = index.top_k(query, 10, search_filter)
+
+        # equal scores may come back in another order, so only the admitted ids and the scores are compared
+        assert all(admitted(doc_id, search_filter) for doc_id, _ in hits)
+        assert [score for _, score in hits] == pytest.approx(expected)
+
+
+def test_sharded_bm25_top_k_equals_unsharded():
+    # equal scores may come back in another order, so hits are compared by their score in the unsharded index
+    documents, shards = sharded_documents(3)
+    index = BM25Index.from_documents(documents)
+    sharded = ShardedBM25Index([BM25Index.from_documents(shard) for shard in shards])
+    search_filter = SearchFilter(sources=["manual_2.pdf", "manual_5.pdf"], content_type="text")
+
+    def unsharded_scores(query, hits):
+        scores = index.get_scores(query)
+        return [scores[document.metadata["chunk"]] for document in hits]
+
+    for query in QUERIES:
+        assert unsharded_scores(query, sharded.search(query, 10)) == \
+            pytest.approx([score for _, score in index.top_k(query, 10)])
+    for query, hits in zip(QUERIES, sharded.search_batch(QUERIES, 10, search_filter)):
+        assert all(document.metadata["file_name"] in search_filter.sources for document in hits)
+        assert unsharded_scores(query, hits) == pytest.approx([score for _, score in
+                                                              index.top_k(query, 10, search_filter)])
+
+
+def live_index(documents, deleted_file_names):
+    # the index of only the documents that survive a deletion, with their positions in the full list
+    live = [(doc_id, document) for doc_id, document in enumerate(documents)
+            if document.metadata["file_name"] not in deleted_file_names]
+    positions = {doc_id: position for position, (doc_id, _) in enumerate(live)}
+    return BM25Index.from_documents([document for _, document in live]), positions
+
+
+def test_deleted_documents_leave_the_statistics_of_the_live_ones():
+    documents, _ = sharded_documents(1)
+    index = BM25Index.from_documents(documents)
+    expected, positions = live_index(documents, {"manual_2.pdf", "manual_5.pdf"})
+
+    assert index.delete_documents({"manual_2.pdf": len(documents), "manual_5.pdf": len(documents)}) == 24
+
+    assert index.live_count == expected.corpus_size
+    assert index.avgdl == pytest.approx(expected.avgdl)
+    assert set(index.vocabulary) == set(expected.vocabulary)
+    assert [index.idf[index.vocabulary[term]] for term in expected.vocabulary] == pytest.approx(list(expected.idf))
+    for query in QUERIES:
+        scores = index.get_scores(query)
+        assert [scores[doc_id] for doc_id in positions] == pytest.approx(list(expected.get_scores(query)))
+        assert [score for _, score in index.top_k(query, 10)] == \
+            pytest.approx([score for _, score in expected.top_k(query, 10)])
+
+
+def test_sharded_deletion_keeps_global_statistics():
+    documents, shards = sharded_documents(3)
+    indexes = [BM25Index.from_documents(shard) for shard in shards]
+    for number, shard_index in enumerate(indexes):
+        shard_index.name = f"default-{number}"
+    sharded = ShardedBM25Index(indexes)
+    expected, positions = live_index(documents, {"manual_2.pdf", "manual_5.pdf"})
+
+    sharded.delete_documents({shard_index.name: {"manual_2.pdf": len(shard), "manual_5.pdf": len(shard)}
+                              for shard_index, shard in zip(indexes, shards)})
+
+    assert sharded.live_count == expected.corpus_size
+    for shard_index in indexes:
+        assert shard_index.avgdl == pytest.approx(expected.avgdl)
+        assert [shard_index.idf[term_id] for term_id in shard_index.vocabulary.values()] == \
+            pytest.approx([expected.idf[expected.vocabulary[term]] for term in shard_index.vocabulary])
+    for query in QUERIES:
+        scores = expected.get_scores(query)
+        hits = sharded.search(query, 10)
+        assert all(document.metadata["file_name"] not in ("manual_2.pdf", "manual_5.pdf") for document in hits)
+        assert [scores[positions[document.metadata["chunk"]]] for document in hits] == \
+            pytest.approx([score for _, score in expected.top_k(query, 10)])
+
+
+def test_sharded_chroma_top_k_equals_unsharded(stores):
+    documents, _ = sharded_documents(3)
+    flat = ChromaRepository("flat", str(stores / "chroma"))
+    sharded = ShardedChromaRepository("sharded", str(stores / "chroma"), 3)
+    embeddings = flat.ko_embedding.embed_documents([document.page_content for document in documents])
+
+    async def search():
+        await flat.add_embedded_documents(documents, embeddings)
+        await sharded.add_embedded_documents(documents, embeddings)
+        assert [shard.vectorstore._collection.count() for shard in sharded.shards] == \
+            [sum(route(document.metadata["source"], 3) == index for document in documents) for index in range(3)]
+        return [await repository.search_batch_with_embeddings(QUERIES, 10) for repository in (flat, sharded)]
+
+    (query_embeddings, flat_hits), (_, sharded_hits) = asyncio.run(search())
+    for query_embedding, expected, hits in zip(query_embeddings, flat_hits, sharded_hits):
+        def similarities(found):
+            return [float(np.dot(query_embedding, embedding)) for _, embedding in found]
+
+        assert similarities(hits) == pytest.approx(similarities(expected), abs=1e-5)
+
+
+# passages relevant to the query [1, 1, 0] in the order A > A2 > B; A2 repeats much of A, B does not
+LONG_PASSAGE = "약관 " * 8 + "보장 기간"
+PASSAGE_VECTORS = {"보험금 청구 절차 안내": [1, 0.7, 0], "보험금 청구 서류 목록": [1, 0.7, 0.5],
+                   "해지 환급금 계산 방법": [0.25, 1, 0], "보험금 청구 절차 요약": [1, 0.7, 0.05],
+                   LONG_PASSAGE: [0.6, 1, 0.3]}
+
+
+def build_context(monkeypatch, texts, max_tokens=100):
+    # one token per word, so budgets do not depend on the tokenizer
+    monkeypatch.setattr(context_builder, "count_tokens", lambda text, model_name: len(text.split()))
+    builder = ContextBuilder(embedding=None, model_name="gpt-4o-mini", max_tokens=max_tokens)
+    documents = [{"page_content": text, "metadata": {"file_name": "manual.pdf"}} for text in texts]
+    context = builder.build("보험금 청구", documents, query_embedding=[1, 1, 0],
+                            known_embeddings={text: PASSAGE_VECTORS.get(text, [0, 0, 1]) for text in texts})
+    return [passage["page_content"] for passage in context]
+
+
+def test_context_is_ordered_by_marginal_relevance(monkeypatch):
+    # B is less relevant than A2 but is picked before it, since A2 mostly repeats A
+    assert build_context(monkeypatch, ["해지 환급금 계산 방법", "보험금 청구 서류 목록", "보험금 청구 절차 안내"]) == \
+        ["보험금 청구 절차 안내", "해지 환급금 계산 방법", "보험금 청구 서류 목록"]
+
+
+def test_context_drops_exact_and_near_duplicates(monkeypatch):
+    texts = ["보험금 청구 절차 안내", " 보험금 청구 절차 안내 ", "보험금 청구 절차 요약", "해지 환급금 계산 방법"]
+    assert build_context(monkeypatch, texts) == ["보험금 청구 절차 안내", "해지 환급금 계산 방법"]
+
+
+def test_context_skips_passages_over_the_token_budget(monkeypatch):
+    texts = ["보험금 청구 절차 안내", LONG_PASSAGE, "해지 환급금 계산 방법"]
+    # the ten-word passage is picked second but does not fit after four words; the next four-word one does
+    assert build_context(monkeypatch, texts) == ["보험금 청구 절차 안내", LONG_PASSAGE, "해지 환급금 계산 방법"]
+    assert build_context(monkeypatch, texts, max_tokens=9) == ["보험금 청구 절차 안내", "해지 환급금 계산 방법"]
+    assert build_context(monkeypatch, texts, max_tokens=3) == []